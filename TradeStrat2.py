@@ -1,164 +1,224 @@
-from ib_async import *
-import asyncio
-import logging
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
-class MACDStrategy:
-    def __init__(self, fast_period=12, slow_period=26, signal_period=9):
-        self.fast_period = fast_period
-        self.slow_period = slow_period
-        self.signal_period = signal_period
-        
-    def calculate_macd(self, prices):
-        """Calculate MACD and Signal line"""
-        price_series = pd.Series(prices)
-        
-        # Calculate EMAs
-        fast_ema = price_series.ewm(span=self.fast_period, adjust=False).mean()
-        slow_ema = price_series.ewm(span=self.slow_period, adjust=False).mean()
-        
-        # Calculate MACD line
-        macd_line = fast_ema - slow_ema
-        
-        # Calculate Signal line
-        signal_line = macd_line.ewm(span=self.signal_period, adjust=False).mean()
-        
-        # Calculate MACD histogram
-        macd_histogram = macd_line - signal_line
-        
-        return {
-            'macd_line': macd_line.iloc[-1],
-            'signal_line': signal_line.iloc[-1],
-            'histogram': macd_histogram.iloc[-1],
-            'prev_histogram': macd_histogram.iloc[-2] if len(macd_histogram) > 1 else 0
-        }
-
-async def get_historical_data(ib, contract, duration='3 M', bar_size='1 day'):
-    """Get historical data for MACD calculation"""
-    bars = await ib.reqHistoricalDataAsync(
-        contract,
-        endDateTime='',
-        durationStr=duration,
-        barSizeSetting=bar_size,
-        whatToShow='TRADES',
-        useRTH=True,
-        formatDate=1
-    )
-    return [bar.close for bar in bars]
-
-async def get_current_position(ib, symbol):
-    """Get current position for a symbol"""
-    portfolio = ib.portfolio()
-    for item in portfolio:
-        if item.contract.symbol == symbol:
-            return item.position
-    return 0
-
-async def place_order(ib, contract, action, quantity):
-    """Place and monitor an order"""
-    order = MarketOrder(action, quantity)
-    trade = ib.placeOrder(contract, order)
-    logger.info(f"{action} order placed for {quantity} shares")
-    
-    # Wait for order to fill
-    while not trade.isDone():
-        await asyncio.sleep(1)
-    
-    if trade.orderStatus.status == 'Filled':
-        logger.info(f"Order filled at average price: {trade.orderStatus.avgFillPrice}")
-        return True
-    else:
-        logger.error(f"Order failed with status: {trade.orderStatus.status}")
-        return False
-
-async def main():
-    ib = IB()
-    try:
-        # Connect to IB
-        await ib.connectAsync('127.0.0.1', 7497, clientId=123)
-        logger.info("Connected to IB")
-
-        # Initialize strategy
-        macd_strategy = MACDStrategy()
-        symbol = 'AAPL'  # Trading Apple stock
-        
-        # Define stock contract
-        stock = Stock(symbol, 'SMART', 'USD')
-        await ib.qualifyContractsAsync(stock)
-        logger.info(f"{symbol} contract qualified")
-
-        while True:  # Continuous monitoring loop
-            try:
-                # Get current market data
-                ticker = ib.reqMktData(stock, '', False, False)
-                await asyncio.sleep(2)  # Wait for market data
-                current_price = ticker.last if ticker.last else ticker.close
-                
-                if current_price is None:
-                    logger.error(f"Could not fetch current price for {symbol}")
-                    continue
-                
-                logger.info(f"Current {symbol} price: {current_price}")
-
-                # Get historical data and calculate MACD
-                historical_prices = await get_historical_data(ib, stock)
-                macd_data = macd_strategy.calculate_macd(historical_prices)
-                
-                logger.info(f"MACD Line: {macd_data['macd_line']:.2f}")
-                logger.info(f"Signal Line: {macd_data['signal_line']:.2f}")
-                logger.info(f"Histogram: {macd_data['histogram']:.2f}")
-
-                # Get current position
-                position = await get_current_position(ib, symbol)
-                
-                # Trading logic
-                # Buy signal: MACD line crosses above Signal line (histogram turns positive)
-                # Sell signal: MACD line crosses below Signal line (histogram turns negative)
-                
-                # Calculate position size (example: investing 5% of account equity)
-                account = await ib.accountSummaryAsync()
-                equity = float([v.value for v in account if v.tag == 'NetLiquidation'][0])
-                max_position = int((equity * 0.05) / current_price)  # 5% of account
-
-                if macd_data['histogram'] > 0 and macd_data['prev_histogram'] <= 0:  # Bullish crossover
-                    if position <= 0:  # No existing long position
-                        shares_to_buy = max_position
-                        if shares_to_buy > 0:
-                            success = await place_order(ib, stock, 'BUY', shares_to_buy)
-                            if success:
-                                logger.info(f"Successfully bought {shares_to_buy} shares of {symbol}")
-                        else:
-                            logger.info("Insufficient funds to place order")
-                    else:
-                        logger.info(f"Already holding {symbol} position")
-
-                elif macd_data['histogram'] < 0 and macd_data['prev_histogram'] >= 0:  # Bearish crossover
-                    if position > 0:  # Existing long position
-                        success = await place_order(ib, stock, 'SELL', position)
-                        if success:
-                            logger.info(f"Successfully sold {position} shares of {symbol}")
-                    else:
-                        logger.info("No position to sell")
-
-                # Wait before next check (e.g., check every 5 minutes)
-                await asyncio.sleep(300)  # 5 minutes
-
-            except Exception as e:
-                logger.error(f"Error in trading loop: {e}")
-                await asyncio.sleep(60)  # Wait a minute before retrying
-
-    except Exception as e:
-        logger.error(f"Fatal error occurred: {e}")
-    finally:
-        if ib.isConnected():
-            ib.disconnect()
-            logger.info("Disconnected from IB")
-
-if __name__ == "__main__":
-    asyncio.run(main())
+from ib_async import *
+import asyncio
+import logging
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+from barcache import to_epoch
+from context import TradingContext
+from indicators import MACD
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class MACDStrategy:
+    def __init__(self, fast_period=12, slow_period=26, signal_period=9):
+        self.fast_period = fast_period
+        self.slow_period = slow_period
+        self.signal_period = signal_period
+        # Streaming MACD state, seeded once and then fed only new bars
+        self.macd = MACD(fast_period, slow_period, signal_period)
+        self.last_bar_date = None
+        
+    def calculate_macd(self, prices):
+        """Calculate MACD and Signal line over a full price history"""
+        return MACD(self.fast_period, self.slow_period, self.signal_period).seed(prices)
+
+    def update(self, bars):
+        """
+        Update MACD from historical bars, feeding only bars newer than the last one seen.
+        The last bar is still forming, so it is previewed rather than committed.
+        """
+        if not len(bars):
+            return self.macd.snapshot()
+        if self.last_bar_date is not None and self.last_bar_date < bars.date[0]:
+            # Restored state is older than this history; the bars between are missing
+            self.macd = MACD(self.fast_period, self.slow_period, self.signal_period)
+            self.last_bar_date = None
+        start = 0
+        if self.last_bar_date is not None:
+            start = np.searchsorted(bars.date, self.last_bar_date, side='right')
+        for close in bars.close[start:-1]:
+            self.macd.update(close)
+        if start < len(bars) - 1:
+            self.last_bar_date = bars.date[-2]
+        return self.macd.preview(bars.close[-1])
+
+    def add_bar(self, bar):
+        """Commit a closed bar from a live bar subscription"""
+        date = to_epoch(bar.date)
+        if self.last_bar_date is None or date > self.last_bar_date:
+            self.macd.update(bar.close)
+            self.last_bar_date = date
+
+    def preview(self, price):
+        """MACD with the forming bar at the current price"""
+        return self.macd.preview(price)
+
+    def covers(self, bars):
+        """True if the committed state reaches the first of `bars`, so they alone bring it up to date"""
+        return self.last_bar_date is not None and len(bars) > 0 and self.last_bar_date >= to_epoch(bars[0].date)
+
+    def state(self):
+        """MACD state and last committed bar, for checkpoints"""
+        return {
+            'macd': self.macd.state(),
+            'last_bar_date': None if self.last_bar_date is None else int(self.last_bar_date)
+        }
+
+    def restore(self, state):
+        self.macd.restore(state['macd'])
+        self.last_bar_date = state['last_bar_date']
+
+def checkpoint_key(symbol, fast_period=12, slow_period=26, signal_period=9):
+    return f"macd {symbol} {fast_period}/{slow_period}/{signal_period}"
+
+async def get_historical_data(ib, contract, store, duration='3 M', bar_size='1 day'):
+    """Get historical data for MACD calculation, refreshing only bars missing from the local cache"""
+    bars = await store.get(ib, contract, duration, bar_size, what_to_show='TRADES', use_rth=True)
+    return bars
+
+async def place_order(orders, contract, action, quantity, reference_price=None, trace=None):
+    """Place an order and wait for it to complete"""
+    if trace is not None:
+        trace.mark('signal')
+    order = MarketOrder(action, quantity)
+    logger.info(f"{action} order placed for {quantity} shares")
+
+    # Wait on the trade's status events until it is filled, cancelled or times out
+    result = await orders.place(contract, order, reference_price=reference_price, trace=trace)
+    if result['status'] == 'Filled':
+        logger.info(f"Order filled at average price: {result['avg_fill_price']}" +
+                    (f" (slippage {result['slippage']:.4f})" if result['slippage'] is not None else ""))
+        return True
+    else:
+        logger.error(f"Order failed with status: {result['status']}")
+        return False
+
+async def evaluate(ctx, stock, symbol, macd_data, current_price, trace=None):
+    """Run the MACD trading rules against the latest price"""
+    logger.debug(f"Current {symbol} price: {current_price}")
+    logger.debug(f"MACD Line: {macd_data['macd_line']:.2f}")
+    logger.debug(f"Signal Line: {macd_data['signal_line']:.2f}")
+    logger.debug(f"Histogram: {macd_data['histogram']:.2f}")
+
+    # Get current position
+    position = ctx.account.position(stock)
+    
+    # Trading logic
+    # Buy signal: MACD line crosses above Signal line (histogram turns positive)
+    # Sell signal: MACD line crosses below Signal line (histogram turns negative)
+    if macd_data['histogram'] > 0 and macd_data['prev_histogram'] <= 0:  # Bullish crossover
+        if position <= 0:  # No existing long position
+            # Calculate position size (example: investing 5% of account equity)
+            equity = ctx.account.equity or 0
+            shares_to_buy = int((equity * 0.05) / current_price)  # 5% of account
+            if shares_to_buy > 0:
+                success = await place_order(ctx.orders, stock, 'BUY', shares_to_buy, reference_price=current_price, trace=trace)
+                if success:
+                    logger.info(f"Successfully bought {shares_to_buy} shares of {symbol}")
+            else:
+                logger.info("Insufficient funds to place order")
+        else:
+            logger.debug(f"Already holding {symbol} position")
+
+    elif macd_data['histogram'] < 0 and macd_data['prev_histogram'] >= 0:  # Bearish crossover
+        if position > 0:  # Existing long position
+            success = await place_order(ctx.orders, stock, 'SELL', position, reference_price=current_price, trace=trace)
+            if success:
+                logger.info(f"Successfully sold {position} shares of {symbol}")
+        else:
+            logger.debug("No position to sell")
+
+async def run(ctx, stock, fast_period=12, slow_period=26, signal_period=9):
+    """Trade one qualified contract with the MACD strategy until cancelled"""
+    ib = ctx.ib
+    symbol = stock.symbol
+    macd_strategy = MACDStrategy(fast_period, slow_period, signal_period)
+    checkpoint = checkpoint_key(symbol, fast_period, slow_period, signal_period)
+    busy = asyncio.Lock()
+    ticker = live_bars = None
+    ready = False
+
+    async def on_update(_):
+        # Skip updates that arrive while a previous evaluation (and its order) is running
+        if busy.locked():
+            return
+        async with busy:
+            try:
+                trace = ctx.latency.trace('macd', symbol)
+                current_price = ticker.last if ticker.last else ticker.close
+                if current_price is None or util.isNan(current_price):
+                    return
+                macd_data = macd_strategy.preview(current_price)
+                if trace is not None:
+                    trace.mark('indicator')
+                await evaluate(ctx, stock, symbol, macd_data, current_price, trace)
+            except Exception as e:
+                logger.error(f"Error in {symbol} trading loop: {e}")
+
+    def on_bar(bars):
+        # Bars closing during startup are committed by the catch-up below
+        if not ready:
+            return None
+        # bars[-2] just closed; commit it even if an evaluation is running
+        if len(bars) > 1:
+            macd_strategy.add_bar(bars[-2])
+        return on_update(bars)
+
+    try:
+        async with ctx.startup:
+            # Resume from the last checkpoint
+            state = ctx.checkpoints.get(checkpoint)
+            if state is not None:
+                macd_strategy.restore(state)
+
+            # Evaluate on every tick and on every daily bar close, built locally from the ticks
+            live_bars = await ctx.subscriptions.local_bars(stock, '2 D', '1 day', on_bar=on_bar)
+            if not macd_strategy.covers(live_bars):
+                # No checkpoint, or one older than the live bars: seed from the bar cache
+                macd_strategy.update(await get_historical_data(ib, stock, ctx.store))
+            for bar in live_bars[:-1]:
+                macd_strategy.add_bar(bar)
+            ready = True
+            ctx.checkpoints.register(checkpoint, macd_strategy.state)
+            ticker = ctx.subscriptions.market_data(stock, on_tick=on_update)
+            logger.info(f"MACD strategy running for {symbol}")
+
+        # Run until cancelled or the context stops
+        await ctx.stopped()
+    finally:
+        ctx.checkpoints.unregister(checkpoint)
+        if live_bars is not None:
+            ctx.subscriptions.release_local_bars(stock, '1 day', on_bar=on_bar)
+        if ticker is not None:
+            ctx.subscriptions.release_market_data(stock, on_tick=on_update)
+
+async def main():
+    ib = IB()
+    ctx = TradingContext(ib)
+    try:
+        # Connect to IB, reconnecting and resyncing if the connection drops
+        await ctx.connect('127.0.0.1', 7497, client_ids=(123, 124, 125))
+        await ctx.start()
+        ctx.checkpoints.start()
+
+        symbol = 'AAPL'  # Trading Apple stock
+        
+        # Define stock contract
+        stock, = await ctx.qualify(Stock(symbol, 'SMART', 'USD'))
+        logger.info(f"{symbol} contract qualified")
+
+        await run(ctx, stock)
+
+    except Exception as e:
+        logger.error(f"Fatal error occurred: {e}")
+    finally:
+        ctx.close()
+        if ib.isConnected():
+            ib.disconnect()
+            logger.info("Disconnected from IB")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,210 +1,296 @@
-from ib_async import *
-import asyncio
-import logging
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
-class DonchianStrategy:
-    def __init__(self, period=20):
-        """
-        Initialize Donchian Channel Strategy
-        period: Number of periods for channel calculation (default 20 periods = 100 minutes)
-        """
-        self.period = period
-        
-    def calculate_channels(self, highs, lows):
-        """Calculate Donchian Channels"""
-        upper_channel = pd.Series(highs).rolling(window=self.period).max().iloc[-1]
-        lower_channel = pd.Series(lows).rolling(window=self.period).min().iloc[-1]
-        middle_channel = (upper_channel + lower_channel) / 2
-        
-        return {
-            'upper': upper_channel,
-            'lower': lower_channel,
-            'middle': middle_channel,
-            'prev_upper': pd.Series(highs).rolling(window=self.period).max().iloc[-2],
-            'prev_lower': pd.Series(lows).rolling(window=self.period).max().iloc[-2]
-        }
-
-async def get_historical_data(ib, contract, duration='2 D', bar_size='5 mins'):
-    """Get historical 5-minute bar data"""
-    bars = await ib.reqHistoricalDataAsync(
-        contract,
-        endDateTime='',
-        durationStr=duration,
-        barSizeSetting=bar_size,
-        whatToShow='TRADES',
-        useRTH=True,
-        formatDate=1
-    )
-    return {
-        'highs': [bar.high for bar in bars],
-        'lows': [bar.low for bar in bars],
-        'closes': [bar.close for bar in bars]
-    }
-
-async def get_current_position(ib, symbol):
-    """Get current position for a symbol"""
-    portfolio = ib.portfolio()
-    for item in portfolio:
-        if item.contract.symbol == symbol:
-            return item.position
-    return 0
-
-async def place_order(ib, contract, action, quantity, order_type='MKT', stop_price=None):
-    """Place and monitor an order"""
-    if order_type == 'MKT':
-        order = MarketOrder(action, quantity)
-    elif order_type == 'STP':
-        order = StopOrder(action, quantity, stop_price)
-    
-    trade = ib.placeOrder(contract, order)
-    logger.info(f"{action} {order_type} order placed for {quantity} shares" + 
-                (f" at {stop_price}" if stop_price else ""))
-    
-    # Wait for order to fill
-    while not trade.isDone():
-        await asyncio.sleep(1)
-    
-    if trade.orderStatus.status == 'Filled':
-        logger.info(f"Order filled at average price: {trade.orderStatus.avgFillPrice}")
-        return True
-    else:
-        logger.error(f"Order failed with status: {trade.orderStatus.status}")
-        return False
-
-async def main():
-    ib = IB()
-    try:
-        # Connect to IB
-        await ib.connectAsync('127.0.0.1', 7497, clientId=123)
-        logger.info("Connected to IB")
-
-        # Initialize strategy
-        donchian_strategy = DonchianStrategy(period=20)  # 20 periods = 100 minutes
-        symbol = 'MSFT'  # Trading Microsoft stock
-        
-        # Define stock contract
-        stock = Stock(symbol, 'SMART', 'USD')
-        await ib.qualifyContractsAsync(stock)
-        logger.info(f"{symbol} contract qualified")
-
-        # Trading state variables
-        entry_price = None
-        stop_loss = None
-
-        while True:  # Continuous monitoring loop
-            try:
-                # Get current market data
-                ticker = ib.reqMktData(stock, '', False, False)
-                await asyncio.sleep(2)  # Wait for market data
-                current_price = ticker.last if ticker.last else ticker.close
-                
-                if current_price is None:
-                    logger.error(f"Could not fetch current price for {symbol}")
-                    continue
-                
-                logger.info(f"Current {symbol} price: {current_price}")
-
-                # Get historical data and calculate Donchian Channels
-                historical_data = await get_historical_data(ib, stock)
-                channels = donchian_strategy.calculate_channels(
-                    historical_data['highs'],
-                    historical_data['lows']
-                )
-                
-                logger.info(f"Upper Channel: {channels['upper']:.2f}")
-                logger.info(f"Middle Channel: {channels['middle']:.2f}")
-                logger.info(f"Lower Channel: {channels['lower']:.2f}")
-
-                # Get current position
-                position = await get_current_position(ib, symbol)
-                
-                # Calculate position size (example: investing 5% of account equity)
-                account = await ib.accountSummaryAsync()
-                equity = float([v.value for v in account if v.tag == 'NetLiquidation'][0])
-                max_position = int((equity * 0.05) / current_price)  # 5% of account
-
-                # Trading logic
-                if position == 0:  # No position, look for entry
-                    # Breakout strategy
-                    if current_price > channels['upper']:  # Bullish breakout
-                        # Enter long position
-                        shares_to_buy = max_position
-                        if shares_to_buy > 0:
-                            success = await place_order(ib, stock, 'BUY', shares_to_buy)
-                            if success:
-                                entry_price = current_price
-                                # Set stop loss at lower channel
-                                stop_loss = channels['lower']
-                                logger.info(f"Long position entered at {entry_price:.2f}")
-                                logger.info(f"Stop loss set at {stop_loss:.2f}")
-                        else:
-                            logger.info("Insufficient funds to place order")
-                            
-                    elif current_price < channels['lower']:  # Bearish breakout
-                        # Enter short position
-                        shares_to_short = max_position
-                        if shares_to_short > 0:
-                            success = await place_order(ib, stock, 'SELL', shares_to_short)
-                            if success:
-                                entry_price = current_price
-                                # Set stop loss at upper channel
-                                stop_loss = channels['upper']
-                                logger.info(f"Short position entered at {entry_price:.2f}")
-                                logger.info(f"Stop loss set at {stop_loss:.2f}")
-                        else:
-                            logger.info("Insufficient funds to place order")
-
-                else:  # Managing existing position
-                    if position > 0:  # Long position
-                        # Update trailing stop to lower channel
-                        new_stop = channels['lower']
-                        if new_stop > stop_loss:  # Trail stop only upward
-                            stop_loss = new_stop
-                            logger.info(f"Updated trailing stop to {stop_loss:.2f}")
-                        
-                        # Check if stop loss is hit
-                        if current_price < stop_loss:
-                            success = await place_order(ib, stock, 'SELL', position)
-                            if success:
-                                logger.info(f"Long position closed at {current_price:.2f}")
-                                entry_price = None
-                                stop_loss = None
-                                
-                    else:  # Short position
-                        # Update trailing stop to upper channel
-                        new_stop = channels['upper']
-                        if new_stop < stop_loss:  # Trail stop only downward
-                            stop_loss = new_stop
-                            logger.info(f"Updated trailing stop to {stop_loss:.2f}")
-                        
-                        # Check if stop loss is hit
-                        if current_price > stop_loss:
-                            success = await place_order(ib, stock, 'BUY', abs(position))
-                            if success:
-                                logger.info(f"Short position closed at {current_price:.2f}")
-                                entry_price = None
-                                stop_loss = None
-
-                # Wait before next check (5-minute interval)
-                await asyncio.sleep(300)  # 5 minutes
-
-            except Exception as e:
-                logger.error(f"Error in trading loop: {e}")
-                await asyncio.sleep(60)  # Wait a minute before retrying
-
-    except Exception as e:
-        logger.error(f"Fatal error occurred: {e}")
-    finally:
-        if ib.isConnected():
-            ib.disconnect()
-            logger.info("Disconnected from IB")
-
-if __name__ == "__main__":
-    asyncio.run(main())
+from ib_async import *
+import asyncio
+import logging
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+from barcache import to_epoch
+from context import TradingContext
+from indicators import Donchian
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class DonchianStrategy:
+    def __init__(self, period=20):
+        """
+        Initialize Donchian Channel Strategy
+        period: Number of periods for channel calculation (default 20 periods = 100 minutes)
+        """
+        self.period = period
+        # Streaming channel state, seeded once and then fed only new bars
+        self.channels = Donchian(period)
+        self.last_bar_date = None
+        # Trading state
+        self.entry_price = None
+        self.stop_loss = None
+        
+    def calculate_channels(self, highs, lows):
+        """Calculate Donchian Channels over a full high/low history"""
+        return Donchian(self.period).seed(highs, lows)
+
+    def update(self, bars):
+        """
+        Update channels from historical bars, feeding only bars newer than the last one seen.
+        The last bar is still forming, so it is previewed rather than committed.
+        """
+        if not len(bars):
+            return self.channels.snapshot()
+        if self.last_bar_date is not None and self.last_bar_date < bars.date[0]:
+            # Restored state is older than this history; the bars between are missing
+            self.channels = Donchian(self.period)
+            self.last_bar_date = None
+        start = 0
+        if self.last_bar_date is not None:
+            start = np.searchsorted(bars.date, self.last_bar_date, side='right')
+        for high, low in zip(bars.high[start:-1], bars.low[start:-1]):
+            self.channels.update(high, low)
+        if start < len(bars) - 1:
+            self.last_bar_date = bars.date[-2]
+        return self.channels.preview(bars.high[-1], bars.low[-1])
+
+    def add_bar(self, bar):
+        """Commit a closed bar from a live bar subscription"""
+        date = to_epoch(bar.date)
+        if self.last_bar_date is None or date > self.last_bar_date:
+            self.channels.update(bar.high, bar.low)
+            self.last_bar_date = date
+
+    def closed_channels(self):
+        """
+        Channels of the closed bars, which a breakout has to clear. The forming bar
+        already holds the current price, so channels including it are never broken.
+        """
+        return self.channels.snapshot()
+
+    def covers(self, bars):
+        """True if the committed state reaches the first of `bars`, so they alone bring it up to date"""
+        return self.last_bar_date is not None and len(bars) > 0 and self.last_bar_date >= to_epoch(bars[0].date)
+
+    def state(self):
+        """Channel state, last committed bar and trailing stop, for checkpoints"""
+        return {
+            'channels': self.channels.state(),
+            'last_bar_date': None if self.last_bar_date is None else int(self.last_bar_date),
+            'entry_price': self.entry_price,
+            'stop_loss': self.stop_loss
+        }
+
+    def restore(self, state):
+        self.channels.restore(state['channels'])
+        self.last_bar_date = state['last_bar_date']
+        self.entry_price = state['entry_price']
+        self.stop_loss = state['stop_loss']
+
+    def exited(self, result):
+        """The stop engine's exit filled: the position is closed"""
+        logger.info(f"Position closed by trailing stop at {result['avg_fill_price']:.2f}")
+        self.entry_price = None
+        self.stop_loss = None
+
+def checkpoint_key(symbol, period=20):
+    return f"donchian {symbol} {period}"
+
+async def get_historical_data(ib, contract, store, duration='2 D', bar_size='5 mins'):
+    """Get historical 5-minute bar data, refreshing only bars missing from the local cache"""
+    bars = await store.get(ib, contract, duration, bar_size, what_to_show='TRADES', use_rth=True)
+    return bars
+
+def get_max_position(account, current_price):
+    """Calculate position size (example: investing 5% of account equity)"""
+    equity = account.equity or 0
+    return int((equity * 0.05) / current_price)  # 5% of account
+
+async def place_order(orders, contract, action, quantity, order_type='MKT', stop_price=None, reference_price=None, trace=None):
+    """Place an order and wait for it to complete"""
+    if trace is not None:
+        trace.mark('signal')
+    if order_type == 'MKT':
+        order = MarketOrder(action, quantity)
+    elif order_type == 'STP':
+        order = StopOrder(action, quantity, stop_price)
+
+    logger.info(f"{action} {order_type} order placed for {quantity} shares" +
+                (f" at {stop_price}" if stop_price else ""))
+
+    # Wait on the trade's status events until it is filled, cancelled or times out
+    result = await orders.place(contract, order, reference_price=reference_price, trace=trace)
+    if result['status'] == 'Filled':
+        logger.info(f"Order filled at average price: {result['avg_fill_price']}" +
+                    (f" (slippage {result['slippage']:.4f})" if result['slippage'] is not None else ""))
+        return True
+    else:
+        logger.error(f"Order failed with status: {result['status']}")
+        return False
+
+async def evaluate(ctx, stock, symbol, donchian_strategy, channels, current_price, trace=None):
+    """Run the Donchian breakout and trailing stop rules against the latest price"""
+    logger.debug(f"Current {symbol} price: {current_price}")
+    logger.debug(f"Upper Channel: {channels['upper']:.2f}")
+    logger.debug(f"Middle Channel: {channels['middle']:.2f}")
+    logger.debug(f"Lower Channel: {channels['lower']:.2f}")
+
+    # Get current position
+    position = ctx.account.position(stock)
+    
+    # Trading logic
+    if position == 0:  # No position, look for entry
+        # Breakout strategy
+        if current_price > channels['upper']:  # Bullish breakout
+            # Enter long position
+            shares_to_buy = get_max_position(ctx.account, current_price)
+            if shares_to_buy > 0:
+                success = await place_order(ctx.orders, stock, 'BUY', shares_to_buy, reference_price=current_price, trace=trace)
+                if success:
+                    donchian_strategy.entry_price = current_price
+                    # Set stop loss at lower channel
+                    donchian_strategy.stop_loss = channels['lower']
+                    logger.info(f"Long position entered at {donchian_strategy.entry_price:.2f}")
+                    logger.info(f"Stop loss set at {donchian_strategy.stop_loss:.2f}")
+                    protect(ctx, stock, donchian_strategy, 'SELL', shares_to_buy)
+            else:
+                logger.info("Insufficient funds to place order")
+
+        elif current_price < channels['lower']:  # Bearish breakout
+            # Enter short position
+            shares_to_short = get_max_position(ctx.account, current_price)
+            if shares_to_short > 0:
+                success = await place_order(ctx.orders, stock, 'SELL', shares_to_short, reference_price=current_price, trace=trace)
+                if success:
+                    donchian_strategy.entry_price = current_price
+                    # Set stop loss at upper channel
+                    donchian_strategy.stop_loss = channels['upper']
+                    logger.info(f"Short position entered at {donchian_strategy.entry_price:.2f}")
+                    logger.info(f"Stop loss set at {donchian_strategy.stop_loss:.2f}")
+                    protect(ctx, stock, donchian_strategy, 'BUY', shares_to_short)
+            else:
+                logger.info("Insufficient funds to place order")
+
+    else:  # Managing existing position
+        # The stop engine exits on the first tick through the stop; here the stop only trails
+        if position > 0:  # Long position
+            # Update trailing stop to lower channel
+            new_stop = channels['lower']
+            # A position without a stop (e.g. opened before a restart with no checkpoint) starts at the channel
+            if donchian_strategy.stop_loss is None or new_stop > donchian_strategy.stop_loss:  # Trail stop only upward
+                donchian_strategy.stop_loss = new_stop
+                logger.info(f"Updated trailing stop to {donchian_strategy.stop_loss:.2f}")
+            protect(ctx, stock, donchian_strategy, 'SELL', position)
+
+        else:  # Short position
+            # Update trailing stop to upper channel
+            new_stop = channels['upper']
+            if donchian_strategy.stop_loss is None or new_stop < donchian_strategy.stop_loss:  # Trail stop only downward
+                donchian_strategy.stop_loss = new_stop
+                logger.info(f"Updated trailing stop to {donchian_strategy.stop_loss:.2f}")
+            protect(ctx, stock, donchian_strategy, 'BUY', abs(position))
+        ctx.stops.check(stock.conId, current_price, current_price)
+
+def protect(ctx, stock, donchian_strategy, action, quantity):
+    """Keep the stop engine's exit in line with the position and the trailing stop"""
+    key = checkpoint_key(stock.symbol, donchian_strategy.period)
+    stop = ctx.stops.get(key)
+    if stop is None or stop.action != action or stop.quantity != quantity:
+        ctx.stops.set(key, stock, action, quantity, donchian_strategy.stop_loss, on_exit=donchian_strategy.exited)
+    else:
+        ctx.stops.trail(key, donchian_strategy.stop_loss)
+
+async def run(ctx, stock, period=20):
+    """Trade one qualified contract with the Donchian strategy until cancelled"""
+    ib = ctx.ib
+    symbol = stock.symbol
+    donchian_strategy = DonchianStrategy(period=period)
+    checkpoint = checkpoint_key(symbol, period)
+    busy = asyncio.Lock()
+    ticker = live_bars = None
+    ready = False
+
+    async def on_update(_):
+        # Skip updates that arrive while a previous evaluation (and its order) is running
+        if busy.locked():
+            return
+        async with busy:
+            try:
+                trace = ctx.latency.trace('donchian', symbol)
+                current_price = ticker.last if ticker.last else ticker.close
+                if current_price is None or util.isNan(current_price):
+                    return
+                channels = donchian_strategy.closed_channels()
+                if trace is not None:
+                    trace.mark('indicator')
+                await evaluate(ctx, stock, symbol, donchian_strategy, channels, current_price, trace)
+            except Exception as e:
+                logger.error(f"Error in {symbol} trading loop: {e}")
+
+    def on_bar(bars):
+        # Bars closing during startup are committed by the catch-up below
+        if not ready:
+            return None
+        # bars[-2] just closed; commit it even if an evaluation is running
+        if len(bars) > 1:
+            donchian_strategy.add_bar(bars[-2])
+        return on_update(bars)
+
+    try:
+        async with ctx.startup:
+            # Resume from the last checkpoint, including the trailing stop
+            state = ctx.checkpoints.get(checkpoint)
+            if state is not None:
+                donchian_strategy.restore(state)
+
+            # Evaluate on every tick and on every 5-minute bar close, built locally from the ticks
+            live_bars = await ctx.subscriptions.local_bars(stock, '2 D', '5 mins', on_bar=on_bar)
+            if not donchian_strategy.covers(live_bars):
+                # No checkpoint, or one older than the live bars: seed from the bar cache
+                donchian_strategy.update(await get_historical_data(ib, stock, ctx.store))
+            for bar in live_bars[:-1]:
+                donchian_strategy.add_bar(bar)
+            ready = True
+            ctx.checkpoints.register(checkpoint, donchian_strategy.state)
+            # Stops are checked on every tick, even while an evaluation is running
+            ctx.stops.watch(ctx.subscriptions, stock)
+            position = ctx.account.position(stock)
+            if position and donchian_strategy.stop_loss is not None:
+                protect(ctx, stock, donchian_strategy, 'SELL' if position > 0 else 'BUY', abs(position))
+            ticker = ctx.subscriptions.market_data(stock, on_tick=on_update)
+            logger.info(f"Donchian strategy running for {symbol}")
+
+        # Run until cancelled or the context stops
+        await ctx.stopped()
+    finally:
+        ctx.checkpoints.unregister(checkpoint)
+        if ready:
+            ctx.stops.unwatch(stock)
+        if live_bars is not None:
+            ctx.subscriptions.release_local_bars(stock, '5 mins', on_bar=on_bar)
+        if ticker is not None:
+            ctx.subscriptions.release_market_data(stock, on_tick=on_update)
+
+async def main():
+    ib = IB()
+    ctx = TradingContext(ib)
+    try:
+        # Connect to IB, reconnecting and resyncing if the connection drops
+        await ctx.connect('127.0.0.1', 7497, client_ids=(123, 124, 125))
+        await ctx.start()
+        ctx.checkpoints.start()
+
+        symbol = 'MSFT'  # Trading Microsoft stock
+        
+        # Define stock contract
+        stock, = await ctx.qualify(Stock(symbol, 'SMART', 'USD'))
+        logger.info(f"{symbol} contract qualified")
+
+        await run(ctx, stock, period=20)  # 20 periods = 100 minutes
+
+    except Exception as e:
+        logger.error(f"Fatal error occurred: {e}")
+    finally:
+        ctx.close()
+        if ib.isConnected():
+            ib.disconnect()
+            logger.info("Disconnected from IB")
+
+if __name__ == "__main__":
+    asyncio.run(main())
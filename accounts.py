@@ -0,0 +1,120 @@
+import logging
+from ib_async import Position
+
+logger = logging.getLogger(__name__)
+
+class AccountState:
+    def __init__(self, ib, account=''):
+        """
+        In-memory account and position state kept current by IB's account, portfolio
+        and position update streams, so strategies read it without a round trip.
+        Fills of our own orders move the position as soon as they arrive; the position
+        stream, which can lag behind the order's Filled status, confirms them later.
+        Positions are indexed by conId, so a stock and its options never mix.
+        account: account code to follow; '' follows every account on the connection.
+        """
+        self.ib = ib
+        self.account = account
+        self.positions = {}  # conId -> Position
+        self.portfolio = {}  # conId -> PortfolioItem
+        self.values = {}  # tag -> float
+        self.started = False
+
+    async def start(self):
+        """Subscribe to the update streams and load the current state"""
+        if self.started:
+            return
+        self.ib.positionEvent += self.on_position
+        self.ib.updatePortfolioEvent += self.on_portfolio
+        self.ib.accountValueEvent += self.on_account_value
+        self.ib.execDetailsEvent += self.on_fill
+        await self.load()
+        self.started = True
+        logger.info(f"Account state: {len(self.positions)} positions, equity {self.equity}")
+
+    async def load(self, replace=False):
+        # ib_async subscribes to positions and, with a single account, account updates
+        # when it connects; ask for account updates only if none have arrived
+        if not self.ib.accountValues(self.account):
+            await self.ib.reqAccountUpdatesAsync(self.account)
+        if replace:
+            self.positions.clear()
+            self.portfolio.clear()
+        for position in self.ib.positions(self.account):
+            self.on_position(position)
+        for item in self.ib.portfolio(self.account):
+            self.on_portfolio(item)
+        for value in self.ib.accountValues(self.account):
+            self.on_account_value(value)
+
+    async def resync(self):
+        """Reload after a reconnect, dropping positions closed while disconnected"""
+        if not self.started:
+            return
+        await self.load(replace=True)
+
+    def ours(self, account):
+        return not self.account or account == self.account
+
+    def on_position(self, position):
+        if not self.ours(position.account):
+            return
+        if position.position == 0:
+            self.positions.pop(position.contract.conId, None)
+        else:
+            self.positions[position.contract.conId] = position
+
+    def on_fill(self, trade, fill):
+        # IB sends an execution before the position update that includes it
+        execution = fill.execution
+        if not self.ours(execution.acctNumber):
+            return
+        contract = trade.contract
+        held = self.positions.get(contract.conId)
+        before = held.position if held is not None else 0
+        quantity = execution.shares if execution.side == 'BOT' else -execution.shares
+        position = before + quantity
+        # avgCost includes the multiplier, as in IB's position updates
+        cost = execution.price * float(contract.multiplier or 1)
+        if before == 0 or (before > 0) == (quantity > 0):
+            avg_cost = ((held.avgCost * before if held is not None else 0) + cost * quantity) / position
+        else:
+            avg_cost = held.avgCost if abs(quantity) <= abs(before) else cost
+        self.on_position(Position(execution.acctNumber, contract, position, avg_cost))
+
+    def on_portfolio(self, item):
+        if not self.ours(item.account):
+            return
+        if item.position == 0:
+            self.portfolio.pop(item.contract.conId, None)
+        else:
+            self.portfolio[item.contract.conId] = item
+
+    def on_account_value(self, value):
+        if not self.ours(value.account) or value.currency == 'BASE':
+            return
+        try:
+            self.values[value.tag] = float(value.value)
+        except ValueError:
+            pass
+
+    def position(self, contract):
+        """Current position in a qualified contract, 0 if flat"""
+        position = self.positions.get(contract.conId)
+        return position.position if position is not None else 0
+
+    @property
+    def equity(self):
+        return self.values.get('NetLiquidation')
+
+    @property
+    def buying_power(self):
+        return self.values.get('BuyingPower')
+
+    def close(self):
+        if self.started:
+            self.ib.positionEvent -= self.on_position
+            self.ib.updatePortfolioEvent -= self.on_portfolio
+            self.ib.accountValueEvent -= self.on_account_value
+            self.ib.execDetailsEvent -= self.on_fill
+            self.started = False
@@ -0,0 +1,221 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def ema(values, span):
+    """EMA of every row, same as the live strategies' ewm(span, adjust=False)"""
+    return pd.Series(values).ewm(span=span, adjust=False).mean().to_numpy()
+
+def rolling_max(values, period):
+    return pd.Series(values).rolling(window=period).max().to_numpy()
+
+def rolling_min(values, period):
+    return pd.Series(values).rolling(window=period).min().to_numpy()
+
+def shift(values, n=1):
+    """Shift forward by n rows, filling the head with NaN"""
+    out = np.full(len(values), np.nan)
+    out[n:] = values[:-n]
+    return out
+
+def ema200_positions(close, period=200):
+    """
+    TradeStrat1: long while the close is above the EMA.
+    The script itself only buys; the exit below the EMA follows the README's sell signal.
+    """
+    return (close > ema(close, period)).astype(np.int8)
+
+def macd_positions(close, fast_period=12, slow_period=26, signal_period=9):
+    """
+    TradeStrat2: buy when the histogram turns positive while flat,
+    sell when it turns negative while long.
+    """
+    macd_line = ema(close, fast_period) - ema(close, slow_period)
+    histogram = macd_line - ema(macd_line, signal_period)
+    prev_histogram = np.concatenate([[0.0], histogram[:-1]])
+    buy = (histogram > 0) & (prev_histogram <= 0)
+    sell = (histogram < 0) & (prev_histogram >= 0)
+    # The last crossover decides the position; before the first one we are flat
+    state = np.where(buy, 1.0, np.where(sell, 0.0, np.nan))
+    state = pd.Series(state).ffill().fillna(0).to_numpy()
+    return state.astype(np.int8)
+
+def _stop_exit(close, channel, start, side, chunk=256):
+    """
+    First bar after `start` where the close crosses the trailing stop, or None.
+    A long stop trails the lower channel upward (running max), a short stop the upper
+    channel downward (running min). Scans in growing chunks so each trade costs
+    O(trade length) rather than O(remaining bars).
+    """
+    n = len(close)
+    stop = channel[start]
+    i = start + 1
+    while i < n:
+        end = min(n, i + chunk)
+        if side > 0:
+            stops = np.maximum.accumulate(np.maximum(channel[i:end], stop))
+            hits = np.flatnonzero(close[i:end] < stops)
+        else:
+            stops = np.minimum.accumulate(np.minimum(channel[i:end], stop))
+            hits = np.flatnonzero(close[i:end] > stops)
+        if hits.size:
+            return i + hits[0]
+        stop = stops[-1]
+        i = end
+        chunk *= 2
+    return None
+
+def donchian_positions(high, low, close, period=20):
+    """
+    TradeStrat3: enter long above the upper channel and short below the lower one,
+    then trail the stop along the opposite channel and exit when it is crossed.
+    Channels come from the `period` bars before the current one, as in the live script.
+    """
+    upper = shift(rolling_max(high, period))
+    lower = shift(rolling_min(low, period))
+    long_entries = np.flatnonzero(close > upper)
+    short_entries = np.flatnonzero(close < lower)
+    positions = np.zeros(len(close), dtype=np.int8)
+    t = 0
+    while True:
+        i = np.searchsorted(long_entries, t)
+        j = np.searchsorted(short_entries, t)
+        next_long = long_entries[i] if i < len(long_entries) else None
+        next_short = short_entries[j] if j < len(short_entries) else None
+        if next_long is None and next_short is None:
+            break
+        # The long check runs first, as in the script
+        if next_short is None or (next_long is not None and next_long <= next_short):
+            entry, side, channel = next_long, 1, lower
+        else:
+            entry, side, channel = next_short, -1, upper
+        exit = _stop_exit(close, channel, entry, side)
+        if exit is None:
+            positions[entry:] = side
+            break
+        positions[entry:exit] = side
+        # The exit uses up that evaluation, so the earliest re-entry is the next bar
+        t = exit + 1
+    return positions
+
+STRATEGIES = {
+    'ema200': lambda bars, **params: ema200_positions(bars['close'], **params),
+    'macd': lambda bars, **params: macd_positions(bars['close'], **params),
+    'donchian': lambda bars, **params: donchian_positions(bars['high'], bars['low'], bars['close'], **params)
+}
+
+def trades_from_positions(positions, close, dates=None):
+    """Entry/exit bar indices, side, prices and return of every round trip"""
+    columns = ['entry', 'exit', 'side', 'entry_price', 'exit_price', 'return']
+    if len(positions) == 0:
+        return pd.DataFrame(columns=columns + (['entry_date', 'exit_date'] if dates is not None else []))
+    prev = np.concatenate([[0], positions[:-1]])
+    changes = np.flatnonzero(positions != prev)
+    sides = positions[changes]
+    ends = np.concatenate([changes[1:], [len(positions) - 1]])
+    held = sides != 0
+    entry, exit, side = changes[held], ends[held], sides[held].astype(np.int64)
+    trades = pd.DataFrame({
+        'entry': entry,
+        'exit': exit,
+        'side': side,
+        'entry_price': close[entry],
+        'exit_price': close[exit],
+        'return': side * (close[exit] / close[entry] - 1)
+    })
+    if dates is not None:
+        trades['entry_date'] = dates[entry]
+        trades['exit_date'] = dates[exit]
+    return trades
+
+def summarize(returns, equity, trades, exposure, periods_per_year=252):
+    """Summary statistics of a backtest"""
+    std = returns.std()
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    return {
+        'total_return': equity[-1] - 1 if len(equity) else 0.0,
+        'sharpe': returns.mean() / std * np.sqrt(periods_per_year) if std > 0 else 0.0,
+        'max_drawdown': drawdown.min() if len(drawdown) else 0.0,
+        'trades': len(trades),
+        'win_rate': (trades['return'] > 0).mean() if len(trades) else 0.0,
+        'exposure': exposure
+    }
+
+def has_field(bars, name):
+    if isinstance(bars, dict):
+        return name in bars
+    return name in (bars.dtype.names or ())
+
+def run_backtest(bars, strategy, allocation=1.0, commission=0.0, periods_per_year=252, **params):
+    """
+    Backtest one strategy on OHLCV bars (a BarStore record array or a dict of arrays).
+    Orders fill at the close of the signal bar, as the live market orders do.
+    allocation: fraction of equity per position; commission: cost per unit of turnover.
+    Returns a dict with trades (DataFrame), equity (array) and stats.
+    """
+    close = np.asarray(bars['close'], dtype=float)
+    positions = STRATEGIES[strategy](bars, **params)
+    bar_returns = np.concatenate([[0.0], close[1:] / close[:-1] - 1])
+    held = np.concatenate([[0], positions[:-1]])
+    turnover = np.abs(np.diff(np.concatenate([[0], positions])))
+    returns = allocation * (held * bar_returns - commission * turnover)
+    equity = np.cumprod(1 + returns)  # starting from 1.0
+    dates = bars['date'] if has_field(bars, 'date') else None
+    trades = trades_from_positions(positions, close, dates)
+    return {
+        'trades': trades,
+        'equity': equity,
+        'stats': summarize(returns, equity, trades, np.mean(positions != 0), periods_per_year)
+    }
+
+def _sweep_symbol(symbol, bars, strategy, param_sets, options):
+    """Worker: every parameter set for one symbol, so its bars are pickled once"""
+    results = []
+    for params in param_sets:
+        stats = run_backtest(bars, strategy, **options, **params)['stats']
+        results.append({'symbol': symbol, **params, **stats})
+    return results
+
+def sweep(datasets, strategy, grid, max_workers=None, **options):
+    """
+    Run a parameter grid over many symbols on a process pool.
+    datasets: {symbol: bars}; grid: {param: [values]}, e.g. {'period': [20, 55, 100]}.
+    Returns one DataFrame row per (symbol, parameter set), best total return first.
+    """
+    names = list(grid)
+    param_sets = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    rows = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(_sweep_symbol, symbol, bars, strategy, param_sets, options)
+                   for symbol, bars in datasets.items()]
+        for future in futures:
+            rows.extend(future.result())
+    return pd.DataFrame(rows).sort_values('total_return', ascending=False, ignore_index=True)
+
+def load_bars(path):
+    """Load bars saved by BarStore (.npy)"""
+    return np.load(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the EMA200, MACD and Donchian strategies")
+    parser.add_argument('strategy', choices=sorted(STRATEGIES))
+    parser.add_argument('files', nargs='+', help="Bar files from the bar cache (.npy)")
+    parser.add_argument('--grid', default='{}', help='Parameter grid as JSON, e.g. \'{"period": [20, 55, 100]}\'')
+    parser.add_argument('--periods-per-year', type=int, default=252)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    datasets = {os.path.splitext(os.path.basename(path))[0]: load_bars(path) for path in args.files}
+    grid = {name: list(values) for name, values in json.loads(args.grid).items()}
+    results = sweep(datasets, args.strategy, grid, max_workers=args.workers,
+                    periods_per_year=args.periods_per_year)
+    print(results.to_string())
@@ -0,0 +1,161 @@
+import logging
+from datetime import datetime, time as clock_time, timedelta, timezone
+from zoneinfo import ZoneInfo
+from ib_async import BarData, BarDataList
+from barcache import BAR_SECONDS, to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Ticker.ticks types that are trades: last and delayed last
+TRADE_TICKS = (4, 68)
+
+class Session:
+    def __init__(self, open='09:30', close='16:00', tz='America/New_York'):
+        """Regular trading hours of a market, in its local time zone"""
+        self.open = clock_time.fromisoformat(open)
+        self.close = clock_time.fromisoformat(close)
+        self.tz = ZoneInfo(tz)
+        self.today = None  # hours() of the local day looked up last
+
+    def hours(self, day):
+        """(midnight, next midnight, open, close) of a local date, as epoch seconds"""
+        midnight = datetime(day.year, day.month, day.day, tzinfo=self.tz)
+        return (
+            int(midnight.timestamp()),
+            int((midnight + timedelta(days=1)).timestamp()),
+            int(datetime.combine(day, self.open, self.tz).timestamp()),
+            int(datetime.combine(day, self.close, self.tz).timestamp())
+        )
+
+    def day(self, t):
+        """(local date, hours) of the day epoch second t falls in"""
+        if self.today is None or not self.today[1][0] <= t < self.today[1][1]:
+            day = datetime.fromtimestamp(t, self.tz).date()
+            self.today = (day, self.hours(day))
+        return self.today
+
+
+class BarBuilder:
+    def __init__(self, bar_size, session=None, use_rth=True):
+        """
+        OHLCV bars of one size built from a stream of trades or smaller bars.
+        Intraday bars are aligned to the local clock (and, with use_rth, clipped to the
+        session, so 1 hour bars start 9:30, 10:00, ...); daily bars span the session,
+        or the local day without use_rth. Trades outside regular hours are dropped
+        with use_rth.
+        `bars` behaves like a keepUpToDate BarDataList: updateEvent(bars, True) when a bar
+        closes, bars[-2] being the bar that closed and bars[-1] the next one (empty
+        until its first trade, standing at the last close).
+        """
+        self.bar_size = bar_size
+        self.seconds = BAR_SECONDS[bar_size]
+        if self.seconds > 86400:
+            raise ValueError(f"Cannot build {bar_size} bars locally")
+        self.daily = self.seconds == 86400
+        self.session = session if session is not None else Session()
+        self.use_rth = use_rth
+        self.bars = BarDataList()
+        self.bars.barSizeSetting = bar_size
+        self.bars.useRTH = use_rth
+        self.start = self.end = None  # bucket of bars[-1], None while it waits for a trade
+        self.empty = True  # bars[-1] has no trades yet
+        self.closed = None  # end of the last bar closed
+
+    def bucket(self, t):
+        """(start, end, date) of the bar epoch second t falls in, None outside the session"""
+        day, (midnight, next_midnight, open_, close) = self.session.day(t)
+        if self.use_rth and not open_ <= t < close:
+            return None
+        if self.daily:
+            return (open_, close, day) if self.use_rth else (midnight, next_midnight, day)
+        start = midnight + (t - midnight) // self.seconds * self.seconds
+        end = start + self.seconds
+        if self.use_rth:
+            start, end = max(start, open_), min(end, close)
+        return start, end, datetime.fromtimestamp(start, timezone.utc)
+
+    def bar_start(self, bar):
+        date = to_epoch(bar.date)
+        if not self.daily:
+            return date
+        # Daily bars are dated with the session's local date
+        midnight, _, open_, _ = self.session.hours(datetime.fromtimestamp(date, timezone.utc).date())
+        return open_ if self.use_rth else midnight
+
+    def add(self, t, open, high, low, close, volume, end=None):
+        """
+        Add a trade at epoch second t (open = high = low = close) or a bar starting at t.
+        end: a bar's end; it closes the built bar straight away when both end together.
+        """
+        if self.start is None or not self.start <= t < self.end:
+            bucket = self.bucket(t)
+            first = self.start if self.start is not None else self.closed
+            if bucket is None or (first is not None and t < first):
+                return  # outside the session, or late for a bar already closed
+            self.open_bar(*bucket)
+        bar = self.bars[-1]
+        if self.empty:
+            bar.open, bar.high, bar.low = open, high, low
+            self.empty = False
+        else:
+            if high > bar.high:
+                bar.high = high
+            if low < bar.low:
+                bar.low = low
+        bar.close = close
+        bar.volume += volume
+        bar.barCount += 1
+        if end is not None and end >= self.end:
+            self.close()
+        else:
+            self.bars.updateEvent.emit(self.bars, False)
+
+    def open_bar(self, start, end, date):
+        if not self.empty:
+            self.close()
+        if not self.bars:
+            self.bars.append(BarData())
+        self.bars[-1].date = date
+        self.start, self.end = start, end
+
+    def close(self):
+        """Close bars[-1] and start the next one empty"""
+        bar = self.bars[-1]
+        self.closed = self.end
+        bucket = self.bucket(self.end)  # None at the end of the session
+        self.start, self.end = bucket[:2] if bucket is not None else (None, None)
+        self.bars.append(BarData(date=bucket[2] if bucket is not None else bar.date, open=bar.close,
+                                 high=bar.close, low=bar.close, close=bar.close, volume=0))
+        self.empty = True
+        self.bars.updateEvent.emit(self.bars, True)
+
+    def flush(self, now):
+        """Close the forming bar if its time is up, without waiting for the next trade"""
+        if not self.empty and self.end is not None and now >= self.end:
+            self.close()
+            return True
+        return False
+
+    def merge(self, history):
+        """
+        Splice in historical bars (IB's, with the last one still forming): bars newer than
+        the last one closed are added and the forming one replaces the bar being built.
+        Returns the indices of the bars that closed, oldest first.
+        """
+        if not len(history):
+            return []
+        last = self.bars[-2].date if len(self.bars) > 1 else None
+        if self.bars:
+            self.bars.pop()
+        added = []
+        for bar in history[:-1]:
+            if last is None or to_epoch(bar.date) > to_epoch(last):
+                self.bars.append(bar)
+                added.append(len(self.bars) - 1)
+        forming = history[-1]
+        self.bars.append(forming)
+        self.start = self.closed = self.bar_start(forming)
+        bucket = self.bucket(self.start)
+        self.end = bucket[1] if bucket is not None else self.start + self.seconds
+        self.empty = False
+        return added
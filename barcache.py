@@ -0,0 +1,164 @@
+import asyncio
+import calendar
+import logging
+import math
+import os
+import time
+from datetime import datetime
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# One row per bar; `date` is the bar start as epoch seconds (UTC)
+BAR_DTYPE = np.dtype([
+    ('date', 'i8'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8')
+])
+
+BAR_SECONDS = {
+    '1 secs': 1, '5 secs': 5, '10 secs': 10, '15 secs': 15, '30 secs': 30,
+    '1 min': 60, '2 mins': 120, '3 mins': 180, '5 mins': 300, '10 mins': 600,
+    '15 mins': 900, '20 mins': 1200, '30 mins': 1800,
+    '1 hour': 3600, '2 hours': 7200, '3 hours': 10800, '4 hours': 14400, '8 hours': 28800,
+    '1 day': 86400, '1 week': 604800, '1 month': 2592000
+}
+
+# How much later than requested the cache may start before get() fetches the whole duration
+BACKFILL_SLACK = 4 * 86400
+
+# Seconds per unit of an IB durationStr ('2 D', '1 Y', ...)
+DURATION_SECONDS = {'S': 1, 'D': 86400, 'W': 604800, 'M': 2592000, 'Y': 31536000}
+
+def to_epoch(value):
+    """Convert a BarData date (date or datetime) to epoch seconds"""
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return calendar.timegm(value.timetuple())
+
+def bars_to_array(bars):
+    """Convert a list of BarData into a BAR_DTYPE array"""
+    array = np.empty(len(bars), dtype=BAR_DTYPE)
+    for i, bar in enumerate(bars):
+        array[i] = (to_epoch(bar.date), bar.open, bar.high, bar.low, bar.close, bar.volume)
+    return array
+
+def delta_duration(last_date, bar_size, now=None):
+    """
+    IB durationStr covering everything from the last cached bar until now.
+    The last cached bar is fetched again since it may still have been forming.
+    """
+    now = time.time() if now is None else now
+    bar_seconds = BAR_SECONDS[bar_size]
+    seconds = max(now - last_date, 0) + bar_seconds
+    if bar_seconds < 86400 and seconds <= 86400:
+        return f"{int(math.ceil(seconds))} S"
+    days = int(math.ceil(seconds / 86400))
+    if days > 365:
+        return f"{int(math.ceil(days / 365))} Y"
+    return f"{days} D"
+
+def duration_seconds(duration):
+    """Length of an IB durationStr in seconds"""
+    amount, unit = duration.split()
+    return int(amount) * DURATION_SECONDS[unit]
+
+class BarStore:
+    def __init__(self, directory='.barcache', scheduler=None):
+        """
+        On-disk historical bar cache shared by all strategies
+        Bars are kept per (conId, barSize, whatToShow, useRTH) as a .npy column-packed
+        array, read once and then kept in memory; only bars after the last cached one
+        are requested. Files are not memory-mapped so save() can replace them on Windows.
+        Requests go through the pacing scheduler when one is given.
+        """
+        self.directory = directory
+        self.scheduler = scheduler
+        self.bars = {}
+        self.locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(contract, bar_size, what_to_show='TRADES', use_rth=True):
+        return (contract.conId, bar_size, what_to_show, bool(use_rth))
+
+    def path(self, key):
+        con_id, bar_size, what_to_show, use_rth = key
+        name = f"{con_id}_{bar_size.replace(' ', '')}_{what_to_show}_{int(use_rth)}.npy"
+        return os.path.join(self.directory, name)
+
+    def load(self, key):
+        """Cached bars for a key, read from disk on first access"""
+        if key not in self.bars:
+            path = self.path(key)
+            if os.path.exists(path):
+                self.bars[key] = np.load(path)
+            else:
+                self.bars[key] = np.empty(0, dtype=BAR_DTYPE)
+        return self.bars[key]
+
+    def save(self, key, bars):
+        """Write bars atomically so a crash never leaves a torn file"""
+        path = self.path(key)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, bars)
+        os.replace(tmp, path)
+        self.bars[key] = bars
+
+    def merge(self, key, new):
+        """Replace cached bars from the first new bar onwards and append the rest"""
+        cached = self.load(key)
+        if not len(new):
+            return cached
+        keep = np.searchsorted(cached['date'], new['date'][0], side='left')
+        bars = np.concatenate([cached[:keep], new])
+        self.save(key, bars)
+        return bars
+
+    async def fetch(self, ib, contract, duration, bar_size, what_to_show, use_rth):
+        kwargs = dict(
+            endDateTime='',
+            durationStr=duration,
+            barSizeSetting=bar_size,
+            whatToShow=what_to_show,
+            useRTH=use_rth,
+            formatDate=2
+        )
+        if self.scheduler is not None:
+            return await self.scheduler.request(contract, **kwargs)
+        return await ib.reqHistoricalDataAsync(contract, **kwargs)
+
+    async def get(self, ib, contract, duration, bar_size, what_to_show='TRADES', use_rth=True):
+        """
+        Get bars for a contract, downloading only what is missing from the cache:
+        bars after the newest cached one, and the whole `duration` when the cache
+        starts later than it reaches back.
+        Returns the last `duration` of the cache (counted back from the end of the
+        newest bar) as a record array with date/open/high/low/close/volume columns.
+        """
+        key = self.key(contract, bar_size, what_to_show, use_rth)
+        span = duration_seconds(duration)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            cached = self.load(key)
+            fetch = duration
+            if len(cached):
+                fetch = delta_duration(int(cached['date'][-1]), bar_size)
+            bars = await self.fetch(ib, contract, fetch, bar_size, what_to_show, use_rth)
+            logger.debug(f"{contract.symbol} {bar_size}: {len(bars)} bars fetched for {fetch}")
+            merged = self.merge(key, bars_to_array(bars))
+            if fetch != duration and len(merged):
+                start = int(merged['date'][-1]) + BAR_SECONDS[bar_size] - span
+                # Weekends and holidays leave up to a few days without bars at the start
+                if int(merged['date'][0]) > start + BACKFILL_SLACK:
+                    bars = await self.fetch(ib, contract, duration, bar_size, what_to_show, use_rth)
+                    logger.debug(f"{contract.symbol} {bar_size}: cache too short, {len(bars)} bars fetched for {duration}")
+                    merged = self.merge(key, bars_to_array(bars))
+        if len(merged):
+            start = int(merged['date'][-1]) + BAR_SECONDS[bar_size] - span
+            merged = merged[np.searchsorted(merged['date'], start, side='left'):]
+        return merged.view(np.recarray)
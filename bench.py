@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+import timeit
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from ib_async import MarketOrder, Stock
+import TradeStrat1
+import TradeStrat2
+import TradeStrat3
+import screener
+from barcache import BAR_DTYPE
+from indicators import EMA, MACD, Donchian
+from orders import OrderManager
+from risk import RiskGate
+from simbroker import SimIB
+from stops import StopEngine
+
+# Set up logging
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+HISTORY_LENGTHS = (100, 1000, 10000, 100000)
+SYMBOL_COUNTS = (10, 100, 1000)
+STOP_COUNTS = (100, 1000, 10000)
+UNIVERSE_SIZES = (300, 3000)
+SUITES = ('indicators', 'signals', 'orders', 'stops', 'screener', 'risk')
+
+# Full-history pandas recomputation, as the strategies did it before the streaming indicators
+
+def pandas_ema(prices, period=200):
+    return pd.Series(prices).ewm(span=period, adjust=False).mean().iloc[-1]
+
+def pandas_macd(prices, fast_period=12, slow_period=26, signal_period=9):
+    price_series = pd.Series(prices)
+    macd_line = (price_series.ewm(span=fast_period, adjust=False).mean() -
+                 price_series.ewm(span=slow_period, adjust=False).mean())
+    signal_line = macd_line.ewm(span=signal_period, adjust=False).mean()
+    histogram = macd_line - signal_line
+    return histogram.iloc[-1], histogram.iloc[-2]
+
+def pandas_channels(highs, lows, period=20):
+    upper = pd.Series(highs).rolling(window=period).max()
+    lower = pd.Series(lows).rolling(window=period).min()
+    return upper.iloc[-1], lower.iloc[-1], upper.iloc[-2], lower.iloc[-2]
+
+def random_bars(n, seed=0, start=1_600_000_000, bar_seconds=300):
+    """Random-walk OHLCV bars in the bar cache layout"""
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.001, n)) * close
+    bars = np.empty(n, dtype=BAR_DTYPE)
+    bars['date'] = start + np.arange(n) * bar_seconds
+    bars['open'] = open_
+    bars['high'] = np.maximum(open_, close) + spread
+    bars['low'] = np.minimum(open_, close) - spread
+    bars['close'] = close
+    bars['volume'] = rng.integers(100, 10000, n)
+    return bars.view(np.recarray)
+
+def per_call(fn, repeat=5):
+    """Best-of-`repeat` seconds per call, each run long enough to time reliably"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def bench_indicators(lengths=HISTORY_LENGTHS):
+    """Per-call cost of each indicator: pandas recompute, full seed, and one streaming update"""
+    results = []
+    for n in lengths:
+        bars = random_bars(n)
+        close, high, low = bars.close, bars.high, bars.low
+        ema, macd, channels = EMA(200), MACD(), Donchian(20)
+        ema.seed(close)
+        macd.seed(close)
+        channels.seed(high, low)
+        cases = {
+            'ema': {
+                'pandas': lambda: pandas_ema(close),
+                'seed': lambda: TradeStrat1.calculate_ema(close),
+                'update': lambda: ema.preview(close[-1])
+            },
+            'macd': {
+                'pandas': lambda: pandas_macd(close),
+                'seed': lambda: TradeStrat2.MACDStrategy().calculate_macd(close),
+                'update': lambda: macd.preview(close[-1])
+            },
+            'donchian': {
+                'pandas': lambda: pandas_channels(high, low),
+                'seed': lambda: TradeStrat3.DonchianStrategy().calculate_channels(high, low),
+                'update': lambda: channels.preview(high[-1], low[-1])
+            }
+        }
+        for indicator, methods in cases.items():
+            for method, fn in methods.items():
+                results.append({
+                    'benchmark': 'indicator',
+                    'name': f"{indicator}.{method}",
+                    'history': n,
+                    'value': per_call(fn),
+                    'unit': 's/call'
+                })
+    return results
+
+def bench_signals(symbol_counts=SYMBOL_COUNTS, ticks_per_symbol=200, history=500):
+    """
+    Signal evaluation throughput: every symbol runs MACD and Donchian on each tick,
+    previewing the forming bar and applying the crossover/breakout rules.
+    """
+    results = []
+    for count in symbol_counts:
+        rng = np.random.default_rng(count)
+        macds, donchians, bars = [], [], []
+        for i in range(count):
+            data = random_bars(history, seed=i)
+            macd = TradeStrat2.MACDStrategy()
+            macd.update(data)
+            donchian = TradeStrat3.DonchianStrategy()
+            donchian.update(data)
+            macds.append(macd)
+            donchians.append(donchian)
+            bars.append(data[-1])
+        moves = np.exp(rng.normal(0, 0.001, (ticks_per_symbol, count)))
+        started = time.perf_counter()
+        signals = 0
+        for row in moves:
+            for i in range(count):
+                bar = bars[i]
+                price = bar.close * row[i]
+                macd_data = macds[i].preview(price)
+                if (macd_data['histogram'] > 0) != (macd_data['prev_histogram'] > 0):
+                    signals += 1
+                channels = donchians[i].channels.preview(max(bar.high, price), min(bar.low, price))
+                if price > channels['prev_upper'] or price < channels['prev_lower']:
+                    signals += 1
+        elapsed = time.perf_counter() - started
+        evaluations = ticks_per_symbol * count
+        results.append({
+            'benchmark': 'signals',
+            'name': 'macd+donchian',
+            'symbols': count,
+            'value': evaluations / elapsed,
+            'unit': 'evaluations/s',
+            'signals': signals
+        })
+    return results
+
+def bench_orders(orders=200, latency=0.0):
+    """Submit-to-fill round trip through OrderManager against the simulated broker"""
+    ib = SimIB({'BENCH': random_bars(1000)}, latency=latency)
+    manager = OrderManager(ib)
+    times = []
+
+    async def place_all(contract):
+        for i in range(orders):
+            started = time.perf_counter()
+            await manager.place(contract, MarketOrder('BUY' if i % 2 == 0 else 'SELL', 1))
+            times.append(time.perf_counter() - started)
+
+    async def run():
+        await ib.connectAsync()
+        contract, = await ib.qualifyContractsAsync(Stock('BENCH', 'SMART', 'USD'))
+        await ib.replay(place_all(contract), start=ib.now + 500 * ib.base_seconds, settle=1)
+
+    asyncio.run(run())
+    times = np.array(times)
+    return [{
+        'benchmark': 'orders',
+        'name': 'submit_to_fill',
+        'orders': len(times),
+        'value': float(np.median(times)),
+        'p99': float(np.percentile(times, 99)),
+        'unit': 's/order'
+    }]
+
+def bench_stops(stop_counts=STOP_COUNTS, contracts=100):
+    """
+    Stop engine cost per tick and per trailing update by number of stops held,
+    with long stops below and short stops above the price so none fires.
+    """
+    results = []
+    for count in stop_counts:
+        engine = StopEngine(orders=None)
+        rng = np.random.default_rng(count)
+        stocks = [Stock(f"S{i}", 'SMART', 'USD') for i in range(contracts)]
+        for i, stock in enumerate(stocks):
+            stock.conId = i + 1
+        for i in range(count):
+            if i % 2:
+                engine.set(i, stocks[i % contracts], 'SELL', 100, 90 + rng.normal(0, 2))
+            else:
+                engine.set(i, stocks[i % contracts], 'BUY', 100, 110 + rng.normal(0, 2))
+        con_ids = [int(con_id) for con_id in rng.integers(1, contracts + 1, 1000)]
+        keys = [int(key) for key in rng.integers(0, count, 1000)]
+
+        def ticks():
+            for con_id in con_ids:
+                engine.check(con_id, 100.0, 100.0)
+
+        def trails():
+            # Every call moves the stop in its favour and pushes an entry
+            for key in keys:
+                stop = engine.stops[key]
+                engine.trail(key, stop.trigger + (0.01 if stop.action == 'SELL' else -0.01))
+
+        for name, fn in (('check', ticks), ('trail', trails)):
+            results.append({
+                'benchmark': 'stops',
+                'name': name,
+                'stops': count,
+                'value': per_call(fn) / 1000,
+                'unit': 's/call'
+            })
+    return results
+
+def bench_screener(universe_sizes=UNIVERSE_SIZES, days=260):
+    """
+    EMA200 screen of a whole universe of daily bars, each symbol missing a few days:
+    aligning the bars into one matrix, and the vectorized EMA and ranking over it.
+    """
+    results = []
+    for count in universe_sizes:
+        rng = np.random.default_rng(count)
+        universe = {}
+        for i in range(count):
+            days_traded = np.sort(rng.choice(days, days - int(rng.integers(0, 10)), replace=False))
+            bars = np.zeros(len(days_traded), dtype=BAR_DTYPE)
+            bars['date'] = 1_600_000_000 + 86400 * days_traded
+            bars['close'] = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(bars))))
+            universe[f"S{i}"] = bars
+        dates, symbols, closes = screener.align(universe)
+        for name, fn in (('align', lambda: screener.align(universe)),
+                         ('ema200', lambda: screener.screen(closes, symbols))):
+            results.append({
+                'benchmark': 'screener',
+                'name': name,
+                'symbols': count,
+                'value': per_call(fn),
+                'unit': 's/call'
+            })
+    return results
+
+def bench_risk(symbol_counts=SYMBOL_COUNTS, orders=1000):
+    """
+    Pre-trade risk check per order with every limit set, by number of symbols
+    already holding positions: check alone, and approve plus done (the counters
+    an order moves through).
+    """
+    results = []
+    for count in symbol_counts:
+        gate = RiskGate(max_exposure=1e12, max_symbol_notional=1e9, max_order_notional=1e9,
+                        max_open_orders=10 * orders, max_order_rate=None)
+        stocks = [Stock(f"S{i}", 'SMART', 'USD') for i in range(count)]
+        for i, stock in enumerate(stocks):
+            stock.conId = i + 1
+            gate.positions[stock.conId] = 100
+            gate.prices[stock.conId] = 100.0
+            gate.refresh(stock.conId)
+        rng = np.random.default_rng(count)
+        picks = [stocks[i] for i in rng.integers(0, count, orders)]
+        order_list = [MarketOrder('BUY', int(quantity)) for quantity in rng.integers(1, 100, orders)]
+
+        def checks():
+            for stock, order in zip(picks, order_list):
+                gate.check(stock, order, 100.0)
+
+        def round_trips():
+            for stock, order in zip(picks, order_list):
+                gate.approve(stock, order, 100.0)
+                gate.done(stock, order, 0)
+
+        for name, fn in (('check', checks), ('approve+done', round_trips)):
+            results.append({
+                'benchmark': 'risk',
+                'name': name,
+                'symbols': count,
+                'value': per_call(fn) / orders,
+                'unit': 's/order'
+            })
+    return results
+
+def git_commit():
+    # Ask about the repository bench.py is in, wherever it is run from
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True, cwd=cwd).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True, cwd=cwd).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def result_key(row):
+    return (row['benchmark'], row['name'], row.get('history'), row.get('symbols'), row.get('stops'))
+
+def load_results(path, commit):
+    """Latest results recorded for a commit, keyed by benchmark"""
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                row = json.loads(line)
+                if row['commit'] == commit:
+                    results[result_key(row)] = row
+    return results
+
+def report(results, baseline=None):
+    for row in results:
+        size = row.get('history') or row.get('symbols') or row.get('orders') or row.get('stops')
+        line = f"{row['benchmark']:<10} {row['name']:<16} {size:>7} {row['value']:>14.6g} {row['unit']}"
+        previous = (baseline or {}).get(result_key(row))
+        if previous is not None:
+            line += f"   ({row['value'] / previous['value']:.2f}x vs {previous['commit']})"
+        print(line)
+
+def main(suites, output, compare=None, quick=False):
+    commit = git_commit()
+    meta = {
+        'commit': commit,
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine()
+    }
+    results = []
+    if 'indicators' in suites:
+        results += bench_indicators(HISTORY_LENGTHS[:3] if quick else HISTORY_LENGTHS)
+    if 'signals' in suites:
+        results += bench_signals(SYMBOL_COUNTS[:2] if quick else SYMBOL_COUNTS)
+    if 'orders' in suites:
+        results += bench_orders(50 if quick else 200)
+    if 'stops' in suites:
+        results += bench_stops(STOP_COUNTS[:2] if quick else STOP_COUNTS)
+    if 'screener' in suites:
+        results += bench_screener(UNIVERSE_SIZES[:1] if quick else UNIVERSE_SIZES)
+    if 'risk' in suites:
+        results += bench_risk(SYMBOL_COUNTS[:2] if quick else SYMBOL_COUNTS)
+    baseline = load_results(output, compare) if compare else None
+    with open(output, 'a') as f:
+        for row in results:
+            f.write(json.dumps({**meta, **row}) + '\n')
+    report(results, baseline)
+    print(f"Results for {commit} appended to {output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark indicators, signal evaluation and the order pipeline")
+    parser.add_argument('suites', nargs='*', help="Any of indicators, signals, orders, stops, screener, risk (default: all)")
+    parser.add_argument('--output', default='bench_results.jsonl', help="JSONL file results are appended to")
+    parser.add_argument('--compare', metavar='COMMIT', help="Show ratios against results recorded for COMMIT")
+    parser.add_argument('--quick', action='store_true', help="Smaller sizes for a fast check")
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    main(args.suites or SUITES, args.output, args.compare, args.quick)
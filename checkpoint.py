@@ -0,0 +1,92 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+class CheckpointStore:
+    def __init__(self, path='.checkpoint.json'):
+        """
+        Crash-safe snapshots of strategy state. Strategies register a provider per key
+        (a function returning JSON-able state); all providers are polled and written
+        together, atomically, every few seconds and on close. After a restart each
+        strategy gets its last state back instead of re-seeding from history.
+        """
+        self.path = path
+        self.states = None  # key -> last state, loaded on first access
+        self.providers = {}  # key -> function returning the current state
+        self.saved = None  # time of the last snapshot written or loaded
+        self.task = None
+
+    def load(self):
+        if self.states is None:
+            self.states = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path) as f:
+                        snapshot = json.load(f)
+                    self.states = snapshot['states']
+                    self.saved = snapshot['time']
+                    logger.info(f"Loaded checkpoint of {len(self.states)} states from "
+                                f"{time.time() - self.saved:.0f}s ago")
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Ignoring unreadable checkpoint {self.path}: {e}")
+        return self.states
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
+
+    def register(self, key, provider):
+        self.load()
+        self.providers[key] = provider
+
+    def unregister(self, key):
+        """Stop polling a provider, keeping its final state for the next snapshot"""
+        provider = self.providers.pop(key, None)
+        if provider is not None:
+            self.collect(key, provider)
+
+    def collect(self, key, provider):
+        try:
+            state = provider()
+        except Exception as e:
+            logger.error(f"Checkpoint of {key} failed: {e}")
+            return
+        if state is not None:
+            self.states[key] = state
+
+    def save(self):
+        """Poll every provider and write the snapshot; a crash mid-write leaves the previous one"""
+        states = self.load()
+        for key, provider in list(self.providers.items()):
+            self.collect(key, provider)
+        self.saved = time.time()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'time': self.saved, 'states': states}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def start(self, interval=30):
+        """Write a snapshot every `interval` seconds until closed"""
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run(interval))
+
+    async def run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.save()
+            except OSError as e:
+                logger.error(f"Could not write checkpoint {self.path}: {e}")
+
+    def close(self):
+        """Stop the periodic snapshots and write a final one"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.states is not None:
+            self.save()
@@ -1,47 +1,132 @@
-from ib_async import *
-import asyncio
-import logging
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
-async def main():
-    ib = IB()
-    try:
-        await ib.connectAsync('127.0.0.1', 7497, clientId=123)
-        logger.info("Connected to IB")
-
-        # Get all open positions
-        positions = await ib.reqPositionsAsync()
-        if not positions:
-            logger.info("No open positions to close.")
-        else:
-            for pos in positions:
-                if pos.position > 0:
-                    # Place a market sell order to close long positions
-                    order = MarketOrder('SELL', pos.position)
-                    trade = ib.placeOrder(pos.contract, order)
-                    logger.info(f"Sell order placed to close position: {pos.contract.symbol} {pos.position}")
-                elif pos.position < 0:
-                    # Place a market buy order to close short positions
-                    order = MarketOrder('BUY', abs(pos.position))
-                    trade = ib.placeOrder(pos.contract, order)
-                    logger.info(f"Buy order placed to close short position: {pos.contract.symbol} {abs(pos.position)}")
-                else:
-                    logger.info(f"No position to close for {pos.contract.symbol}")
-                await asyncio.sleep(1)  # Give IB time to process each order
-
-            # Optional: Wait for all orders to fill
-            await asyncio.sleep(5)
-            logger.info("All close orders sent. Check TWS for order status.")
-
-    except Exception as e:
-        logger.error(f"Connection or setup error: {e}")
-    finally:
-        if ib.isConnected():
-            ib.disconnect()
-            logger.info("Disconnected from IB")
-
-if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+from ib_async import *
+import argparse
+import asyncio
+import logging
+import time
+from orders import OrderManager
+from scheduler import TokenBucket
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+async def throttle(bucket):
+    """Wait for a token so order submissions stay under the message rate limit"""
+    while True:
+        wait = bucket.delay()
+        if wait <= 0:
+            bucket.take()
+            return
+        await asyncio.sleep(wait)
+
+async def close_position(orders, bucket, pos, started, timeout=30, retries=3, retry_delay=1):
+    """
+    Close one position with a market order and track it until it is flat.
+    Rejected, cancelled or partially filled orders are resubmitted for the remainder.
+    An order still working after the timeout is waited on again instead, since a
+    second close next to it would over-close; each wait counts as an attempt.
+    """
+    contract = pos.contract
+    if not contract.exchange:
+        # Position contracts come without a routing exchange
+        contract.exchange = 'SMART'
+    action = 'SELL' if pos.position > 0 else 'BUY'
+    remaining = abs(pos.position)
+    filled = filled_value = 0.0
+    done = done_value = 0.0  # filled by orders that are over
+    attempts = 0
+    result = None
+    while remaining > 0 and attempts <= retries:
+        working = result is not None and result['status'] == 'Timeout'
+        if attempts and not working:
+            logger.warning(f"Retrying {contract.symbol}: {remaining} left after {result['status']}")
+            await asyncio.sleep(retry_delay)
+        attempts += 1
+        if working:
+            logger.warning(f"{contract.symbol} close still working with {result['filled']:g} filled, waiting for it")
+            result = await orders.wait(result['trade'], timeout)
+        else:
+            await throttle(bucket)
+            logger.info(f"{action} order placed to close {contract.symbol} {remaining}")
+            result = await orders.place(contract, MarketOrder(action, remaining), timeout=timeout)
+        filled = done + result['filled']
+        if result['filled']:
+            filled_value = done_value + result['filled'] * result['avg_fill_price']
+        if result['status'] != 'Timeout':
+            done, done_value = filled, filled_value
+            remaining = abs(pos.position) - filled
+    status = result['status'] if result is not None else None
+    return {
+        'symbol': contract.localSymbol or contract.symbol,
+        'position': pos.position,
+        'action': action,
+        'status': status,
+        'filled': filled,
+        'remaining': abs(pos.position) - filled,
+        'attempts': attempts,
+        'avg_fill_price': filled_value / filled if filled else None,
+        'time_to_flat': time.monotonic() - started if filled >= abs(pos.position) else None
+    }
+
+async def flatten(ib, rate=40, timeout=30, retries=3):
+    """
+    Close every open position concurrently.
+    rate: order submissions per second, below IB's 50 messages per second limit.
+    Returns one report row per position.
+    """
+    positions = [pos for pos in await ib.reqPositionsAsync() if pos.position != 0]
+    if not positions:
+        return []
+    started = time.monotonic()
+    # No risk gate: closing orders only reduce positions, and the rate is throttled below
+    orders = OrderManager(ib)
+    bucket = TokenBucket(rate, rate)
+    return await asyncio.gather(*[
+        close_position(orders, bucket, pos, started, timeout, retries)
+        for pos in positions
+    ])
+
+def log_report(report):
+    """Log time-to-flat per position, slowest last, and anything still open"""
+    for row in sorted(report, key=lambda row: (row['time_to_flat'] is None, row['time_to_flat'] or 0)):
+        if row['remaining'] <= 0:
+            logger.info(f"{row['symbol']:<12} {row['action']:<4} {abs(row['position']):>10g} "
+                        f"flat in {row['time_to_flat']:.2f}s at {row['avg_fill_price']:.4f} "
+                        f"({row['attempts']} attempt{'s' if row['attempts'] > 1 else ''})")
+        else:
+            logger.error(f"{row['symbol']:<12} {row['action']:<4} {abs(row['position']):>10g} "
+                         f"NOT FLAT: {row['remaining']:g} left, last status {row['status']} "
+                         f"after {row['attempts']} attempts")
+    flat = [row['time_to_flat'] for row in report if row['remaining'] <= 0]
+    if flat:
+        logger.info(f"{len(flat)}/{len(report)} positions flat, all flat after {max(flat):.2f}s")
+    if len(flat) < len(report):
+        logger.error(f"{len(report) - len(flat)} positions still open")
+
+async def main(rate=40, timeout=30, retries=3):
+    ib = IB()
+    try:
+        await ib.connectAsync('127.0.0.1', 7497, clientId=123)
+        logger.info("Connected to IB")
+
+        # Close all open positions at once and wait for each to fill
+        report = await flatten(ib, rate, timeout, retries)
+        if not report:
+            logger.info("No open positions to close.")
+        else:
+            log_report(report)
+
+    except Exception as e:
+        logger.error(f"Connection or setup error: {e}")
+    finally:
+        if ib.isConnected():
+            ib.disconnect()
+            logger.info("Disconnected from IB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Close every open position as fast as possible")
+    parser.add_argument('--rate', type=float, default=40, help="Order submissions per second")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds to wait for each order")
+    parser.add_argument('--retries', type=int, default=3, help="Resubmissions after a reject, or waits on a close still working")
+    args = parser.parse_args()
+    asyncio.run(main(args.rate, args.timeout, args.retries))
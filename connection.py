@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# IB system messages about the link between TWS and IB's servers
+CONNECTIVITY_LOST = 1100
+RESTORED_DATA_LOST = 1101
+RESTORED_DATA_KEPT = 1102
+
+class ConnectionManager:
+    def __init__(self, ib, host='127.0.0.1', port=7497, client_ids=(123,), timeout=10,
+                 backoff=1, max_backoff=30, heartbeat=30):
+        """
+        Keeps one IB connection up across TWS restarts and dropped sockets.
+        Connects with the first client ID of the pool that TWS accepts, notices
+        disconnects (and silent sockets, through a periodic heartbeat), reconnects
+        with exponential backoff and then runs the on_reconnect hooks to restore
+        session state.
+        on_reconnect: coroutine functions awaited in order after every reconnect.
+        """
+        self.ib = ib
+        self.host = host
+        self.port = port
+        self.client_ids = list(client_ids)
+        self.client_id = None
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.heartbeat = heartbeat
+        self.on_reconnect = []
+        self.connected = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.reconnects = 0
+        self.tasks = set()
+
+    async def start(self, retries=3):
+        """Make the first connection and start watching it; raises if it cannot connect"""
+        await self.connect(retries)
+        self.ib.disconnectedEvent += self.on_disconnected
+        self.ib.errorEvent += self.on_error
+        if self.heartbeat:
+            self.spawn(self.watch())
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def connect(self, retries=None):
+        """
+        Connect, trying the client IDs in turn (the last one used first) and backing off
+        between rounds. retries: rounds before giving up; None retries until closed.
+        """
+        delay = self.backoff
+        attempt = 0
+        while True:
+            ids = self.client_ids
+            if self.client_id in ids:
+                ids = [self.client_id] + [i for i in ids if i != self.client_id]
+            error = None
+            for client_id in ids:
+                try:
+                    await self.ib.connectAsync(self.host, self.port, clientId=client_id, timeout=self.timeout)
+                except (OSError, asyncio.TimeoutError) as e:
+                    # TWS refuses a client ID still held by a dead session
+                    logger.warning(f"Connecting with client ID {client_id} failed: {e!r}")
+                    error = e
+                    continue
+                self.client_id = client_id
+                self.connected.set()
+                logger.info(f"Connected to IB at {self.host}:{self.port} with client ID {client_id}")
+                return client_id
+            attempt += 1
+            if self.closed.is_set() or (retries is not None and attempt >= retries):
+                raise ConnectionError(f"Could not connect to IB at {self.host}:{self.port}") from error
+            logger.info(f"Retrying connection in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    def on_disconnected(self):
+        # Failed connect attempts also emit disconnectedEvent; only react to losing a live connection
+        if self.closed.is_set() or not self.connected.is_set():
+            return
+        self.connected.clear()
+        logger.warning("Connection to IB lost, reconnecting")
+        self.spawn(self.reconnect())
+
+    def on_error(self, req_id, error_code, error_string, contract):
+        if error_code == CONNECTIVITY_LOST:
+            logger.warning("TWS lost connectivity to IB")
+        elif error_code == RESTORED_DATA_LOST:
+            # The socket stayed up but TWS dropped every subscription
+            logger.warning("TWS connectivity restored with data lost, resyncing")
+            self.spawn(self.resync())
+        elif error_code == RESTORED_DATA_KEPT:
+            logger.info("TWS connectivity restored")
+
+    async def reconnect(self):
+        started = time.monotonic()
+        try:
+            await self.connect()
+        except ConnectionError:
+            return  # closed while reconnecting
+        self.reconnects += 1
+        await self.resync()
+        logger.info(f"Reconnected and resynced in {time.monotonic() - started:.1f}s")
+
+    async def resync(self):
+        for hook in self.on_reconnect:
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Resync after reconnect failed: {e}")
+
+    async def watch(self):
+        """Drop a connection whose socket is open but no longer answers, so it gets replaced"""
+        while not self.closed.is_set():
+            await asyncio.sleep(self.heartbeat)
+            if not self.connected.is_set():
+                continue
+            try:
+                await asyncio.wait_for(self.ib.reqCurrentTimeAsync(), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                if self.connected.is_set():
+                    logger.warning(f"No heartbeat answer from IB in {self.timeout}s, dropping the connection")
+                    self.ib.disconnect()
+
+    def close(self):
+        """Stop reconnecting; the caller still disconnects"""
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.ib.disconnectedEvent -= self.on_disconnected
+        self.ib.errorEvent -= self.on_error
+        for task in self.tasks:
+            task.cancel()
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from accounts import AccountState
+from barcache import BarStore
+from checkpoint import CheckpointStore
+from connection import ConnectionManager
+from contractcache import ContractCache
+from latency import LatencyRecorder
+from orders import OrderManager
+from pnl import PnLMonitor
+from risk import RiskGate
+from scheduler import HistoricalScheduler
+from stops import StopEngine
+from subscriptions import SubscriptionManager
+
+logger = logging.getLogger(__name__)
+
+class TradingContext:
+    def __init__(self, ib, store=None, subscriptions=None, contracts=None, checkpoints=None, max_starting=20,
+                 limits=None):
+        """
+        State shared by every strategy running on one IB connection:
+        qualified contracts, the paced historical data queue, the bar cache,
+        market data subscriptions, account state, PnL, the risk gate and order
+        manager, the stop engine, latency histograms, strategy checkpoints and,
+        once connect() is used, the connection manager.
+        max_starting limits how many strategies seed their history at the same time.
+        limits: RiskGate limits (max_exposure, max_leverage, max_symbol_notional,
+        max_order_notional, max_open_orders, max_order_rate).
+        """
+        self.ib = ib
+        self.scheduler = HistoricalScheduler(ib)
+        self.store = store if store is not None else BarStore(scheduler=self.scheduler)
+        self.subscriptions = subscriptions if subscriptions is not None else SubscriptionManager(ib, self.scheduler)
+        self.account = AccountState(ib)
+        self.risk = RiskGate(self.account, **(limits or {}))
+        self.orders = OrderManager(ib, risk=self.risk)
+        self.pnl = PnLMonitor(ib)
+        self.latency = LatencyRecorder()
+        self.stops = StopEngine(self.orders, self.latency)
+        self.contracts = contracts if contracts is not None else ContractCache()
+        self.checkpoints = checkpoints if checkpoints is not None else CheckpointStore()
+        self.startup = asyncio.Semaphore(max_starting)
+        self.connection = None
+
+    async def connect(self, host='127.0.0.1', port=7497, client_ids=(123,), **options):
+        """
+        Connect through a ConnectionManager that reconnects on drops and resyncs this
+        context; options are passed to ConnectionManager.
+        """
+        self.connection = ConnectionManager(self.ib, host, port, client_ids, **options)
+        self.connection.on_reconnect.append(self.resync)
+        await self.connection.start()
+
+    async def start(self):
+        """Load account state and check orders left in flight by the last run; call once connected"""
+        await self.account.start()
+        self.risk.load()
+        self.orders.reconcile(self.checkpoints.get('orders', []))
+        self.checkpoints.register('orders', self.orders.pending)
+
+    async def resync(self):
+        """
+        Restore session state after a reconnect in one batch: account and positions,
+        every market data and bar subscription, in-flight orders, PnL subscriptions and
+        the risk gate's positions.
+        Strategy state (indicators, stops) is kept, so nothing is re-seeded.
+        """
+        await asyncio.gather(self.account.resync(), self.subscriptions.resubscribe())
+        self.orders.resync()
+        self.pnl.resync()
+        # Let orders that finished while disconnected settle before positions are reloaded
+        await asyncio.sleep(0)
+        self.risk.load()
+
+    async def stopped(self):
+        """
+        Wait until strategies should stop: the context is closed or, without a
+        connection manager to restore it, the connection drops.
+        """
+        if self.connection is None:
+            await self.ib.disconnectedEvent
+        else:
+            await self.connection.closed.wait()
+
+    async def qualify(self, *contracts):
+        """
+        Qualify contracts in one batch, skipping any already in the contract cache.
+        Returns the qualified contracts in order, None for any IB could not resolve.
+        """
+        return await self.contracts.qualify(self.ib, *contracts)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.account.close()
+        self.pnl.close()
+        self.latency.close()
+        self.checkpoints.close()
+        self.stops.close()
+        self.subscriptions.close()
+        self.scheduler.close()
@@ -0,0 +1,80 @@
+import dataclasses
+import json
+import logging
+import os
+from datetime import datetime
+from ib_async import Contract
+
+logger = logging.getLogger(__name__)
+
+def contract_key(contract):
+    """Cache key of a contract as requested, before qualification fills it in"""
+    return (contract.symbol, contract.secType, contract.exchange, contract.currency,
+            contract.lastTradeDateOrContractMonth, contract.strike, contract.right)
+
+def expired(key, today=None):
+    """True once the last trading day (YYYYMMDD or month YYYYMM) has passed"""
+    expiry = key[4]
+    if not expiry:
+        return False
+    today = today or datetime.now().strftime('%Y%m%d')
+    return expiry[:8] < today[:len(expiry[:8])]
+
+class ContractCache:
+    def __init__(self, path='.contracts.json'):
+        """
+        Qualified contracts persisted in one JSON file, so a cold start reads one file
+        instead of making a qualification round trip per contract.
+        Keyed by (symbol, secType, exchange, currency, expiry, strike, right);
+        contracts past their expiry are dropped on load.
+        """
+        self.path = path
+        self.contracts = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            entries = json.load(f)
+        for key, fields in entries:
+            key = tuple(key)
+            if not expired(key):
+                self.contracts[key] = Contract.create(**fields)
+        logger.debug(f"Loaded {len(self.contracts)} contracts from {self.path}")
+
+    def save(self):
+        """Write the cache atomically so a crash never leaves a torn file"""
+        entries = []
+        for key, contract in self.contracts.items():
+            fields = {name: value for name, value in dataclasses.asdict(contract).items()
+                      if value not in ('', 0, 0.0, None, [])}
+            entries.append([key, fields])
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
+
+    def get(self, contract):
+        return self.contracts.get(contract_key(contract))
+
+    async def qualify(self, ib, *contracts):
+        """
+        Qualify contracts, sending only the cache misses to IB in one batch.
+        Returns the qualified contracts in order, None for any IB could not resolve.
+        """
+        # Qualification fills in fields in place, so take the keys beforehand
+        keys = [contract_key(contract) for contract in contracts]
+        missing = {}
+        for key, contract in zip(keys, contracts):
+            if key not in self.contracts and key not in missing:
+                missing[key] = contract
+        if missing:
+            await ib.qualifyContractsAsync(*missing.values())
+            for key, contract in missing.items():
+                if contract.conId:
+                    self.contracts[key] = contract
+                else:
+                    logger.error(f"Could not qualify {contract.symbol}")
+            self.save()
+        return [self.contracts.get(key) for key in keys]
@@ -0,0 +1,116 @@
+import logging
+import os
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from ib_async import ExecutionFilter
+
+logger = logging.getLogger(__name__)
+
+# One row per execution; `time` is epoch seconds (UTC)
+EXECUTION_DTYPE = np.dtype([
+    ('time', 'i8'),
+    ('exec_id', 'U48'),
+    ('order_id', 'i8'),
+    ('perm_id', 'i8'),
+    ('account', 'U16'),
+    ('con_id', 'i8'),
+    ('symbol', 'U16'),
+    ('local_symbol', 'U32'),
+    ('sec_type', 'U8'),
+    ('exchange', 'U16'),
+    ('currency', 'U8'),
+    ('side', 'U4'),
+    ('shares', 'f8'),
+    ('price', 'f8'),
+    ('commission', 'f8')
+])
+
+def to_epoch(value):
+    """Execution time (a datetime, UTC if naive) to epoch seconds"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def fills_to_array(fills):
+    """Convert a list of Fills into an EXECUTION_DTYPE array"""
+    array = np.empty(len(fills), dtype=EXECUTION_DTYPE)
+    for i, fill in enumerate(fills):
+        contract, execution = fill.contract, fill.execution
+        commission = fill.commissionReport.commission if fill.commissionReport else 0.0
+        array[i] = (to_epoch(execution.time), execution.execId, execution.orderId, execution.permId,
+                    execution.acctNumber, contract.conId, contract.symbol, contract.localSymbol,
+                    contract.secType, execution.exchange, contract.currency, execution.side,
+                    execution.shares, execution.price, commission)
+    return array
+
+class ExecutionStore:
+    def __init__(self, path='.executions.npy'):
+        """
+        Execution history kept on disk as one column-packed array sorted by time, so
+        each sync asks IB only for executions since the last stored one and reports
+        query the local file. IB itself only returns the last few days of executions.
+        """
+        self.path = path
+        self.executions = None
+
+    def load(self):
+        """Stored executions, read from disk on first access (not mmapped, so save() can replace the file)"""
+        if self.executions is None:
+            if os.path.exists(self.path):
+                self.executions = np.load(self.path)
+            else:
+                self.executions = np.empty(0, dtype=EXECUTION_DTYPE)
+        return self.executions
+
+    def save(self, executions):
+        """Write executions atomically so a crash never leaves a torn file"""
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, executions)
+        os.replace(tmp, self.path)
+        self.executions = executions
+
+    async def sync(self, ib):
+        """
+        Fetch executions since the last stored one and append the new ones.
+        Returns the number of executions added.
+        """
+        stored = self.load()
+        exec_filter = ExecutionFilter()
+        if len(stored):
+            last = int(stored['time'][-1])
+            exec_filter.time = datetime.fromtimestamp(last, timezone.utc).strftime('%Y%m%d-%H:%M:%S')
+        fills = await ib.reqExecutionsAsync(exec_filter)
+        new = fills_to_array(fills)
+        if len(stored):
+            # The time filter is inclusive to the second; drop executions already stored
+            recent = set(stored['exec_id'][np.searchsorted(stored['time'], last):])
+            new = new[new['time'] >= last]
+            new = new[[exec_id not in recent for exec_id in new['exec_id']]]
+        if not len(new):
+            return 0
+        executions = np.concatenate([stored, np.sort(new, order='time', kind='stable')])
+        self.save(executions)
+        logger.debug(f"Stored {len(new)} new executions, {len(executions)} total")
+        return len(new)
+
+    def query(self, symbol=None, start=None, end=None):
+        """
+        Stored executions as a DataFrame, optionally for one symbol and a time range.
+        start/end: datetimes (UTC if naive) or epoch seconds; end is exclusive.
+        """
+        executions = self.load()
+        times = executions['time']
+        lo = 0 if start is None else np.searchsorted(times, self._epoch(start), side='left')
+        hi = len(executions) if end is None else np.searchsorted(times, self._epoch(end), side='left')
+        selected = executions[lo:hi]
+        if symbol is not None:
+            selected = selected[selected['symbol'] == symbol]
+        df = pd.DataFrame(selected)
+        df['time'] = pd.to_datetime(df['time'], unit='s', utc=True)
+        return df
+
+    @staticmethod
+    def _epoch(value):
+        return value if isinstance(value, (int, float)) else to_epoch(value)
@@ -0,0 +1,406 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+import numpy as np
+import TradeStrat2
+import TradeStrat3
+from barcache import to_epoch
+from latency import LatencyRecorder
+from marketbus import LAST, MarketDataBus
+from stops import StopEngine
+
+logger = logging.getLogger(__name__)
+
+class MACDWorker:
+    # History for seeding, live bar subscription duration and bar size
+    history = staticmethod(TradeStrat2.get_historical_data)
+    checkpoint_key = staticmethod(TradeStrat2.checkpoint_key)
+    live_duration, bar_size = '2 D', '1 day'
+
+    def __init__(self, fast_period=12, slow_period=26, signal_period=9):
+        self.strategy = TradeStrat2.MACDStrategy(fast_period, slow_period, signal_period)
+
+    async def evaluate(self, ctx, contract, price, forming, trace):
+        macd_data = self.strategy.preview(price)
+        if trace is not None:
+            trace.mark('indicator')
+        await TradeStrat2.evaluate(ctx, contract, contract.symbol, macd_data, price, trace)
+
+
+class DonchianWorker:
+    history = staticmethod(TradeStrat3.get_historical_data)
+    checkpoint_key = staticmethod(TradeStrat3.checkpoint_key)
+    live_duration, bar_size = '2 D', '5 mins'
+
+    def __init__(self, period=20):
+        self.strategy = TradeStrat3.DonchianStrategy(period=period)
+
+    async def evaluate(self, ctx, contract, price, forming, trace):
+        channels = self.strategy.closed_channels()
+        if trace is not None:
+            trace.mark('indicator')
+        await TradeStrat3.evaluate(ctx, contract, contract.symbol, self.strategy, channels, price, trace)
+
+
+# Strategies that can run in worker processes; others stay in the gateway
+WORKER_STRATEGIES = {
+    'macd': MACDWorker,
+    'donchian': DonchianWorker
+}
+
+def shard(symbol, workers):
+    """Stable worker index for a symbol, so every strategy on it shares one worker"""
+    return zlib.crc32(symbol.encode()) % workers
+
+
+class WorkerAccount:
+    def __init__(self):
+        """Positions and equity mirrored from the gateway's AccountState"""
+        self.positions = {}  # conId -> position
+        self.equity = None
+
+    def position(self, contract):
+        return self.positions.get(contract.conId, 0)
+
+
+class WorkerOrders:
+    def __init__(self, outbox, worker_id):
+        """
+        Stands in for OrderManager: sends order intents to the gateway and awaits the result.
+        Results are final; the gateway follows an order that timed out until it is done.
+        """
+        self.outbox = outbox
+        self.worker_id = worker_id
+        self.pending = {}  # intent id -> future
+        self.next_id = 0
+
+    async def place(self, contract, order, timeout=None, cancel_on_timeout=None, reference_price=None, trace=None):
+        self.next_id += 1
+        intent_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[intent_id] = future
+        self.outbox.put(('order', self.worker_id, intent_id, contract, order,
+                         {'timeout': timeout, 'cancel_on_timeout': cancel_on_timeout,
+                          'reference_price': reference_price}))
+        if trace is not None:
+            trace.mark('submit')
+        result = await future
+        if trace is not None and result['status'] == 'Filled':
+            trace.mark('fill')
+        return result
+
+    def done(self, intent_id, result):
+        future = self.pending.pop(intent_id, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+
+class WorkerContext:
+    def __init__(self, outbox, worker_id):
+        """The parts of TradingContext the strategies' evaluate() uses"""
+        self.account = WorkerAccount()
+        self.orders = WorkerOrders(outbox, worker_id)
+        # Stage histograms are kept by the gateway
+        self.latency = LatencyRecorder(enabled=False)
+        self.stops = StopEngine(self.orders)
+
+
+class Worker:
+    def __init__(self, worker_id, inbox, outbox, bus_name, poll_interval=0.0005, checkpoint_interval=5):
+        """
+        Strategy worker process: keeps indicator state for its shard of symbols and
+        evaluates the rules on market data the gateway publishes to the shared-memory bus.
+        Ticks that pile up while it is busy are conflated to the latest price per contract.
+        Strategy states are reported to the gateway every checkpoint_interval seconds.
+        """
+        self.worker_id = worker_id
+        self.inbox = inbox
+        self.outbox = outbox
+        self.checkpoint_interval = checkpoint_interval
+        self.reported = time.monotonic()
+        self.bus = MarketDataBus.attach(bus_name)
+        self.poll_interval = poll_interval
+        self.seen = {}  # conId -> last bus sequence read
+        self.ctx = WorkerContext(outbox, worker_id)
+        self.entries = {}  # entry id -> (name, adapter, contract)
+        self.by_con_id = {}  # conId -> [entry id]
+        self.forming = {}  # entry id -> forming BarData
+        self.busy = {}  # entry id -> Lock
+        self.tasks = set()
+
+    def drain(self, limit=10000):
+        """Take whatever messages are already queued"""
+        messages = []
+        try:
+            while len(messages) < limit:
+                messages.append(self.inbox.get_nowait())
+        except queue.Empty:
+            pass
+        return messages
+
+    def poll(self):
+        """{conId: (high, low, last)} of the prices published since the previous poll"""
+        ticks = {}
+        for con_id, seen in self.seen.items():
+            slot = self.bus.slot(con_id)
+            seq, prices = self.bus.since(slot, seen, LAST)
+            if seq == seen:
+                continue
+            self.seen[con_id] = seq
+            prices = prices[~np.isnan(prices)]
+            if len(prices):
+                ticks[con_id] = (float(prices.max()), float(prices.min()), float(prices[-1]))
+        return ticks
+
+    def wait(self):
+        """Block until there are messages or new ticks"""
+        while True:
+            messages = self.drain()
+            ticks = self.poll()
+            if messages or ticks:
+                return messages, ticks
+            time.sleep(self.poll_interval)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            messages, ticks = await loop.run_in_executor(None, self.wait)
+            prices = {}
+            for message in messages:
+                kind = message[0]
+                if kind == 'stop':
+                    for task in self.tasks:
+                        task.cancel()
+                    self.report()
+                    self.bus.close()
+                    return
+                if kind == 'bar':
+                    _, entry_id, closed, forming = message
+                    self.entries[entry_id][1].strategy.add_bar(closed)
+                    self.forming[entry_id] = forming
+                    prices[self.entries[entry_id][2].conId] = forming.close
+                else:
+                    self.handle(message)
+            # Ticks were read after the messages, so they extend the bars those brought
+            for con_id, (high, low, price) in ticks.items():
+                self.ctx.stops.check(con_id, low, high)
+                prices[con_id] = price
+                for entry_id in self.by_con_id.get(con_id, ()):
+                    forming = self.forming.get(entry_id)
+                    if forming is not None:
+                        forming.high = max(forming.high, high)
+                        forming.low = min(forming.low, low)
+                        forming.close = price
+            for con_id, price in prices.items():
+                for entry_id in self.by_con_id.get(con_id, ()):
+                    self.evaluate(entry_id, price)
+            if time.monotonic() - self.reported >= self.checkpoint_interval:
+                self.report()
+
+    def report(self):
+        """Send every strategy's state to the gateway for its checkpoints"""
+        for entry_id, (name, adapter, contract) in self.entries.items():
+            self.outbox.put(('state', entry_id, adapter.strategy.state()))
+        self.reported = time.monotonic()
+
+    def handle(self, message):
+        kind = message[0]
+        if kind == 'add':
+            _, entry_id, name, params, contract, state, history, closed, forming = message
+            adapter = WORKER_STRATEGIES[name](**params)
+            if state is not None:
+                adapter.strategy.restore(state)
+            if history is not None:
+                adapter.strategy.update(history)
+            for bar in closed:
+                adapter.strategy.add_bar(bar)
+            self.entries[entry_id] = (name, adapter, contract)
+            # Ticks before this point are already in the seeded bars
+            self.seen.setdefault(contract.conId, self.bus.sequence(self.bus.slot(contract.conId)))
+            self.by_con_id.setdefault(contract.conId, []).append(entry_id)
+            self.forming[entry_id] = forming
+            self.busy[entry_id] = asyncio.Lock()
+            logger.info(f"Worker {self.worker_id}: {name} strategy running for {contract.symbol}")
+        elif kind == 'position':
+            _, con_id, position = message
+            self.ctx.account.positions[con_id] = position
+        elif kind == 'equity':
+            self.ctx.account.equity = message[1]
+        elif kind == 'order_done':
+            _, intent_id, result = message
+            self.ctx.orders.done(intent_id, result)
+
+    def evaluate(self, entry_id, price):
+        # Skip ticks that arrive while a previous evaluation (and its order) is running
+        busy = self.busy[entry_id]
+        if busy.locked():
+            return
+        name, adapter, contract = self.entries[entry_id]
+
+        async def run():
+            if busy.locked():
+                return
+            async with busy:
+                try:
+                    await adapter.evaluate(self.ctx, contract, price, self.forming.get(entry_id), None)
+                except Exception as e:
+                    logger.error(f"Error in {contract.symbol} {name} worker loop: {e}")
+
+        task = asyncio.ensure_future(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+def worker_main(worker_id, inbox, outbox, bus_name):
+    asyncio.run(Worker(worker_id, inbox, outbox, bus_name).run())
+
+
+class Gateway:
+    def __init__(self, ctx, workers=None, instruments=1024, capacity=256):
+        """
+        Owns the IB connection (through a TradingContext) and fans market data and
+        account updates out to strategy worker processes sharded by symbol.
+        Quotes go through a shared-memory MarketDataBus, one market data line per contract;
+        bars, account updates and order results go through each worker's queue.
+        Workers send order intents back; the gateway places them and returns the results.
+        Workers also report their strategies' states, which go into the context's checkpoints.
+        """
+        self.ctx = ctx
+        self.workers = workers or multiprocessing.cpu_count()
+        self.bus_size = (instruments, capacity)
+        self.bus = None
+        self.inboxes = []  # one per worker
+        self.outbox = multiprocessing.Queue()  # order intents from every worker
+        self.processes = []
+        self.routes = {}  # conId -> worker index
+        self.added = set()  # entry ids seeded in their worker
+        self.states = {}  # entry id -> last state reported by its worker
+        self.releases = []  # callbacks undoing subscriptions
+        self.reader = None
+        self.tasks = set()
+
+    def start(self):
+        self.bus = MarketDataBus(instruments=self.bus_size[0], capacity=self.bus_size[1])
+        for worker_id in range(self.workers):
+            inbox = multiprocessing.Queue()
+            process = multiprocessing.Process(target=worker_main, args=(worker_id, inbox, self.outbox, self.bus.name),
+                                              daemon=True)
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+        self.ctx.ib.positionEvent += self.on_position
+        self.ctx.ib.accountValueEvent += self.on_account_value
+        self.reader = threading.Thread(target=self.read, args=(asyncio.get_running_loop(),), daemon=True)
+        self.reader.start()
+        logger.info(f"Started {self.workers} strategy workers")
+
+    def send(self, worker, message):
+        self.inboxes[worker].put(message)
+
+    def on_position(self, position):
+        worker = self.routes.get(position.contract.conId)
+        if worker is not None:
+            self.send(worker, ('position', position.contract.conId, self.ctx.account.position(position.contract)))
+
+    def on_account_value(self, value):
+        if value.tag == 'NetLiquidation':
+            for worker in range(self.workers):
+                self.send(worker, ('equity', self.ctx.account.equity))
+
+    async def resync(self):
+        """Send every worker the account state reloaded after a reconnect"""
+        for con_id, worker in self.routes.items():
+            position = self.ctx.account.positions.get(con_id)
+            self.send(worker, ('position', con_id, position.position if position is not None else 0))
+        for worker in range(self.workers):
+            self.send(worker, ('equity', self.ctx.account.equity))
+
+    async def add(self, entry_id, entry, contract):
+        """Seed one (strategy, symbol) entry in its worker and start forwarding its data"""
+        ctx = self.ctx
+        adapter = WORKER_STRATEGIES[entry['strategy']]
+        worker = shard(contract.symbol, self.workers)
+        con_id = contract.conId
+
+        def on_bar(bars):
+            # bars[-2] just closed and bars[-1] is forming; bars closing during startup go with 'add'
+            if len(bars) > 1 and entry_id in self.added:
+                self.send(worker, ('bar', entry_id, bars[-2], bars[-1]))
+
+        async with ctx.startup:
+            params = entry.get('params', {})
+            checkpoint = adapter.checkpoint_key(contract.symbol, **params)
+            state = ctx.checkpoints.get(checkpoint)
+            live_bars = await ctx.subscriptions.local_bars(contract, adapter.live_duration, adapter.bar_size, on_bar=on_bar)
+            self.releases.append(lambda: ctx.subscriptions.release_local_bars(contract, adapter.bar_size, on_bar=on_bar))
+            history = None
+            if state is None or state['last_bar_date'] is None or state['last_bar_date'] < to_epoch(live_bars[0].date):
+                # No checkpoint, or one older than the live bars: seed from the bar cache
+                history = await adapter.history(ctx.ib, contract, ctx.store)
+            self.routes[con_id] = worker
+            self.send(worker, ('position', con_id, ctx.account.position(contract)))
+            self.send(worker, ('equity', ctx.account.equity))
+            self.bus.feed(ctx.subscriptions, contract)
+            self.releases.append(lambda: self.bus.release(contract))
+            self.send(worker, ('add', entry_id, entry['strategy'], params, contract,
+                               state, history, list(live_bars[:-1]), live_bars[-1]))
+            self.added.add(entry_id)
+            ctx.checkpoints.register(checkpoint, lambda: self.states.get(entry_id, state))
+
+    def read(self, loop):
+        """Outbox reader thread: keeps reported states and hands order intents to the event loop"""
+        while True:
+            message = self.outbox.get()
+            if message is None:
+                return
+            if message[0] == 'state':
+                _, entry_id, state = message
+                self.states[entry_id] = state
+            else:
+                loop.call_soon_threadsafe(self.on_intent, message)
+
+    def on_intent(self, message):
+        task = asyncio.ensure_future(self.place(*message[1:]))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def place(self, worker, intent_id, contract, order, options):
+        try:
+            result = await self.ctx.orders.place(contract, order, **options)
+            while result['status'] == 'Timeout':
+                # Workers only see final results, so they never act next to a live order
+                result = await self.ctx.orders.wait(result['trade'], reference_price=options.get('reference_price'))
+            result = {key: value for key, value in result.items() if key != 'trade'}
+        except Exception as e:
+            logger.error(f"Order intent for {contract.symbol} failed: {e}")
+            result = {'status': 'Error', 'filled': 0.0, 'avg_fill_price': None, 'slippage': None, 'latency': None}
+        if result['filled']:
+            # The fill is in the account already; the worker sees it before the result
+            self.send(worker, ('position', contract.conId, self.ctx.account.position(contract)))
+        self.send(worker, ('order_done', intent_id, result))
+
+    def close(self):
+        for release in self.releases:
+            release()
+        self.releases.clear()
+        self.ctx.ib.positionEvent -= self.on_position
+        self.ctx.ib.accountValueEvent -= self.on_account_value
+        for inbox in self.inboxes:
+            inbox.put(('stop',))
+        for task in self.tasks:
+            task.cancel()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        # Workers report their final states on stop; read them before the reader exits
+        if self.reader is not None:
+            self.outbox.put(None)
+            self.reader.join(timeout=5)
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+        logger.info("Stopped strategy workers")
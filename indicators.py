@@ -0,0 +1,241 @@
+import math
+from collections import deque
+
+class EMA:
+    def __init__(self, span):
+        """
+        Incremental Exponential Moving Average
+        Matches pd.Series(prices).ewm(span=span, adjust=False).mean() value for value
+        """
+        self.span = span
+        self.alpha = 2.0 / (span + 1)
+        self.value = None
+        self.count = 0
+
+    def update(self, price):
+        """Add a closed bar and return the new EMA"""
+        price = float(price)
+        if self.value is None:
+            self.value = price
+        else:
+            self.value += self.alpha * (price - self.value)
+        self.count += 1
+        return self.value
+
+    def preview(self, price):
+        """EMA if `price` closed the next bar, without changing state"""
+        price = float(price)
+        if self.value is None:
+            return price
+        return self.value + self.alpha * (price - self.value)
+
+    def seed(self, prices):
+        """Feed a history of closes, oldest first"""
+        for price in prices:
+            self.update(price)
+        return self.value
+
+    def state(self):
+        """Incremental state as plain values, for checkpoints"""
+        return {'value': self.value, 'count': self.count}
+
+    def restore(self, state):
+        self.value = state['value']
+        self.count = state['count']
+
+
+class MACD:
+    def __init__(self, fast_period=12, slow_period=26, signal_period=9):
+        """
+        Incremental MACD: O(1) per bar instead of three ewm() passes over the history
+        """
+        self.fast = EMA(fast_period)
+        self.slow = EMA(slow_period)
+        self.signal = EMA(signal_period)
+        self.histogram = None
+        self.prev_histogram = None
+
+    def update(self, price):
+        """Add a closed bar and return the MACD snapshot"""
+        macd_line = self.fast.update(price) - self.slow.update(price)
+        signal_line = self.signal.update(macd_line)
+        self.prev_histogram = self.histogram
+        self.histogram = macd_line - signal_line
+        return self.snapshot()
+
+    def preview(self, price):
+        """MACD snapshot if `price` closed the next bar, without changing state"""
+        macd_line = self.fast.preview(price) - self.slow.preview(price)
+        signal_line = self.signal.preview(macd_line)
+        return {
+            'macd_line': macd_line,
+            'signal_line': signal_line,
+            'histogram': macd_line - signal_line,
+            'prev_histogram': self.histogram if self.histogram is not None else 0
+        }
+
+    def seed(self, prices):
+        """Feed a history of closes, oldest first"""
+        for price in prices:
+            self.update(price)
+        return self.snapshot()
+
+    def state(self):
+        return {
+            'fast': self.fast.state(),
+            'slow': self.slow.state(),
+            'signal': self.signal.state(),
+            'histogram': self.histogram,
+            'prev_histogram': self.prev_histogram
+        }
+
+    def restore(self, state):
+        self.fast.restore(state['fast'])
+        self.slow.restore(state['slow'])
+        self.signal.restore(state['signal'])
+        self.histogram = state['histogram']
+        self.prev_histogram = state['prev_histogram']
+
+    def snapshot(self):
+        """Same dict MACDStrategy.calculate_macd returns"""
+        if self.histogram is None:
+            return None
+        return {
+            'macd_line': self.fast.value - self.slow.value,
+            'signal_line': self.signal.value,
+            'histogram': self.histogram,
+            'prev_histogram': self.prev_histogram if self.prev_histogram is not None else 0
+        }
+
+
+class RollingMax:
+    def __init__(self, period):
+        """
+        Rolling maximum over the last `period` values using a monotonic deque
+        Amortized O(1) per update; NaN until the window is full, like pandas rolling()
+        """
+        self.period = period
+        self.window = deque()  # (index, value) with decreasing values
+        self.count = 0
+
+    def _better(self, a, b):
+        return a >= b
+
+    def update(self, value):
+        value = float(value)
+        window = self.window
+        while window and self._better(value, window[-1][1]):
+            window.pop()
+        window.append((self.count, value))
+        self.count += 1
+        if window[0][0] <= self.count - 1 - self.period:
+            window.popleft()
+        return self.value
+
+    @property
+    def value(self):
+        if self.count < self.period:
+            return math.nan
+        return self.window[0][1]
+
+    def preview(self, value):
+        """Window value if `value` were added next, without changing state"""
+        if self.count + 1 < self.period:
+            return math.nan
+        value = float(value)
+        window = self.window
+        # Only the oldest entry can fall out of the window when one value is added
+        if window and window[0][0] <= self.count - self.period:
+            best = window[1][1] if len(window) > 1 else value
+        else:
+            best = window[0][1] if window else value
+        return value if self._better(value, best) else best
+
+    def state(self):
+        return {'window': [list(item) for item in self.window], 'count': self.count}
+
+    def restore(self, state):
+        self.window = deque((index, value) for index, value in state['window'])
+        self.count = state['count']
+
+
+class RollingMin(RollingMax):
+    """Rolling minimum over the last `period` values using a monotonic deque"""
+
+    def _better(self, a, b):
+        return a <= b
+
+
+class Donchian:
+    def __init__(self, period=20):
+        """
+        Streaming Donchian Channels
+        Upper is the highest high and lower the lowest low of the last `period` bars
+        """
+        self.period = period
+        self.highs = RollingMax(period)
+        self.lows = RollingMin(period)
+        self.prev_upper = math.nan
+        self.prev_lower = math.nan
+
+    @property
+    def upper(self):
+        return self.highs.value
+
+    @property
+    def lower(self):
+        return self.lows.value
+
+    @property
+    def middle(self):
+        return (self.upper + self.lower) / 2
+
+    def update(self, high, low):
+        """Add a closed bar and return the channel snapshot"""
+        self.prev_upper = self.upper
+        self.prev_lower = self.lower
+        self.highs.update(high)
+        self.lows.update(low)
+        return self.snapshot()
+
+    def preview(self, high, low):
+        """Channel snapshot if the bar closed now, without changing state"""
+        upper = self.highs.preview(high)
+        lower = self.lows.preview(low)
+        return {
+            'upper': upper,
+            'lower': lower,
+            'middle': (upper + lower) / 2,
+            'prev_upper': self.upper,
+            'prev_lower': self.lower
+        }
+
+    def seed(self, highs, lows):
+        """Feed a history of highs and lows, oldest first"""
+        for high, low in zip(highs, lows):
+            self.update(high, low)
+        return self.snapshot()
+
+    def state(self):
+        return {
+            'highs': self.highs.state(),
+            'lows': self.lows.state(),
+            'prev_upper': self.prev_upper,
+            'prev_lower': self.prev_lower
+        }
+
+    def restore(self, state):
+        self.highs.restore(state['highs'])
+        self.lows.restore(state['lows'])
+        self.prev_upper = state['prev_upper']
+        self.prev_lower = state['prev_lower']
+
+    def snapshot(self):
+        """Same dict DonchianStrategy.calculate_channels returns"""
+        return {
+            'upper': self.upper,
+            'lower': self.lower,
+            'middle': self.middle,
+            'prev_upper': self.prev_upper,
+            'prev_lower': self.prev_lower
+        }
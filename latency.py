@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Stages of one evaluation, in order; each is timed from the previous one
+STAGES = ('indicator', 'signal', 'submit', 'ack', 'fill')
+
+class Histogram:
+    # Log-spaced buckets, four per doubling, from 1 microsecond to about 100 seconds
+    MIN = 1e-6
+    LOG_RATIO = math.log(2) / 4
+    BUCKETS = 108
+
+    def __init__(self):
+        """Fixed log-bucket histogram of durations in seconds; recording is O(1)"""
+        self.counts = [0] * (self.BUCKETS + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bound(cls, i):
+        """Upper bound in seconds of bucket i"""
+        return cls.MIN * math.exp(i * cls.LOG_RATIO) if i < cls.BUCKETS else math.inf
+
+    def record(self, seconds):
+        if seconds <= self.MIN:
+            i = 0
+        else:
+            i = min(math.ceil(math.log(seconds / self.MIN) / self.LOG_RATIO), self.BUCKETS)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (within 19% of the true value)"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(self.bound(i), self.max)
+        return self.max
+
+
+class Trace:
+    __slots__ = ('recorder', 'strategy', 'symbol', 'start', 'last')
+
+    def __init__(self, recorder, strategy, symbol, start=None):
+        """Timestamps of one tick's way through a strategy, starting at market data receipt"""
+        self.recorder = recorder
+        self.strategy = strategy
+        self.symbol = symbol
+        self.start = self.last = time.perf_counter() if start is None else start
+
+    def mark(self, stage):
+        """Record the time since the previous stage; at 'fill' also the whole tick-to-fill time"""
+        now = time.perf_counter()
+        self.recorder.record(self.strategy, self.symbol, stage, now - self.last)
+        if stage == 'fill':
+            self.recorder.record(self.strategy, self.symbol, 'tick_to_fill', now - self.start)
+        self.last = now
+
+
+class LatencyRecorder:
+    def __init__(self, enabled=True):
+        """
+        Latency histograms per (strategy, symbol, stage), fed by Traces on the hot path.
+        Exported in Prometheus text format to a file or over HTTP.
+        """
+        self.enabled = enabled
+        self.histograms = {}
+        self.server = None
+
+    def trace(self, strategy, symbol):
+        """Start a trace at market data receipt; None when disabled"""
+        return Trace(self, strategy, symbol) if self.enabled else None
+
+    def record(self, strategy, symbol, stage, seconds):
+        key = (strategy, symbol, stage)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.record(seconds)
+
+    def summary(self):
+        """{(strategy, symbol, stage): {'count', 'p50', 'p99', 'max'}} in seconds"""
+        return {key: {'count': h.count, 'p50': h.quantile(0.5), 'p99': h.quantile(0.99), 'max': h.max}
+                for key, h in self.histograms.items()}
+
+    def prometheus(self):
+        """All histograms in Prometheus text exposition format"""
+        lines = [
+            '# HELP trade_latency_seconds Time spent in each stage from tick to fill',
+            '# TYPE trade_latency_seconds histogram'
+        ]
+        for (strategy, symbol, stage), h in sorted(self.histograms.items()):
+            labels = f'strategy="{strategy}",symbol="{symbol}",stage="{stage}"'
+            cumulative = 0
+            for i, count in enumerate(h.counts):
+                cumulative += count
+                # Export one bound per doubling to keep the series count down
+                if i % 4 == 0 or i == Histogram.BUCKETS:
+                    le = '+Inf' if i == Histogram.BUCKETS else f'{Histogram.bound(i):.6g}'
+                    lines.append(f'trade_latency_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'trade_latency_seconds_sum{{{labels}}} {h.sum:.9f}')
+            lines.append(f'trade_latency_seconds_count{{{labels}}} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the metrics file atomically, e.g. for the node_exporter textfile collector"""
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+    async def serve(self, port=9100, host='127.0.0.1'):
+        """Serve the metrics over HTTP for Prometheus to scrape"""
+        async def handle(reader, writer):
+            try:
+                await reader.readuntil(b'\r\n\r\n')
+                body = self.prometheus().encode()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        self.server = await asyncio.start_server(handle, host, port)
+        logger.info(f"Serving latency metrics on http://{host}:{port}/metrics")
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
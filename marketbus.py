@@ -0,0 +1,168 @@
+import logging
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Fields of each ring, in order; TIME is epoch seconds
+FIELDS = ('bid', 'ask', 'last', 'size', 'time')
+BID, ASK, LAST, SIZE, TIME = range(len(FIELDS))
+
+HEADER = 3  # int64s: instruments, capacity, registered
+
+def number(value):
+    """Ticker field as a float, NaN when unset"""
+    return float('nan') if value is None else float(value)
+
+class MarketDataBus:
+    def __init__(self, name=None, instruments=1024, capacity=256, create=True):
+        """
+        Quotes for many instruments in one shared-memory block, written by the process
+        holding the IB connection and read by any number of local processes without
+        pickling. Each instrument has a fixed ring of `capacity` entries laid out as
+        a struct of arrays (bid, ask, last, size, time) and a sequence number counting
+        every entry published; the sequence is written after the entry, so a reader
+        that sees it can read the entry.
+        Layout: header, sequences[instruments], con_ids[instruments],
+                rings[instruments, len(FIELDS), capacity] (float64).
+        """
+        if create:
+            size = 8 * (HEADER + 2 * instruments + instruments * len(FIELDS) * capacity)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            instruments, capacity = (int(n) for n in np.ndarray((2,), np.int64, self.shm.buf))
+        self.owner = create
+        self.instruments = instruments
+        self.capacity = capacity
+        buf = self.shm.buf
+        self.header = np.ndarray((HEADER,), np.int64, buf)
+        self.sequences = np.ndarray((instruments,), np.int64, buf, 8 * HEADER)
+        self.con_ids = np.ndarray((instruments,), np.int64, buf, 8 * (HEADER + instruments))
+        self.rings = np.ndarray((instruments, len(FIELDS), capacity), np.float64, buf,
+                                8 * (HEADER + 2 * instruments))
+        if create:
+            self.header[:] = (instruments, capacity, 0)
+        self.slots = {}  # conId -> slot
+        self.feeds = {}  # conId -> number of feed() calls
+        self.subscriptions = None
+
+    @classmethod
+    def attach(cls, name):
+        """Open an existing bus by name for reading"""
+        return cls(name=name, create=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # Writer side
+
+    def register(self, con_id):
+        """Slot of a contract, allocating the next free one on first use"""
+        slot = self.slots.get(con_id)
+        if slot is None:
+            slot = int(self.header[2])
+            if slot >= self.instruments:
+                raise RuntimeError(f"Market data bus is full ({self.instruments} instruments)")
+            self.con_ids[slot] = con_id
+            self.header[2] = slot + 1
+            self.slots[con_id] = slot
+        return slot
+
+    def publish(self, slot, bid, ask, last, size, timestamp):
+        seq = int(self.sequences[slot])
+        self.rings[slot, :, seq % self.capacity] = (bid, ask, last, size, timestamp)
+        self.sequences[slot] = seq + 1
+
+    def on_tick(self, ticker):
+        slot = self.slots.get(ticker.contract.conId)
+        if slot is None:
+            return
+        last = ticker.last if ticker.last else ticker.close
+        timestamp = ticker.time.timestamp() if ticker.time else time.time()
+        self.publish(slot, number(ticker.bid), number(ticker.ask), number(last),
+                     number(ticker.lastSize), timestamp)
+
+    def feed(self, subscriptions, contract):
+        """Publish a contract's quotes, sharing the market data line with in-process users"""
+        con_id = contract.conId
+        self.register(con_id)
+        if not self.feeds.get(con_id):
+            subscriptions.market_data(contract, on_tick=self.on_tick)
+            self.feeds[con_id] = 0
+        self.feeds[con_id] += 1
+        self.subscriptions = subscriptions
+
+    def release(self, contract):
+        """Drop one feed() reference; quotes stop with the last one (the slot is kept)"""
+        con_id = contract.conId
+        if not self.feeds.get(con_id):
+            return
+        self.feeds[con_id] -= 1
+        if not self.feeds[con_id]:
+            del self.feeds[con_id]
+            self.subscriptions.release_market_data(contract, on_tick=self.on_tick)
+
+    # Reader side
+
+    def slot(self, con_id):
+        """Slot of a contract registered by the writer, or None"""
+        slot = self.slots.get(con_id)
+        if slot is None:
+            registered = int(self.header[2])
+            matches = np.flatnonzero(self.con_ids[:registered] == con_id)
+            if not len(matches):
+                return None
+            slot = self.slots[con_id] = int(matches[0])
+        return slot
+
+    def sequence(self, slot):
+        """Number of entries published so far"""
+        return int(self.sequences[slot])
+
+    def ring(self, slot):
+        """The instrument's ring as a (len(FIELDS), capacity) view; entry n is at column n % capacity"""
+        return self.rings[slot]
+
+    def latest(self, slot):
+        """(sequence, {field: value}) of the newest entry; (0, {}) before the first"""
+        while True:
+            seq = int(self.sequences[slot])
+            if not seq:
+                return 0, {}
+            row = self.rings[slot, :, (seq - 1) % self.capacity].tolist()
+            # Retry if the writer lapped the ring while the entry was read
+            if int(self.sequences[slot]) - seq < self.capacity - 1:
+                return seq, dict(zip(FIELDS, row))
+
+    def since(self, slot, seq, field=LAST):
+        """
+        Values of one field published after sequence `seq`, oldest first, and the new sequence.
+        A view into the ring unless it wraps; entries lapped by the writer are skipped.
+        Read the values before the writer can lap them again.
+        """
+        end = int(self.sequences[slot])
+        start = max(seq, end - self.capacity + 1)
+        values = self.rings[slot, field]
+        lo, hi = start % self.capacity, end % self.capacity
+        if start == end:
+            return end, values[:0]
+        if lo < hi:
+            return end, values[lo:hi]
+        return end, np.concatenate([values[lo:], values[:hi]])
+
+    def close(self):
+        """Detach; the writer also frees the shared memory"""
+        if self.subscriptions is not None:
+            for con_id in list(self.feeds):
+                ticker = self.subscriptions.tickers.get(con_id)
+                if ticker is not None:
+                    self.subscriptions.release_market_data(ticker.contract, on_tick=self.on_tick)
+            self.feeds.clear()
+        # Drop the views before closing the buffer they point into
+        self.header = self.sequences = self.con_ids = self.rings = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,160 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from ib_async import Option
+
+logger = logging.getLogger(__name__)
+
+def today():
+    return datetime.now().strftime('%Y%m%d')
+
+class ChainIndex:
+    def __init__(self, symbol, exchange, trading_class, multiplier, expirations, strikes, currency='USD', fetched=None):
+        """
+        Option chain of one underlying on one exchange.
+        Expirations are YYYYMMDD strings; strikes are kept as a sorted list per expiry
+        so lookups are binary searches.
+        reqSecDefOptParams reports the strikes of all expiries together, so a strike
+        listed here may not exist for every expiry; qualify before trading it.
+        """
+        self.symbol = symbol
+        self.exchange = exchange
+        self.trading_class = trading_class
+        self.multiplier = multiplier
+        self.currency = currency
+        self.fetched = fetched if fetched is not None else time.time()
+        self.expirations = sorted(expirations)
+        strikes = sorted(set(strikes))
+        self.strikes = {expiry: strikes for expiry in self.expirations}
+
+    def evict_expired(self, now=None):
+        """Drop expirations before today; returns how many remain"""
+        start = bisect.bisect_left(self.expirations, now or today())
+        for expiry in self.expirations[:start]:
+            del self.strikes[expiry]
+        self.expirations = self.expirations[start:]
+        return len(self.expirations)
+
+    def nearest_expiry(self, on_or_after=None):
+        """First expiry on or after a YYYYMMDD date (default today)"""
+        i = bisect.bisect_left(self.expirations, on_or_after or today())
+        return self.expirations[i] if i < len(self.expirations) else None
+
+    def nearest_strikes(self, expiry, price, count=1):
+        """The `count` strikes closest to price, closest first"""
+        strikes = self.strikes[expiry]
+        hi = bisect.bisect_left(strikes, price)
+        lo = hi - 1
+        nearest = []
+        while len(nearest) < count and (lo >= 0 or hi < len(strikes)):
+            if hi >= len(strikes) or (lo >= 0 and price - strikes[lo] <= strikes[hi] - price):
+                nearest.append(strikes[lo])
+                lo -= 1
+            else:
+                nearest.append(strikes[hi])
+                hi += 1
+        return nearest
+
+    def nearest_strike(self, expiry, price):
+        nearest = self.nearest_strikes(expiry, price)
+        return nearest[0] if nearest else None
+
+    def strike_range(self, expiry, low, high):
+        """Strikes between low and high inclusive"""
+        strikes = self.strikes[expiry]
+        return strikes[bisect.bisect_left(strikes, low):bisect.bisect_right(strikes, high)]
+
+    def option(self, expiry, strike, right):
+        """Unqualified Option contract for this chain"""
+        return Option(self.symbol, expiry, strike, right, self.exchange, self.multiplier,
+                      self.currency, tradingClass=self.trading_class)
+
+    def to_dict(self):
+        return {
+            'symbol': self.symbol,
+            'exchange': self.exchange,
+            'trading_class': self.trading_class,
+            'multiplier': self.multiplier,
+            'currency': self.currency,
+            'fetched': self.fetched,
+            'expirations': self.expirations,
+            'strikes': self.strikes[self.expirations[0]] if self.expirations else []
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['symbol'], data['exchange'], data['trading_class'], data['multiplier'],
+                   data['expirations'], data['strikes'], data['currency'], data['fetched'])
+
+
+class OptionChains:
+    def __init__(self, directory='.optioncache', max_age=86400):
+        """
+        Option chains from reqSecDefOptParams, cached on disk per underlying conId.
+        Expired expirations are evicted on load; a chain is fetched again once it is
+        older than max_age seconds or has no expirations left.
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.chains = {}
+        self.locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, con_id, exchange):
+        return os.path.join(self.directory, f"{con_id}_{exchange}.json")
+
+    def load(self, con_id, exchange):
+        path = self.path(con_id, exchange)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return ChainIndex.from_dict(json.load(f))
+
+    def save(self, con_id, chain):
+        """Write the chain atomically so a crash never leaves a torn file"""
+        path = self.path(con_id, chain.exchange)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(chain.to_dict(), f)
+        os.replace(tmp, path)
+
+    def fresh(self, chain):
+        return (chain is not None and chain.evict_expired() > 0
+                and time.time() - chain.fetched < self.max_age)
+
+    async def fetch(self, ib, underlying, exchange):
+        params = await ib.reqSecDefOptParamsAsync(underlying.symbol, '', underlying.secType, underlying.conId)
+        # One entry per exchange and trading class; prefer the standard class, which
+        # has the underlying's symbol and the most expirations
+        matches = [p for p in params if p.exchange == exchange]
+        if not matches:
+            return None
+        best = max(matches, key=lambda p: (p.tradingClass == underlying.symbol, len(p.expirations)))
+        return ChainIndex(underlying.symbol, exchange, best.tradingClass, best.multiplier,
+                          best.expirations, best.strikes, underlying.currency)
+
+    async def get(self, ib, underlying, exchange='SMART'):
+        """
+        Option chain for a qualified underlying contract, from memory, disk or IB.
+        Returns None if IB lists no options for it on that exchange.
+        """
+        key = (underlying.conId, exchange)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            chain = self.chains.get(key)
+            if not self.fresh(chain):
+                chain = self.load(*key)
+            if not self.fresh(chain):
+                chain = await self.fetch(ib, underlying, exchange)
+                if chain is None:
+                    logger.error(f"No {exchange} option chain for {underlying.symbol}")
+                    return None
+                chain.evict_expired()
+                self.save(underlying.conId, chain)
+                logger.debug(f"{underlying.symbol} option chain: {len(chain.expirations)} expirations")
+            self.chains[key] = chain
+        return chain
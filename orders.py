@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import time
+from ib_async import OrderStatus
+from risk import RiskRejected
+
+logger = logging.getLogger(__name__)
+
+# Statuses an order never leaves; rejected orders end Inactive, which older ib_async
+# releases leave out of DoneStates
+DONE_STATES = OrderStatus.DoneStates | {'Inactive'}
+
+class OrderManager:
+    def __init__(self, ib, timeout=60, cancel_on_timeout=True, cancel_grace=5, risk=None):
+        """
+        Places orders and waits on the Trade's status events instead of polling isDone().
+        Each place() call only waits for its own order, so strategies can keep several
+        orders in flight at once.
+        risk: RiskGate every order has to pass before it is placed.
+        """
+        self.ib = ib
+        self.risk = risk
+        self.timeout = timeout
+        self.cancel_on_timeout = cancel_on_timeout
+        self.cancel_grace = cancel_grace
+        self.open_trades = {}  # orderId -> Trade
+        self.listeners = {}  # orderId -> status handler
+        self.futures = {}  # orderId -> future resolved when the order is done
+
+    def submit(self, contract, order, trace=None, reference_price=None):
+        """
+        Place an order and return (trade, future) where the future resolves when it is done.
+        trace: latency Trace marked at submit, broker ack and fill.
+        Raises RiskRejected if the risk gate refuses the order.
+        """
+        if self.risk is not None:
+            self.risk.approve(contract, order, reference_price)
+        try:
+            trade = self.ib.placeOrder(contract, order)
+        except Exception:
+            if self.risk is not None:
+                self.risk.done(contract, order, 0)
+            raise
+        future = asyncio.get_running_loop().create_future()
+        self.open_trades[order.orderId] = trade
+        acked = False
+        if trace is not None:
+            trace.mark('submit')
+
+        def on_status(trade):
+            nonlocal acked
+            if trace is not None and not acked and trade.orderStatus.status not in ('', 'PendingSubmit'):
+                acked = True
+                trace.mark('ack')
+            if trade.orderStatus.status in DONE_STATES and not future.done():
+                if trace is not None and trade.orderStatus.status == 'Filled':
+                    trace.mark('fill')
+                future.set_result(trade)
+
+        trade.statusEvent += on_status
+        self.listeners[order.orderId] = on_status
+        self.futures[order.orderId] = future
+        future.add_done_callback(lambda _: self._forget(order.orderId))
+        on_status(trade)
+        return trade, future
+
+    def _forget(self, order_id):
+        trade = self.open_trades.pop(order_id, None)
+        on_status = self.listeners.pop(order_id, None)
+        self.futures.pop(order_id, None)
+        if trade is not None:
+            trade.statusEvent -= on_status
+            if self.risk is not None:
+                self.risk.done(trade.contract, trade.order, trade.filled(),
+                               trade.orderStatus.avgFillPrice if trade.fills else None)
+
+    def resync(self):
+        """
+        After a reconnect, follow in-flight orders through the Trades IB reports for the
+        new session (open and completed orders are fetched on connect), matched by permId.
+        Orders that finished while disconnected resolve here.
+        """
+        current = {trade.order.permId: trade for trade in self.ib.trades() if trade.order.permId}
+        for order_id, old in list(self.open_trades.items()):
+            new = current.get(old.order.permId)
+            if new is None:
+                logger.warning(f"Order {order_id} for {old.contract.symbol} unknown after reconnect")
+                continue
+            on_status = self.listeners[order_id]
+            old.statusEvent -= on_status
+            new.statusEvent += on_status
+            self.open_trades[order_id] = new
+            on_status(new)
+
+    def pending(self):
+        """In-flight orders as plain values, for checkpoints"""
+        return [{
+            'order_id': order_id,
+            'perm_id': trade.order.permId,
+            'symbol': trade.contract.symbol,
+            'con_id': trade.contract.conId,
+            'action': trade.order.action,
+            'quantity': trade.order.totalQuantity,
+            'filled': trade.filled(),
+            'status': trade.orderStatus.status
+        } for order_id, trade in self.open_trades.items()]
+
+    def reconcile(self, pending):
+        """Log what became of orders that were in flight when the last checkpoint was taken"""
+        current = {trade.order.permId: trade for trade in self.ib.trades() if trade.order.permId}
+        for order in pending:
+            trade = current.get(order['perm_id'])
+            status = f"now {trade.orderStatus.status}, {trade.filled()} filled" if trade is not None else "not reported by IB"
+            logger.warning(f"{order['action']} {order['quantity']} {order['symbol']} (order {order['order_id']}) "
+                           f"was in flight at the last checkpoint: {status}")
+
+    async def place(self, contract, order, timeout=None, cancel_on_timeout=None, reference_price=None, trace=None):
+        """
+        Place an order and wait until it is filled, cancelled or rejected.
+        On timeout the order is cancelled (unless cancel_on_timeout=False).
+        reference_price: price the decision was made at, used for slippage.
+        trace: latency Trace of the tick that led to this order.
+        Returns a dict with the trade, final status, filled quantity, average fill price,
+        slippage (positive = paid more than the reference) and submit-to-done latency.
+        The status is 'Timeout' when the order may still be working (not cancelled, or
+        the cancel not confirmed); wait() follows it from there.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        cancel_on_timeout = self.cancel_on_timeout if cancel_on_timeout is None else cancel_on_timeout
+        started = time.monotonic()
+        try:
+            trade, future = self.submit(contract, order, trace, reference_price)
+        except RiskRejected as e:
+            logger.warning(f"{order.action} {order.totalQuantity} {contract.symbol} rejected by risk check: {e}")
+            return {'trade': None, 'status': 'RiskRejected', 'filled': 0.0, 'avg_fill_price': None,
+                    'slippage': None, 'latency': time.monotonic() - started}
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{order.action} order for {contract.symbol} not done after {timeout}s")
+            if cancel_on_timeout:
+                # The Trade is replaced if the connection was re-established meanwhile
+                self.ib.cancelOrder(self.open_trades.get(order.orderId, trade).order)
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), self.cancel_grace)
+                except asyncio.TimeoutError:
+                    logger.error(f"Cancel of {contract.symbol} order {order.orderId} not confirmed")
+        return self.outcome(future, trade, reference_price, started)
+
+    async def wait(self, trade, timeout=None, reference_price=None):
+        """
+        Keep waiting for an order place() returned as 'Timeout'.
+        Returns the same dict as place(), again 'Timeout' if it is still not done.
+        """
+        started = time.monotonic()
+        future = self.futures.get(trade.order.orderId)
+        if future is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.timeout if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.outcome(future, trade, reference_price, started)
+
+    def outcome(self, future, trade, reference_price, started):
+        if future is None or future.done():
+            # The future holds the Trade, replaced if the connection was re-established meanwhile
+            trade = future.result() if future is not None else trade
+            return self.result(trade, reference_price, time.monotonic() - started)
+        trade = self.open_trades.get(trade.order.orderId, trade)
+        result = self.result(trade, reference_price, time.monotonic() - started)
+        result['status'] = 'Timeout'
+        return result
+
+    @staticmethod
+    def result(trade, reference_price=None, latency=None):
+        status = trade.orderStatus
+        avg_fill_price = status.avgFillPrice if trade.fills else None
+        slippage = None
+        if avg_fill_price and reference_price:
+            sign = 1 if trade.order.action == 'BUY' else -1
+            slippage = sign * (avg_fill_price - reference_price)
+        return {
+            'trade': trade,
+            'status': status.status,
+            'filled': trade.filled(),
+            'avg_fill_price': avg_fill_price,
+            'slippage': slippage,
+            'latency': latency
+        }
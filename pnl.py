@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('dailyPnL', 'unrealizedPnL', 'realizedPnL', 'value')
+
+def values(pnl):
+    """PnL fields of a PnL/PnLSingle as a tuple, with IB's unset NaNs as 0"""
+    row = (getattr(pnl, field, 0.0) for field in FIELDS)
+    return tuple(0.0 if math.isnan(value) else value for value in row)
+
+class PnLMonitor:
+    def __init__(self, ib, strategies=None):
+        """
+        Live PnL from reqPnL/reqPnLSingle subscriptions, one per account and open position,
+        all requested at once and kept open. Totals by account, symbol and strategy are
+        adjusted on every update, so a snapshot costs no round trip.
+        strategies: {conId: strategy name} used for the by-strategy totals.
+        """
+        self.ib = ib
+        self.strategies = dict(strategies or {})
+        self.accounts = {}  # account -> PnL
+        self.singles = {}  # (account, conId) -> PnLSingle
+        self.contracts = {}  # conId -> Contract
+        self.last = {}  # (account, conId) -> values last added to the totals
+        self.by_account = {}
+        self.by_symbol = {}
+        self.by_strategy = {}
+        self.waiting = set()  # subscriptions without a first update yet
+        self.ready = asyncio.Event()
+        self.started = False
+
+    def tag(self, con_id, strategy):
+        """Attribute a contract's PnL to a strategy, moving what was booked under the old one"""
+        previous = self.strategies.get(con_id, '')
+        self.strategies[con_id] = strategy
+        if previous == strategy:
+            return
+        for (account, key_con_id), row in self.last.items():
+            if key_con_id != con_id:
+                continue
+            for name, sign in ((previous, -1), (strategy, 1)):
+                total = self.by_strategy.get(name, (0.0,) * len(FIELDS))
+                self.by_strategy[name] = tuple(t + sign * r for t, r in zip(total, row))
+
+    def start(self):
+        """Subscribe to account PnL and PnL of every open position"""
+        if self.started:
+            return
+        self.ib.pnlSingleEvent += self.on_single
+        self.ib.positionEvent += self.on_position
+        for account in self.ib.managedAccounts():
+            self.accounts[account] = self.ib.reqPnL(account)
+        for position in self.ib.positions():
+            self.on_position(position)
+        self.started = True
+        if not self.waiting:
+            self.ready.set()
+
+    def resync(self):
+        """Subscribe again after a reconnect; the old subscriptions died with the connection"""
+        if not self.started:
+            return
+        previous = set(self.singles)
+        self.accounts.clear()
+        self.singles.clear()
+        self.waiting.clear()
+        for account in self.ib.managedAccounts():
+            self.accounts[account] = self.ib.reqPnL(account)
+        for position in self.ib.positions():
+            self.on_position(position)
+        # Positions closed while disconnected no longer count
+        for key in previous - set(self.singles):
+            self.apply(key, (0.0,) * len(FIELDS))
+            del self.last[key]
+        if not self.waiting:
+            self.ready.set()
+
+    def on_position(self, position):
+        """Follow new positions and drop the subscription of closed ones"""
+        key = (position.account, position.contract.conId)
+        if position.position != 0 and key not in self.singles:
+            self.contracts[key[1]] = position.contract
+            self.waiting.add(key)
+            self.ready.clear()
+            self.singles[key] = self.ib.reqPnLSingle(position.account, '', key[1])
+        elif position.position == 0 and key in self.singles:
+            self.ib.cancelPnLSingle(position.account, '', key[1])
+            del self.singles[key]
+            self.apply(key, (0.0,) * len(FIELDS))
+            self.last.pop(key, None)
+            self.waiting.discard(key)
+            if not self.waiting:
+                self.ready.set()
+
+    def on_single(self, pnl):
+        key = (pnl.account, pnl.conId)
+        if key not in self.singles:
+            return
+        self.apply(key, values(pnl))
+        self.waiting.discard(key)
+        if not self.waiting:
+            self.ready.set()
+
+    def apply(self, key, new):
+        """Replace a position's contribution to the totals"""
+        old = self.last.get(key, (0.0,) * len(FIELDS))
+        self.last[key] = new
+        account, con_id = key
+        contract = self.contracts.get(con_id)
+        symbol = (contract.localSymbol or contract.symbol) if contract is not None else str(con_id)
+        strategy = self.strategies.get(con_id, '')
+        for totals, name in ((self.by_account, account), (self.by_symbol, symbol), (self.by_strategy, strategy)):
+            total = totals.get(name, (0.0,) * len(FIELDS))
+            totals[name] = tuple(t - o + n for t, o, n in zip(total, old, new))
+
+    async def wait_ready(self, timeout=5):
+        """Wait until every position subscription has reported once"""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"No PnL yet for {len(self.waiting)} positions")
+
+    def snapshot(self):
+        """
+        Current PnL without a round trip:
+        {'accounts': {account: {...}}, 'by_account'/'by_symbol'/'by_strategy': {name: {...}},
+         'positions': {(account, conId): {...}}}, each {...} keyed by dailyPnL, unrealizedPnL,
+        realizedPnL and value (market value; not reported for accounts).
+        """
+        def as_dicts(table):
+            return {name: dict(zip(FIELDS, row)) for name, row in table.items()}
+
+        return {
+            'accounts': {account: dict(zip(FIELDS[:3], values(pnl)[:3])) for account, pnl in self.accounts.items()},
+            'by_account': as_dicts(self.by_account),
+            'by_symbol': as_dicts(self.by_symbol),
+            'by_strategy': as_dicts(self.by_strategy),
+            'positions': as_dicts(self.last)
+        }
+
+    def close(self):
+        if not self.started:
+            return
+        self.ib.pnlSingleEvent -= self.on_single
+        self.ib.positionEvent -= self.on_position
+        for account in self.accounts:
+            self.ib.cancelPnL(account)
+        for account, con_id in self.singles:
+            self.ib.cancelPnLSingle(account, '', con_id)
+        self.accounts.clear()
+        self.singles.clear()
+        self.started = False
@@ -0,0 +1,180 @@
+import logging
+import time
+from ib_async.util import UNSET_DOUBLE
+from scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class RiskRejected(Exception):
+    """An order refused by the pre-trade risk check; the message says which limit"""
+
+
+class RiskGate:
+    def __init__(self, account=None, max_exposure=None, max_leverage=None, max_symbol_notional=None,
+                 max_order_notional=None, max_open_orders=None, max_order_rate=40):
+        """
+        Pre-trade risk check run on every order before it reaches placeOrder.
+        Keeps running counters so a check is a few dict lookups, whatever the
+        number of symbols and strategies:
+        - per symbol: position (the account's while none of our orders are working
+          on it, else the account's before they went out plus their fills), signed
+          quantity of working orders, last price and gross notional
+        - gross exposure (sum of the per-symbol notionals), open orders, and
+          working orders by (conId, action, quantity) to catch duplicates
+        - order messages through a token bucket
+        Orders that bring a position closer to flat only have to pass the
+        duplicate check, so stops and flattening are never held back.
+        Limits are in account currency; None disables one.
+        max_leverage: gross exposure as a multiple of the account's equity.
+        max_order_rate: orders per second, allowing bursts of as many.
+        """
+        self.account = account
+        self.max_exposure = max_exposure
+        self.max_leverage = max_leverage
+        self.max_symbol_notional = max_symbol_notional
+        self.max_order_notional = max_order_notional
+        self.max_open_orders = max_open_orders
+        self.bucket = TokenBucket(max_order_rate, max_order_rate) if max_order_rate else None
+        self.positions = {}  # conId -> position as we know it
+        self.working = {}  # conId -> signed quantity of working orders
+        self.prices = {}  # conId -> last price
+        self.multipliers = {}  # conId -> contract multiplier
+        self.notional = {}  # conId -> |position + working| * price * multiplier
+        self.exposure = 0.0
+        self.open_orders = 0
+        self.in_flight = {}  # (conId, action, quantity) -> working orders
+        self.rejected = 0
+
+    def load(self):
+        """Take positions and prices from the account; call after it has loaded and after a reconnect"""
+        self.positions.clear()
+        if self.account is not None:
+            for con_id, position in self.account.positions.items():
+                multiplier = self.multipliers[con_id] = float(position.contract.multiplier or 1)
+                self.positions[con_id] = position.position
+                item = self.account.portfolio.get(con_id)
+                if item is not None and item.marketPrice > 0:
+                    self.prices[con_id] = item.marketPrice
+                elif con_id not in self.prices and position.avgCost:
+                    # avgCost includes the multiplier
+                    self.prices[con_id] = position.avgCost / multiplier
+        for con_id in set(self.notional) | set(self.positions):
+            self.refresh(con_id)
+
+    def position(self, con_id):
+        # The account also sees fills from TWS, other clients and closepos; while our own
+        # orders work it may hold part of their fills, which `working` still counts
+        if self.account is not None and not self.working.get(con_id):
+            held = self.account.positions.get(con_id)
+            self.positions[con_id] = held.position if held is not None else 0
+        return self.positions.setdefault(con_id, 0)
+
+    def refresh(self, con_id):
+        """Recompute one symbol's notional and move the exposure total by the difference"""
+        price = self.prices.get(con_id)
+        held = self.position(con_id) + self.working.get(con_id, 0)
+        notional = abs(held) * price * self.multipliers.get(con_id, 1.0) if price else 0.0
+        self.exposure += notional - self.notional.get(con_id, 0.0)
+        self.notional[con_id] = notional
+
+    def price(self, contract, order, price=None):
+        """Price to value an order at: the decision price, else its limit, else the last one seen"""
+        if price:
+            return price
+        if 0 < order.lmtPrice < UNSET_DOUBLE:
+            return order.lmtPrice
+        return self.prices.get(contract.conId)
+
+    @staticmethod
+    def reduces(held, signed):
+        """Whether adding `signed` brings `held` closer to flat without flipping it"""
+        after = held + signed
+        return abs(after) <= abs(held) and after * held >= 0
+
+    def check(self, contract, order, price=None, now=None):
+        """Approve an order (returns None) or say why not"""
+        con_id = contract.conId
+        quantity = order.totalQuantity
+        signed = quantity if order.action == 'BUY' else -quantity
+        if self.in_flight.get((con_id, order.action, quantity)):
+            return f"same {order.action} {quantity} {contract.symbol} order already working"
+        # Picks up position changes from outside since this symbol was last seen
+        self.refresh(con_id)
+        position = self.positions[con_id]
+        held = position + self.working.get(con_id, 0)
+        after = held + signed
+        # Reducing either way, whether or not the working orders fill
+        if self.reduces(position, signed) and self.reduces(held, signed):
+            return None
+        price = self.price(contract, order, price)
+        if self.max_open_orders is not None and self.open_orders >= self.max_open_orders:
+            return f"{self.open_orders} orders already working (limit {self.max_open_orders})"
+        if self.bucket is not None and self.bucket.delay(now) > 0:
+            return f"order rate above {self.bucket.rate:g}/s"
+        if self.max_exposure is None and self.max_leverage is None and \
+                self.max_symbol_notional is None and self.max_order_notional is None:
+            return None
+        if not price or price != price:
+            return f"no price for {contract.symbol} to check notional limits"
+        multiplier = float(contract.multiplier or 1)
+        order_notional = quantity * price * multiplier
+        if self.max_order_notional is not None and order_notional > self.max_order_notional:
+            return f"order notional {order_notional:.0f} above {self.max_order_notional:.0f}"
+        symbol_notional = abs(after) * price * multiplier
+        if self.max_symbol_notional is not None and symbol_notional > self.max_symbol_notional:
+            return f"{contract.symbol} notional {symbol_notional:.0f} above {self.max_symbol_notional:.0f}"
+        exposure = self.exposure - self.notional.get(con_id, 0.0) + symbol_notional
+        if self.max_exposure is not None and exposure > self.max_exposure:
+            return f"exposure {exposure:.0f} above {self.max_exposure:.0f}"
+        if self.max_leverage is not None:
+            equity = self.account.equity if self.account is not None else None
+            if not equity or exposure > self.max_leverage * equity:
+                return f"exposure {exposure:.0f} above {self.max_leverage:g}x equity {equity or 0:.0f}"
+        return None
+
+    def approve(self, contract, order, price=None):
+        """Check an order and count it as working; raises RiskRejected"""
+        now = time.monotonic()
+        price = self.price(contract, order, price)
+        reason = self.check(contract, order, price, now)
+        if reason is not None:
+            self.rejected += 1
+            raise RiskRejected(reason)
+        con_id = contract.conId
+        quantity = order.totalQuantity
+        if self.bucket is not None:
+            self.bucket.take(now)
+        if price:
+            self.prices[con_id] = price
+        self.multipliers[con_id] = float(contract.multiplier or 1)
+        self.working[con_id] = self.working.get(con_id, 0) + (quantity if order.action == 'BUY' else -quantity)
+        self.open_orders += 1
+        key = (con_id, order.action, quantity)
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+        self.refresh(con_id)
+
+    def done(self, contract, order, filled, avg_fill_price=None):
+        """An approved order is done: move what filled from working to the position"""
+        con_id = contract.conId
+        quantity = order.totalQuantity
+        sign = 1 if order.action == 'BUY' else -1
+        # Added to the position from before the order; once nothing else is working
+        # position() goes back to the account, which has the fill by now
+        self.positions[con_id] = self.positions.get(con_id, 0) + sign * filled
+        self.working[con_id] -= sign * quantity
+        if avg_fill_price:
+            self.prices[con_id] = avg_fill_price
+        self.open_orders -= 1
+        key = (con_id, order.action, quantity)
+        self.in_flight[key] -= 1
+        if not self.in_flight[key]:
+            del self.in_flight[key]
+        self.refresh(con_id)
+
+    def snapshot(self):
+        return {
+            'exposure': self.exposure,
+            'open_orders': self.open_orders,
+            'rejected': self.rejected,
+            'by_symbol': {con_id: notional for con_id, notional in self.notional.items() if notional}
+        }
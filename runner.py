@@ -0,0 +1,152 @@
+from ib_async import *
+import argparse
+import asyncio
+import json
+import logging
+import TradeStrat1
+import TradeStrat2
+import TradeStrat3
+from context import TradingContext
+from gateway import WORKER_STRATEGIES, Gateway
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Strategy name used in the config -> coroutine run(ctx, contract, **params)
+STRATEGIES = {
+    'ema200': TradeStrat1.run,
+    'macd': TradeStrat2.run,
+    'donchian': TradeStrat3.run
+}
+
+def load_config(path):
+    """
+    Load a runner config:
+    {"host": "127.0.0.1", "port": 7497, "clientIds": [123, 124, 125], "max_starting": 20,
+     "metrics_file": "latency.prom", "metrics_port": 9100, "checkpoint_interval": 30,
+     "risk": {"max_exposure": 500000, "max_symbol_notional": 50000, "max_open_orders": 50},
+     "strategies": [{"strategy": "macd", "symbol": "AAPL", "params": {"fast_period": 12}}, ...]}
+    """
+    with open(path) as f:
+        config = json.load(f)
+    for entry in config['strategies']:
+        if entry['strategy'] not in STRATEGIES:
+            raise ValueError(f"Unknown strategy '{entry['strategy']}' for {entry['symbol']}")
+    return config
+
+async def run_strategy(ctx, entry, contract):
+    """Run one (strategy, symbol) pair, logging failures instead of stopping the others"""
+    name = entry['strategy']
+    try:
+        await STRATEGIES[name](ctx, contract, **entry.get('params', {}))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"{name} strategy for {contract.symbol} stopped: {e}")
+
+async def run_in_worker(ctx, gateway, entry_id, entry, contract):
+    """Hand one (strategy, symbol) pair to its worker process and forward its data until stopped"""
+    try:
+        await gateway.add(entry_id, entry, contract)
+        await ctx.stopped()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"{entry['strategy']} worker for {contract.symbol} stopped: {e}")
+
+async def log_stats(ctx, interval=60, metrics_file=None):
+    """
+    Periodically report the historical data queue, PnL by strategy, risk counters
+    and tick-to-fill latency, and write the latency metrics file if one is set.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        stats = ctx.scheduler.stats()
+        logger.info(f"Historical data queue: depth {stats['queue_depth']}, in flight {stats['in_flight']}, "
+                    f"sent {stats['sent']}, coalesced {stats['coalesced']}, "
+                    f"avg wait {stats['avg_wait']:.1f}s, max wait {stats['max_wait']:.1f}s")
+        if ctx.pnl.started:
+            for strategy, pnl in ctx.pnl.snapshot()['by_strategy'].items():
+                logger.info(f"PnL {strategy or 'untagged'}: daily {pnl['dailyPnL']:.2f}, "
+                            f"unrealized {pnl['unrealizedPnL']:.2f}, realized {pnl['realizedPnL']:.2f}")
+        risk = ctx.risk.snapshot()
+        logger.info(f"Risk: exposure {risk['exposure']:.0f}, {risk['open_orders']} orders working, "
+                    f"{risk['rejected']} rejected")
+        for (strategy, symbol, stage), latency in ctx.latency.summary().items():
+            if stage == 'tick_to_fill':
+                logger.info(f"Tick to fill {strategy} {symbol}: p50 {latency['p50'] * 1000:.1f}ms, "
+                            f"p99 {latency['p99'] * 1000:.1f}ms over {latency['count']} orders")
+        if metrics_file:
+            ctx.latency.write(metrics_file)
+
+async def run_all(ctx, entries, metrics_file=None, gateway=None):
+    """
+    Qualify every contract in one batch and run all strategies as concurrent tasks.
+    With a gateway, strategies that support it run in its worker processes.
+    """
+    contracts = await ctx.qualify(*[
+        Stock(entry['symbol'], entry.get('exchange', 'SMART'), entry.get('currency', 'USD'))
+        for entry in entries
+    ])
+    tasks = []
+    for entry, contract in zip(entries, contracts):
+        if contract is None:
+            logger.error(f"Skipping {entry['strategy']} for {entry['symbol']}: contract not qualified")
+            continue
+        ctx.pnl.tag(contract.conId, entry['strategy'])
+        if gateway is not None and entry['strategy'] in WORKER_STRATEGIES:
+            tasks.append(asyncio.ensure_future(run_in_worker(ctx, gateway, len(tasks), entry, contract)))
+        else:
+            tasks.append(asyncio.ensure_future(run_strategy(ctx, entry, contract)))
+    logger.info(f"Started {len(tasks)} strategies")
+    monitor = asyncio.ensure_future(log_stats(ctx, metrics_file=metrics_file))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        monitor.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def main(config_path, workers=0):
+    config = load_config(config_path)
+    ib = IB()
+    ctx = TradingContext(ib, max_starting=config.get('max_starting', 20), limits=config.get('risk'))
+    gateway = None
+    try:
+        # One connection shared by every strategy; ib_async throttles outgoing
+        # messages to stay under IB's 50 messages per second limit. It is
+        # re-established and resynced whenever it drops.
+        await ctx.connect(config.get('host', '127.0.0.1'), config.get('port', 7497),
+                          config.get('clientIds', [config.get('clientId', 123)]))
+        await ctx.start()
+        ctx.pnl.start()
+        ctx.checkpoints.start(config.get('checkpoint_interval', 30))
+
+        if config.get('metrics_port'):
+            await ctx.latency.serve(config['metrics_port'])
+
+        if workers:
+            gateway = Gateway(ctx, workers)
+            gateway.start()
+            ctx.connection.on_reconnect.append(gateway.resync)
+        await run_all(ctx, config['strategies'], config.get('metrics_file'), gateway)
+
+    except Exception as e:
+        logger.error(f"Fatal error occurred: {e}")
+    finally:
+        if gateway is not None:
+            gateway.close()
+        ctx.close()
+        if ib.isConnected():
+            ib.disconnect()
+            logger.info("Disconnected from IB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many strategy/symbol pairs on one IB connection")
+    parser.add_argument('config', nargs='?', default='strategies.json', help="Path to the runner config")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Run MACD and Donchian strategies in this many worker processes")
+    args = parser.parse_args()
+    asyncio.run(main(args.config, args.workers))
@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, capacity, rate):
+        """
+        Token bucket: bursts of up to `capacity` requests, refilled at `rate` tokens per second.
+        Any window of T seconds admits at most capacity + rate * T requests.
+        """
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        """Seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+
+
+class HistoricalScheduler:
+    def __init__(self, ib, capacity=30, rate=30 / 600, identical_interval=15,
+                 contract_limit=5, contract_window=2, warn_wait=30):
+        """
+        Central queue for reqHistoricalDataAsync that follows IB's pacing rules:
+        - at most 60 requests per 10 minutes (default bucket: 30 burst + 30 refilled per 600 s)
+        - no identical request within 15 seconds
+        - no more than 5 requests for the same contract within 2 seconds
+        Identical requests already queued or in flight share one call.
+        """
+        self.ib = ib
+        self.bucket = TokenBucket(capacity, rate)
+        self.identical_interval = identical_interval
+        self.contract_limit = contract_limit
+        self.contract_window = contract_window
+        self.warn_wait = warn_wait
+        self.queue = []  # heap of (priority, seq, key)
+        self.pending = {}  # key -> (contract, kwargs, future, queued_at)
+        self.last_sent = {}  # key -> monotonic time
+        self.contract_sent = {}  # conId -> deque of monotonic times
+        self.counter = itertools.count()
+        self.wake = asyncio.Event()
+        self.worker = None
+        self.tasks = set()
+        # Stats
+        self.sent = 0
+        self.coalesced = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @staticmethod
+    def key(contract, kwargs):
+        # A keepUpToDate request is its own live subscription; never share it with a one-off
+        return (contract.conId, kwargs.get('endDateTime', ''), kwargs.get('durationStr'),
+                kwargs.get('barSizeSetting'), kwargs.get('whatToShow'), kwargs.get('useRTH'),
+                kwargs.get('formatDate', 1), kwargs.get('keepUpToDate', False))
+
+    async def request(self, contract, priority=10, **kwargs):
+        """
+        Queue a historical data request and wait for its bars.
+        Lower priority numbers are sent first.
+        """
+        key = self.key(contract, kwargs)
+        if key in self.pending:
+            self.coalesced += 1
+            return await asyncio.shield(self.pending[key][2])
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = (contract, kwargs, future, time.monotonic())
+        heapq.heappush(self.queue, (priority, next(self.counter), key))
+        self.wake.set()
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.ensure_future(self._run())
+        return await asyncio.shield(future)
+
+    def _key_delay(self, key, now):
+        """Seconds until a request may be sent under the per-request and per-contract rules"""
+        delay = 0.0
+        last = self.last_sent.get(key)
+        if last is not None:
+            delay = max(delay, last + self.identical_interval - now)
+        sent = self.contract_sent.get(key[0])
+        if sent:
+            while sent and sent[0] <= now - self.contract_window:
+                sent.popleft()
+            if len(sent) >= self.contract_limit:
+                delay = max(delay, sent[0] + self.contract_window - now)
+        return delay
+
+    def _next(self, now):
+        """Pop the highest priority request that may go now, else return the time to wait"""
+        wait = self.bucket.delay(now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for entry in sorted(self.queue):
+            delay = self._key_delay(entry[2], now)
+            if delay <= 0:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                return entry[2], 0.0
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _run(self):
+        while self.queue:
+            now = time.monotonic()
+            key, wait = self._next(now)
+            if key is None:
+                # Sleep until a slot opens or a new request arrives
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.bucket.take(now)
+            self.last_sent[key] = now
+            self.contract_sent.setdefault(key[0], deque()).append(now)
+            task = asyncio.ensure_future(self._send(key, now))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, key, now):
+        contract, kwargs, future, queued_at = self.pending[key]
+        waited = now - queued_at
+        self.sent += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        if waited > self.warn_wait:
+            logger.warning(f"Historical request for {contract.symbol} waited {waited:.1f}s for pacing")
+        try:
+            bars = await self.ib.reqHistoricalDataAsync(contract, **kwargs)
+            if not future.done():
+                future.set_result(bars)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self.pending.pop(key, None)
+
+    def stats(self):
+        """Queue depth, in-flight count and wait times in seconds"""
+        return {
+            'queue_depth': len(self.queue),
+            'in_flight': len(self.pending) - len(self.queue),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'avg_wait': self.total_wait / self.sent if self.sent else 0.0,
+            'max_wait': self.max_wait
+        }
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.cancel()
+        for contract, kwargs, future, queued_at in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.queue.clear()
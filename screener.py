@@ -0,0 +1,130 @@
+from ib_async import *
+import argparse
+import asyncio
+import logging
+import numpy as np
+from context import TradingContext
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def align(universe):
+    """
+    Line up bars from many symbols on one date axis.
+    universe: {symbol: BAR_DTYPE array (as from BarStore.get)}, dates ascending.
+    Returns (dates, symbols, closes) with closes shaped (len(dates), len(symbols)):
+    a missing bar repeats the symbol's previous close, and rows before a symbol's
+    first bar are NaN.
+    """
+    symbols = list(universe)
+    dates = np.unique(np.concatenate([universe[symbol]['date'] for symbol in symbols]))
+    closes = np.full((len(dates), len(symbols)), np.nan)
+    for column, symbol in enumerate(symbols):
+        bars = universe[symbol]
+        closes[np.searchsorted(dates, bars['date']), column] = bars['close']
+    return dates, symbols, forward_fill(closes)
+
+def forward_fill(matrix):
+    """Replace NaNs in each column with the last value above them (leading NaNs stay)"""
+    rows = np.arange(len(matrix))[:, None]
+    last = np.maximum.accumulate(np.where(np.isnan(matrix), 0, rows), axis=0)
+    return matrix[last, np.arange(matrix.shape[1])]
+
+def ema_columns(closes, span):
+    """
+    EMA of every column, same as ewm(span, adjust=False) starting at each column's
+    first close. Loops over rows only; each step updates all symbols at once.
+    """
+    alpha = 2.0 / (span + 1)
+    out = np.empty_like(closes)
+    value = closes[0].copy()
+    out[0] = value
+    for row in range(1, len(closes)):
+        price = closes[row]
+        value += alpha * (price - value)
+        # Columns whose history starts here (value was NaN) begin at the close
+        fresh = np.isnan(value)
+        value[fresh] = price[fresh]
+        out[row] = value
+    return out
+
+def screen(closes, symbols, period=200, prices=None, min_bars=None):
+    """
+    TradeStrat1's signal (price above the EMA of the daily closes) for a whole universe.
+    prices: current prices in column order, defaulting to the last close.
+    min_bars: bars a symbol needs before it can signal (default `period`).
+    Returns the symbols with a signal as dicts, fresh crossovers first, then by
+    distance above the EMA.
+    """
+    min_bars = period if min_bars is None else min_bars
+    ema = ema_columns(closes, period)
+    last = closes[-1] if prices is None else np.asarray(prices, dtype=float)
+    above = last > ema[-1]
+    # Crossover: the previous close was at or below the previous EMA
+    was_above = closes[-2] > ema[-2] if len(closes) > 1 else np.zeros(len(symbols), dtype=bool)
+    bars = np.count_nonzero(~np.isnan(closes), axis=0)
+    signal = np.flatnonzero(above & (bars >= min_bars))
+    distance = last[signal] / ema[-1, signal] - 1
+    crossed = ~was_above[signal]
+    # lexsort sorts by the last key first
+    order = signal[np.lexsort((-distance, ~crossed))]
+    return [{
+        'symbol': symbols[column],
+        'price': float(last[column]),
+        'ema': float(ema[-1, column]),
+        'distance': float(last[column] / ema[-1, column] - 1),
+        'crossed': not bool(was_above[column]),
+        'bars': int(bars[column])
+    } for column in order]
+
+async def load_universe(ctx, contracts, duration='1 Y', bar_size='1 day'):
+    """Daily bars for every contract through the bar cache; symbols that fail are left out"""
+    async def load(contract):
+        try:
+            return await ctx.store.get(ctx.ib, contract, duration, bar_size, what_to_show='TRADES', use_rth=True)
+        except Exception as e:
+            logger.error(f"Could not load bars for {contract.symbol}: {e}")
+            return None
+
+    results = await asyncio.gather(*[load(contract) for contract in contracts])
+    return {contract.symbol: bars for contract, bars in zip(contracts, results)
+            if bars is not None and len(bars)}
+
+async def main(symbols, period=200, top=50):
+    ib = IB()
+    ctx = TradingContext(ib)
+    try:
+        await ib.connectAsync('127.0.0.1', 7497, clientId=123)
+        logger.info("Connected to IB")
+        contracts = await ctx.qualify(*[Stock(symbol, 'SMART', 'USD') for symbol in symbols])
+        contracts = [contract for contract in contracts if contract is not None]
+        universe = await load_universe(ctx, contracts)
+        logger.info(f"Loaded daily bars for {len(universe)} of {len(symbols)} symbols")
+
+        dates, names, closes = align(universe)
+        signals = screen(closes, names, period=period)
+        logger.info(f"{len(signals)} symbols above their EMA {period}")
+        for row in signals[:top]:
+            print(f"{row['symbol']:<8} {row['price']:>10.2f} {row['ema']:>10.2f} "
+                  f"{row['distance'] * 100:>7.2f}%{'  crossed' if row['crossed'] else ''}")
+    except Exception as e:
+        logger.error(f"Error occurred: {e}")
+    finally:
+        ctx.close()
+        if ib.isConnected():
+            ib.disconnect()
+            logger.info("Disconnected from IB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank a universe of stocks by the EMA200 trend signal")
+    parser.add_argument('symbols', nargs='*', help="Symbols to screen")
+    parser.add_argument('--file', help="File with one symbol per line")
+    parser.add_argument('--period', type=int, default=200)
+    parser.add_argument('--top', type=int, default=50, help="Number of signals to print")
+    args = parser.parse_args()
+    symbols = list(args.symbols)
+    if args.file:
+        with open(args.file) as f:
+            symbols += [line.strip() for line in f if line.strip()]
+    asyncio.run(main(symbols, args.period, args.top))
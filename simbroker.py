@@ -0,0 +1,456 @@
+from ib_async import *
+import argparse
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+from eventkit import Event
+from barcache import BAR_SECONDS, BarStore, duration_seconds
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def utc(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc)
+
+def bar_date(epoch, bar_seconds):
+    """BarData.date as IB returns it with formatDate=2: a date for daily bars, else a UTC datetime"""
+    return utc(epoch).date() if bar_seconds >= 86400 else utc(epoch)
+
+class SimIB:
+    def __init__(self, bars, cash=100000.0, latency=0.0, slippage=0.0, account='DU0000001'):
+        """
+        Simulated stand-in for ib_async.IB, covering the calls the scripts make
+        bars: {symbol: BAR_DTYPE array} of recorded bars, all of the same bar size.
+        Each recorded bar is replayed as open/high/low/close ticks on a virtual clock.
+        latency: virtual seconds from placeOrder to fill; slippage: fraction of price
+        paid on market orders.
+        """
+        self.recorded = {symbol: np.asarray(data) for symbol, data in bars.items()}
+        first = next(iter(self.recorded.values()))
+        self.base_seconds = int(np.min(np.diff(first['date']))) if len(first) > 1 else 60
+        self.cash = cash
+        self.latency = latency
+        self.slippage = slippage
+        self.account = account
+        self.now = min(int(data['date'][0]) for data in self.recorded.values())
+        self.connected = False
+        self.con_ids = {symbol: i + 1 for i, symbol in enumerate(sorted(self.recorded))}
+        self.symbols = {con_id: symbol for symbol, con_id in self.con_ids.items()}
+        self.prices = {}  # conId -> last price
+        self.forming = {}  # conId -> [start, open, high, low, close, volume] of the current recorded bar
+        self.tickers = {}  # conId -> Ticker
+        self.bar_lists = []  # keepUpToDate BarDataLists
+        self.holdings = {}  # conId -> [contract, position, avgCost, realized]
+        self.trades_ = []
+        self.fills_ = []
+        self.order_ids = itertools.count(1)
+        self.exec_ids = itertools.count(1)
+        self.timers = []  # heap of (time, seq, callback)
+        self.seq = itertools.count()
+        self.stats = {}
+        # Events the scripts may listen to
+        self.connectedEvent = Event('connectedEvent')
+        self.disconnectedEvent = Event('disconnectedEvent')
+        self.orderStatusEvent = Event('orderStatusEvent')
+        self.execDetailsEvent = Event('execDetailsEvent')
+        self.errorEvent = Event('errorEvent')
+        self.positionEvent = Event('positionEvent')
+        self.updatePortfolioEvent = Event('updatePortfolioEvent')
+        self.accountValueEvent = Event('accountValueEvent')
+
+    # Connection
+
+    async def connectAsync(self, host='127.0.0.1', port=7497, clientId=1, timeout=4, readonly=False, account=''):
+        self.connected = True
+        self.connectedEvent.emit()
+        return self
+
+    def isConnected(self):
+        return self.connected
+
+    def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self.disconnectedEvent.emit()
+
+    # Contracts
+
+    async def qualifyContractsAsync(self, *contracts, returnAll=False):
+        qualified = []
+        for contract in contracts:
+            con_id = self.con_ids.get(contract.symbol)
+            if con_id is None:
+                logger.error(f"No recorded data for {contract.symbol}")
+                continue
+            contract.conId = con_id
+            if contract.exchange == 'SMART':
+                contract.primaryExchange = contract.primaryExchange or 'NASDAQ'
+            qualified.append(contract)
+        return qualified
+
+    # Market data
+
+    def reqMktData(self, contract, genericTickList='', snapshot=False, regulatorySnapshot=False, mktDataOptions=None):
+        ticker = self.tickers.get(contract.conId)
+        if ticker is None:
+            ticker = Ticker(contract=contract)
+            self.tickers[contract.conId] = ticker
+            price = self.prices.get(contract.conId)
+            if price is not None:
+                ticker.last = ticker.close = price
+        return ticker
+
+    def cancelMktData(self, contract):
+        self.tickers.pop(contract.conId, None)
+
+    def ticker(self, contract):
+        return self.tickers.get(contract.conId)
+
+    def history(self, con_id):
+        """Recorded bars completed by now, plus the forming one built from ticks so far"""
+        data = self.recorded[self.symbols[con_id]]
+        done = data[data['date'] + self.base_seconds <= self.now]
+        forming = self.forming.get(con_id)
+        if forming is not None and forming[0] + self.base_seconds > self.now:
+            done = np.concatenate([done, np.array([tuple(forming)], dtype=data.dtype)])
+        return done
+
+    def resample(self, data, bar_seconds):
+        """Aggregate recorded bars into bars of `bar_seconds`"""
+        if not len(data):
+            return []
+        buckets = data['date'] // bar_seconds * bar_seconds
+        starts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+        ends = np.concatenate([starts[1:], [len(data)]]) - 1
+        highs = np.maximum.reduceat(data['high'], starts)
+        lows = np.minimum.reduceat(data['low'], starts)
+        volumes = np.add.reduceat(data['volume'], starts)
+        return [
+            BarData(date=bar_date(int(buckets[s]), bar_seconds), open=float(data['open'][s]),
+                    high=float(h), low=float(l), close=float(data['close'][e]), volume=float(v))
+            for s, e, h, l, v in zip(starts, ends, highs, lows, volumes)
+        ]
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime='', durationStr='1 D', barSizeSetting='1 day',
+                                     whatToShow='TRADES', useRTH=True, formatDate=1, keepUpToDate=False,
+                                     chartOptions=None, timeout=60):
+        start = self.now - duration_seconds(durationStr)
+        bar_seconds = BAR_SECONDS[barSizeSetting]
+        data = self.history(contract.conId)
+        data = data[data['date'] >= start // bar_seconds * bar_seconds]
+        bars = BarDataList(self.resample(data, bar_seconds))
+        bars.contract = contract
+        bars.barSizeSetting = barSizeSetting
+        bars.keepUpToDate = keepUpToDate
+        bars.updateEvent = Event('updateEvent')
+        if keepUpToDate:
+            self.bar_lists.append(bars)
+        return bars
+
+    def cancelHistoricalData(self, bars):
+        self.bar_lists = [b for b in self.bar_lists if b is not bars]
+
+    # Orders
+
+    def placeOrder(self, contract, order):
+        order.orderId = order.orderId or next(self.order_ids)
+        status = OrderStatus(orderId=order.orderId, status='Submitted', remaining=order.totalQuantity)
+        trade = Trade(contract=contract, order=order, orderStatus=status,
+                      log=[TradeLogEntry(utc(self.now), 'Submitted')])
+        self.trades_.append(trade)
+        if order.orderType == 'MKT':
+            self.call_later(self.latency, lambda: self.fill(trade, self.prices.get(contract.conId)))
+        return trade
+
+    def cancelOrder(self, order):
+        for trade in self.trades_:
+            if trade.order.orderId == order.orderId and not trade.isDone():
+                self.set_status(trade, 'Cancelled')
+                trade.cancelledEvent.emit(trade)
+                return trade
+
+    def set_status(self, trade, status):
+        trade.orderStatus.status = status
+        trade.log.append(TradeLogEntry(utc(self.now), status))
+        trade.statusEvent.emit(trade)
+        self.orderStatusEvent.emit(trade)
+
+    def fill(self, trade, price):
+        """Fill a whole order at `price` plus slippage and book the position"""
+        if trade.isDone():
+            return
+        if price is None:
+            self.set_status(trade, 'Inactive')
+            return
+        order = trade.order
+        sign = 1 if order.action == 'BUY' else -1
+        price *= 1 + sign * self.slippage
+        quantity = order.totalQuantity
+        execution = Execution(execId=f"sim.{next(self.exec_ids)}", time=utc(self.now), acctNumber=self.account,
+                              exchange='SIM', side='BOT' if sign > 0 else 'SLD', shares=quantity, price=price,
+                              orderId=order.orderId, cumQty=quantity, avgPrice=price)
+        fill = Fill(trade.contract, execution, CommissionReport(execId=execution.execId), utc(self.now))
+        trade.fills.append(fill)
+        self.fills_.append(fill)
+        status = trade.orderStatus
+        status.filled = quantity
+        status.remaining = 0
+        status.avgFillPrice = status.lastFillPrice = price
+        trade.fillEvent.emit(trade, fill)
+        self.execDetailsEvent.emit(trade, fill)
+        self.set_status(trade, 'Filled')
+        trade.filledEvent.emit(trade)
+        # Position and portfolio updates follow the execution, as from IB
+        self.book(trade.contract, sign * quantity, price)
+
+    def book(self, contract, quantity, price):
+        entry = self.holdings.setdefault(contract.conId, [contract, 0.0, 0.0, 0.0])
+        _, position, avg_cost, realized = entry
+        self.cash -= quantity * price
+        if position == 0 or (position > 0) == (quantity > 0):
+            avg_cost = (avg_cost * position + price * quantity) / (position + quantity)
+        else:
+            closed = min(abs(quantity), abs(position))
+            realized += closed * (price - avg_cost) * (1 if position > 0 else -1)
+            if abs(quantity) > abs(position):
+                avg_cost = price
+        entry[1:] = [position + quantity, avg_cost, realized]
+        self.publish_account(contract.conId)
+
+    def publish_account(self, con_id):
+        """Send the position, portfolio and account updates IB streams after a fill"""
+        contract, position, avg_cost, realized = self.holdings[con_id]
+        price = self.prices.get(con_id, avg_cost)
+        self.positionEvent.emit(Position(self.account, contract, position, avg_cost))
+        self.updatePortfolioEvent.emit(PortfolioItem(contract, position, price, position * price, avg_cost,
+                                                     position * (price - avg_cost), realized, self.account))
+        for value in self.accountValues():
+            self.accountValueEvent.emit(value)
+
+    # Account
+
+    def net_liquidation(self):
+        return self.cash + sum(p[1] * self.prices.get(con_id, p[2]) for con_id, p in self.holdings.items())
+
+    def portfolio(self, account=''):
+        items = []
+        for con_id, (contract, position, avg_cost, realized) in self.holdings.items():
+            if position == 0:
+                continue
+            price = self.prices.get(con_id, avg_cost)
+            items.append(PortfolioItem(contract, position, price, position * price, avg_cost,
+                                       position * (price - avg_cost), realized, self.account))
+        return items
+
+    def positions(self, account=''):
+        return [Position(self.account, contract, position, avg_cost)
+                for contract, position, avg_cost, _ in self.holdings.values() if position != 0]
+
+    async def reqPositionsAsync(self):
+        return self.positions()
+
+    def accountValues(self, account=''):
+        net = self.net_liquidation()
+        return [AccountValue(self.account, tag, f"{value:.2f}", 'USD', '') for tag, value in (
+            ('NetLiquidation', net), ('TotalCashValue', self.cash), ('BuyingPower', max(net, 0) * 4),
+            ('AvailableFunds', self.cash))]
+
+    async def reqAccountUpdatesAsync(self, account=''):
+        return None
+
+    async def accountSummaryAsync(self, account=''):
+        return self.accountValues(account)
+
+    async def reqAccountSummaryAsync(self):
+        return self.accountValues()
+
+    async def reqExecutionsAsync(self, execFilter=None):
+        return list(self.fills_)
+
+    def fills(self):
+        return list(self.fills_)
+
+    def trades(self):
+        return list(self.trades_)
+
+    def openTrades(self):
+        return [trade for trade in self.trades_ if not trade.isDone()]
+
+    # Virtual clock
+
+    def call_later(self, delay, callback):
+        heapq.heappush(self.timers, (self.now + delay, next(self.seq), callback))
+
+    async def sleep(self, delay, result=None):
+        """asyncio.sleep on the virtual clock"""
+        if delay <= 0:
+            await self._real_sleep(0)
+            return result
+        future = asyncio.get_running_loop().create_future()
+        self.call_later(delay, lambda: future.done() or future.set_result(None))
+        await future
+        return result
+
+    def ticks(self):
+        """Recorded bars as (time, conId, price, volume, bar start) ticks in time order"""
+        events = []
+        for symbol, data in self.recorded.items():
+            con_id = self.con_ids[symbol]
+            up = data['close'] >= data['open']
+            # Open at the bar start, then the extreme hit first, then the other, then the close
+            first = np.where(up, data['low'], data['high'])
+            second = np.where(up, data['high'], data['low'])
+            step = self.base_seconds / 4
+            for k, prices in enumerate((data['open'], first, second, data['close'])):
+                events.append(np.rec.fromarrays([
+                    data['date'] + k * step, np.full(len(data), con_id), prices,
+                    data['volume'] / 4, data['date']
+                ], names='time,conId,price,volume,start'))
+        events = np.concatenate(events)
+        return events[np.argsort(events['time'], kind='stable')]
+
+    def on_tick(self, con_id, price, volume, start):
+        self.prices[con_id] = price
+        forming = self.forming.get(con_id)
+        if forming is None or forming[0] != start:
+            if forming is not None:
+                previous_close = forming[4]
+                ticker = self.tickers.get(con_id)
+                if ticker is not None:
+                    ticker.close = previous_close
+            self.forming[con_id] = [start, price, price, price, price, volume]
+        else:
+            forming[2] = max(forming[2], price)
+            forming[3] = min(forming[3], price)
+            forming[4] = price
+            forming[5] += volume
+        ticker = self.tickers.get(con_id)
+        if ticker is not None:
+            ticker.last = price
+            ticker.lastSize = volume
+            ticker.time = utc(self.now)
+            ticker.ticks = [TickData(ticker.time, 4, price, volume)]
+            ticker.updateEvent.emit(ticker)
+        for bars in self.bar_lists:
+            if bars.contract.conId == con_id:
+                self.update_bars(bars, price, volume)
+
+    def update_bars(self, bars, price, volume):
+        bar_seconds = BAR_SECONDS[bars.barSizeSetting]
+        start = int(self.now) // bar_seconds * bar_seconds
+        date = bar_date(start, bar_seconds)
+        if bars and bars[-1].date == date:
+            bar = bars[-1]
+            bar.high = max(bar.high, price)
+            bar.low = min(bar.low, price)
+            bar.close = price
+            bar.volume += volume
+            bars.updateEvent.emit(bars, False)
+        else:
+            bars.append(BarData(date=date, open=price, high=price, low=price, close=price, volume=volume))
+            bars.updateEvent.emit(bars, True)
+
+    def warm_up(self, start):
+        """Move the clock to `start` so recorded bars before it count as history"""
+        self.now = start
+        for symbol, data in self.recorded.items():
+            done = data[data['date'] + self.base_seconds <= start]
+            if len(done):
+                self.prices[self.con_ids[symbol]] = float(done['close'][-1])
+
+    async def replay(self, *coros, start=None, settle=10):
+        """
+        Run coroutines against the recorded data, fast-forwarding the virtual clock through
+        every tick and every asyncio.sleep. Data before `start` (epoch seconds) is only
+        history. When the data runs out the connection is dropped, which ends strategies
+        waiting on disconnectedEvent. Returns the coroutines' results.
+        """
+        ticks = self.ticks()
+        if start is not None:
+            self.warm_up(start)
+            ticks = ticks[ticks['time'] >= start]
+        self._real_sleep = asyncio.sleep
+        asyncio.sleep = self.sleep
+        started = time.perf_counter()
+        processed = 0
+        try:
+            tasks = [asyncio.ensure_future(coro) for coro in coros]
+            while not all(task.done() for task in tasks):
+                for _ in range(settle):
+                    await self._real_sleep(0)
+                next_tick = ticks['time'][processed] if processed < len(ticks) else None
+                next_timer = self.timers[0][0] if self.timers else None
+                if next_tick is None and self.connected:
+                    # Out of data: drop the connection and let the strategies wind down
+                    self.disconnect()
+                    continue
+                if next_tick is None and next_timer is None:
+                    break
+                if next_timer is not None and (next_tick is None or next_timer <= next_tick):
+                    self.now, _, callback = heapq.heappop(self.timers)
+                    callback()
+                else:
+                    tick = ticks[processed]
+                    self.now = tick['time']
+                    self.on_tick(int(tick['conId']), float(tick['price']), float(tick['volume']), int(tick['start']))
+                    processed += 1
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            asyncio.sleep = self._real_sleep
+        wall = time.perf_counter() - started
+        self.stats = {
+            'ticks': processed,
+            'orders': len(self.trades_),
+            'fills': len(self.fills_),
+            'wall_seconds': wall,
+            'ticks_per_second': processed / wall if wall > 0 else 0.0,
+            'net_liquidation': self.net_liquidation()
+        }
+        return results
+
+def load_recording(directory):
+    """Load {SYMBOL}.npy bar files (BAR_DTYPE) from a directory"""
+    return {
+        os.path.splitext(name)[0]: np.load(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory)) if name.endswith('.npy')
+    }
+
+async def main(config_path, data_dir, cash, warmup_days):
+    import runner
+    from context import TradingContext
+    from checkpoint import CheckpointStore
+    from contractcache import ContractCache
+    from subscriptions import SubscriptionManager
+    config = runner.load_config(config_path)
+    ib = SimIB(load_recording(data_dir), cash=cash)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # No pacing queue for the bar cache or subscriptions: simulated history requests
+        # are instant, and the queue's wall-clock pacing would stall the virtual clock.
+        # Simulated conIds and strategy states must not end up in the live caches
+        ctx = TradingContext(ib, store=BarStore(cache_dir), subscriptions=SubscriptionManager(ib),
+                             contracts=ContractCache(os.path.join(cache_dir, 'contracts.json')),
+                             checkpoints=CheckpointStore(os.path.join(cache_dir, 'checkpoint.json')))
+        await ib.connectAsync()
+        await ctx.start()
+        await ib.replay(runner.run_all(ctx, config['strategies']), start=ib.now + warmup_days * 86400)
+        ctx.close()
+    logger.info(f"Replay finished: {ib.stats}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay strategies against recorded bars")
+    parser.add_argument('config', help="Runner config (see strategies.json)")
+    parser.add_argument('data', help="Directory of {SYMBOL}.npy bar files")
+    parser.add_argument('--cash', type=float, default=100000.0)
+    parser.add_argument('--warmup-days', type=float, default=0, help="Recorded days used only as history")
+    args = parser.parse_args()
+    asyncio.run(main(args.config, args.data, args.cash, args.warmup_days))
@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+from ib_async import MarketOrder
+
+logger = logging.getLogger(__name__)
+
+class Stop:
+    __slots__ = ('key', 'contract', 'action', 'quantity', 'trigger', 'on_exit', 'exiting')
+
+    def __init__(self, key, contract, action, quantity, trigger, on_exit=None):
+        """Exit `quantity` with a market `action` order (SELL closes a long) once price crosses `trigger`"""
+        self.key = key
+        self.contract = contract
+        self.action = action
+        self.quantity = quantity
+        self.trigger = trigger
+        self.on_exit = on_exit
+        self.exiting = False
+
+
+class StopEngine:
+    def __init__(self, orders, latency=None):
+        """
+        Stop orders held locally for any number of positions and checked on every tick.
+        Each contract has two heaps keyed by trigger price: SELL stops with the highest
+        trigger on top and BUY stops with the lowest, so a tick only looks at the top
+        of each heap and costs O(1) unless something fires. Trailing pushes a new
+        entry; superseded entries are dropped when they reach the top.
+        orders: OrderManager (or anything with its place() and wait()) used for the exits.
+        """
+        self.orders = orders
+        self.latency = latency
+        self.stops = {}  # key -> Stop, armed or exiting
+        self.books = {}  # conId -> (SELL heap of (-trigger, seq, Stop), BUY heap of (trigger, seq, Stop))
+        self.seq = itertools.count()
+        self.watched = {}  # conId -> number of watch() calls
+        self.subscriptions = None
+        self.tasks = set()
+
+    def get(self, key):
+        return self.stops.get(key)
+
+    def set(self, key, contract, action, quantity, trigger, on_exit=None):
+        """
+        Arm (or replace) the stop under `key`. Ignored while the key's exit order is
+        working, so a position being closed is not closed twice.
+        on_exit(result): called with the OrderManager result once the exit fills.
+        """
+        stop = self.stops.get(key)
+        if stop is not None and stop.exiting:
+            return stop
+        if stop is not None:
+            stop.quantity = 0  # supersedes its heap entries
+        stop = Stop(key, contract, action, quantity, trigger, on_exit)
+        self.stops[key] = stop
+        self.push(stop)
+        return stop
+
+    def push(self, stop):
+        if math.isnan(stop.trigger):
+            return  # no stop level yet; trail() arms it
+        sells, buys = self.books.setdefault(stop.contract.conId, ([], []))
+        if stop.action == 'SELL':
+            heap, entry = sells, (-stop.trigger, next(self.seq), stop)
+        else:
+            heap, entry = buys, (stop.trigger, next(self.seq), stop)
+        heapq.heappush(heap, entry)
+        if len(heap) > 64 and len(heap) > 4 * len(self.stops):
+            self.compact(heap)
+
+    @staticmethod
+    def current(entry):
+        """Whether a heap entry still describes its stop"""
+        trigger, _, stop = entry
+        return stop.quantity > 0 and not stop.exiting and abs(trigger) == stop.trigger
+
+    def compact(self, heap):
+        heap[:] = [entry for entry in heap if self.current(entry)]
+        heapq.heapify(heap)
+
+    def trail(self, key, trigger):
+        """Move a stop's trigger, only ever in the position's favour; True if it moved"""
+        stop = self.stops.get(key)
+        if stop is None or stop.exiting or math.isnan(trigger):
+            return False
+        if math.isnan(stop.trigger) or (trigger > stop.trigger if stop.action == 'SELL' else trigger < stop.trigger):
+            stop.trigger = trigger
+            self.push(stop)
+            return True
+        return False
+
+    def cancel(self, key):
+        """Disarm a stop; an exit already working is not cancelled"""
+        stop = self.stops.get(key)
+        if stop is not None and not stop.exiting:
+            del self.stops[key]
+            stop.quantity = 0
+        return stop
+
+    def check(self, con_id, low, high):
+        """Fire every stop on the contract crossed by prices between low and high"""
+        book = self.books.get(con_id)
+        if book is None:
+            return
+        sells, buys = book
+        while sells:
+            entry = sells[0]
+            if not self.current(entry):
+                heapq.heappop(sells)
+            elif low < entry[2].trigger:
+                heapq.heappop(sells)
+                self.fire(entry[2], low)
+            else:
+                break
+        while buys:
+            entry = buys[0]
+            if not self.current(entry):
+                heapq.heappop(buys)
+            elif high > entry[2].trigger:
+                heapq.heappop(buys)
+                self.fire(entry[2], high)
+            else:
+                break
+
+    def on_tick(self, ticker):
+        price = ticker.last if ticker.last else ticker.close
+        if price is not None and price == price:
+            self.check(ticker.contract.conId, price, price)
+
+    def fire(self, stop, price):
+        stop.exiting = True
+        logger.info(f"Stop {stop.key} hit at {price:.2f} (stop {stop.trigger:.2f}): "
+                    f"{stop.action} {stop.quantity} {stop.contract.symbol}")
+        task = asyncio.ensure_future(self.exit(stop, price))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def exit(self, stop, price):
+        trace = self.latency.trace('stops', stop.contract.symbol) if self.latency is not None else None
+        if trace is not None:
+            trace.mark('signal')
+        try:
+            result = await self.orders.place(stop.contract, MarketOrder(stop.action, stop.quantity),
+                                             reference_price=price, trace=trace)
+        except Exception as e:
+            logger.error(f"Stop exit for {stop.contract.symbol} failed: {e}")
+            result = {'status': 'Error', 'filled': 0.0}
+        while result['status'] == 'Timeout':
+            # The exit may still fill; the stop stays exiting so no second exit goes out next to it
+            logger.warning(f"Stop exit for {stop.contract.symbol} still working with {result['filled']:g} filled")
+            result = await self.orders.wait(result['trade'], reference_price=price)
+        if self.stops.get(stop.key) is stop:
+            del self.stops[stop.key]
+        if result['status'] == 'Filled':
+            logger.info(f"Stop exit for {stop.contract.symbol} filled at {result['avg_fill_price']}")
+            if stop.on_exit is not None:
+                stop.on_exit(result)
+            return
+        # Cancelled or rejected and still exposed: re-arm for the rest so the next tick
+        # through the stop tries again
+        remaining = stop.quantity - (result['filled'] or 0)
+        logger.error(f"Stop exit for {stop.contract.symbol} ended {result['status']}, re-arming for {remaining}")
+        if remaining > 0 and stop.key not in self.stops:
+            self.set(stop.key, stop.contract, stop.action, remaining, stop.trigger, stop.on_exit)
+
+    def watch(self, subscriptions, contract):
+        """Check the contract's stops on every tick of its (shared) market data"""
+        con_id = contract.conId
+        if not self.watched.get(con_id):
+            subscriptions.market_data(contract, on_tick=self.on_tick)
+            self.watched[con_id] = 0
+        self.watched[con_id] += 1
+        self.subscriptions = subscriptions
+
+    def unwatch(self, contract):
+        con_id = contract.conId
+        if not self.watched.get(con_id):
+            return
+        self.watched[con_id] -= 1
+        if not self.watched[con_id]:
+            del self.watched[con_id]
+            self.subscriptions.release_market_data(contract, on_tick=self.on_tick)
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
@@ -0,0 +1,365 @@
+import asyncio
+import logging
+import time
+from barbuilder import TRADE_TICKS, BarBuilder
+from barcache import delta_duration
+
+logger = logging.getLogger(__name__)
+
+class SubscriptionManager:
+    def __init__(self, ib, scheduler=None):
+        """
+        Reference-counted market data and bar subscriptions
+        Each contract is subscribed once no matter how many strategies use it, and the
+        subscription is cancelled when the last user releases it.
+        Historical requests (seeding, resubscribing, backfill) go through the pacing
+        scheduler when one is given.
+        """
+        self.ib = ib
+        self.scheduler = scheduler
+        self.tickers = {}  # conId -> Ticker
+        self.ticker_refs = {}
+        self.bar_lists = {}  # (conId, barSize, whatToShow, useRTH) -> BarDataList
+        self.bar_refs = {}
+        self.handlers = {}  # (key, callback) -> connected event handler
+        self.pending = {}  # key -> in-flight request that concurrent subscribers share
+        self.builders = {}  # (conId, barSize, source, useRTH) -> BarBuilder
+        self.builder_refs = {}
+        self.streams = {}  # (conId, source) -> BarBuilders fed by that contract's ticks or real-time bars
+        self.flusher = None
+        self.tasks = set()
+
+    def dispatch(self, callback, *args):
+        """Call a handler; coroutine handlers are scheduled as tasks"""
+        try:
+            result = callback(*args)
+        except Exception as e:
+            logger.error(f"Error in subscription callback: {e}")
+            return
+        if asyncio.iscoroutine(result):
+            task = asyncio.ensure_future(result)
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    def connect(self, event, key, callback, new_bar_only=False):
+        def handler(*args):
+            # Bar lists emit (bars, hasNewBar); tickers emit (ticker,)
+            if new_bar_only and not args[1]:
+                return
+            self.dispatch(callback, args[0])
+        self.handlers[(key, callback)] = handler
+        event += handler
+
+    def disconnect(self, event, key, callback):
+        handler = self.handlers.pop((key, callback), None)
+        if handler is not None:
+            event -= handler
+
+    async def shared(self, key, request, *args, **kwargs):
+        """Await request(*args, **kwargs), sharing one call between concurrent callers with the same key"""
+        future = self.pending.get(key)
+        if future is None:
+            future = self.pending[key] = asyncio.ensure_future(request(*args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        finally:
+            # The first caller back clears it, before any other caller can run
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    async def historical(self, contract, **kwargs):
+        if self.scheduler is not None:
+            return await self.scheduler.request(contract, **kwargs)
+        return await self.ib.reqHistoricalDataAsync(contract, **kwargs)
+
+    def market_data(self, contract, on_tick=None):
+        """Subscribe to streaming quotes; on_tick(ticker) runs on every update"""
+        con_id = contract.conId
+        if con_id not in self.tickers:
+            self.tickers[con_id] = self.ib.reqMktData(contract, '', False, False)
+            self.ticker_refs[con_id] = 0
+            logger.info(f"Subscribed market data for {contract.symbol}")
+        self.ticker_refs[con_id] += 1
+        ticker = self.tickers[con_id]
+        if on_tick is not None:
+            self.connect(ticker.updateEvent, con_id, on_tick)
+        return ticker
+
+    def release_market_data(self, contract, on_tick=None):
+        """Drop one reference; the market data line is freed with the last one"""
+        con_id = contract.conId
+        if con_id not in self.tickers:
+            return
+        ticker = self.tickers[con_id]
+        if on_tick is not None:
+            self.disconnect(ticker.updateEvent, con_id, on_tick)
+        self.ticker_refs[con_id] -= 1
+        if self.ticker_refs[con_id] <= 0:
+            self.ib.cancelMktData(ticker.contract)
+            del self.tickers[con_id]
+            del self.ticker_refs[con_id]
+            logger.info(f"Cancelled market data for {contract.symbol}")
+
+    async def bars(self, contract, duration, bar_size, on_bar=None, what_to_show='TRADES', use_rth=True):
+        """
+        Subscribe to historical bars kept up to date by IB (keepUpToDate=True).
+        on_bar(bars) runs each time a bar closes, i.e. when IB starts a new one;
+        bars[-2] is then the bar that just closed and bars[-1] the one forming.
+        """
+        key = (contract.conId, bar_size, what_to_show, bool(use_rth))
+        if key not in self.bar_lists:
+            bars = await self.shared(
+                key,
+                self.historical,
+                contract,
+                endDateTime='',
+                durationStr=duration,
+                barSizeSetting=bar_size,
+                whatToShow=what_to_show,
+                useRTH=use_rth,
+                formatDate=2,
+                keepUpToDate=True
+            )
+            if key not in self.bar_lists:  # the first of several concurrent callers
+                self.bar_lists[key] = bars
+                self.bar_refs[key] = 0
+                logger.info(f"Subscribed {bar_size} bars for {contract.symbol}")
+        self.bar_refs[key] += 1
+        bars = self.bar_lists[key]
+        if on_bar is not None:
+            self.connect(bars.updateEvent, key, on_bar, new_bar_only=True)
+        return bars
+
+    def release_bars(self, contract, bar_size, on_bar=None, what_to_show='TRADES', use_rth=True):
+        key = (contract.conId, bar_size, what_to_show, bool(use_rth))
+        if key not in self.bar_lists:
+            return
+        bars = self.bar_lists[key]
+        if on_bar is not None:
+            self.disconnect(bars.updateEvent, key, on_bar)
+        self.bar_refs[key] -= 1
+        if self.bar_refs[key] <= 0:
+            self.ib.cancelHistoricalData(bars)
+            del self.bar_lists[key]
+            del self.bar_refs[key]
+            logger.info(f"Cancelled {bar_size} bars for {contract.symbol}")
+
+    def real_time_bars(self, contract, on_bar, what_to_show='TRADES', use_rth=True):
+        """Subscribe to 5-second real-time bars; on_bar(bars) runs with bars[-1] the bar just completed"""
+        key = (contract.conId, 'realtime', what_to_show, bool(use_rth))
+        if key not in self.bar_lists:
+            self.bar_lists[key] = self.ib.reqRealTimeBars(contract, 5, what_to_show, use_rth)
+            self.bar_refs[key] = 0
+        self.bar_refs[key] += 1
+        bars = self.bar_lists[key]
+        self.connect(bars.updateEvent, key, on_bar)
+        return bars
+
+    def release_real_time_bars(self, contract, on_bar, what_to_show='TRADES', use_rth=True):
+        key = (contract.conId, 'realtime', what_to_show, bool(use_rth))
+        if key not in self.bar_lists:
+            return
+        bars = self.bar_lists[key]
+        self.disconnect(bars.updateEvent, key, on_bar)
+        self.bar_refs[key] -= 1
+        if self.bar_refs[key] <= 0:
+            self.ib.cancelRealTimeBars(bars)
+            del self.bar_lists[key]
+            del self.bar_refs[key]
+
+    async def local_bars(self, contract, duration, bar_size, on_bar=None, use_rth=True, source='ticks', session=None):
+        """
+        Bars built locally, with the same list and on_bar(bars) semantics as bars().
+        They are seeded once with `duration` of history; every later bar is built from
+        the contract's trade ticks (source='ticks') or 5-second real-time bars
+        (source='realtime') and passed to on_bar the moment it closes, without another
+        historical request. All bar sizes of a contract share one stream.
+        session: barbuilder.Session for regular hours (default US equities).
+        """
+        key = (contract.conId, bar_size, source, bool(use_rth))
+        if key not in self.builders:
+            builder = await self.shared(key, self.seed_builder, contract, duration, bar_size, use_rth, session)
+            if key not in self.builders:  # the first of several concurrent callers
+                self.builders[key] = builder
+                self.builder_refs[key] = 0
+                stream = self.streams.setdefault((contract.conId, source), [])
+                if not stream:
+                    if source == 'ticks':
+                        self.market_data(contract, on_tick=self.on_trades)
+                    else:
+                        # Real-time bars outside regular hours too; each builder filters for itself
+                        self.real_time_bars(contract, self.on_real_time_bar, use_rth=False)
+                stream.append(builder)
+                if self.flusher is None and getattr(self.ib, 'wrapper', None) is not None:
+                    # Simulated clocks have no wall time; their bars close on the next trade
+                    self.flusher = asyncio.ensure_future(self.flush_bars())
+                logger.info(f"Building {bar_size} bars for {contract.symbol} from {source}")
+        self.builder_refs[key] += 1
+        bars = self.builders[key].bars
+        if on_bar is not None:
+            self.connect(bars.updateEvent, key, on_bar, new_bar_only=True)
+        return bars
+
+    async def seed_builder(self, contract, duration, bar_size, use_rth, session):
+        builder = BarBuilder(bar_size, session, use_rth)
+        builder.bars.contract = contract
+        builder.merge(await self.historical(
+            contract,
+            endDateTime='',
+            durationStr=duration,
+            barSizeSetting=bar_size,
+            whatToShow='TRADES',
+            useRTH=use_rth,
+            formatDate=2
+        ))
+        return builder
+
+    def release_local_bars(self, contract, bar_size, on_bar=None, use_rth=True, source='ticks'):
+        key = (contract.conId, bar_size, source, bool(use_rth))
+        if key not in self.builders:
+            return
+        builder = self.builders[key]
+        if on_bar is not None:
+            self.disconnect(builder.bars.updateEvent, key, on_bar)
+        self.builder_refs[key] -= 1
+        if self.builder_refs[key] <= 0:
+            del self.builders[key]
+            del self.builder_refs[key]
+            stream = self.streams[(contract.conId, source)]
+            stream.remove(builder)
+            if not stream:
+                del self.streams[(contract.conId, source)]
+                if source == 'ticks':
+                    self.release_market_data(contract, on_tick=self.on_trades)
+                else:
+                    self.release_real_time_bars(contract, self.on_real_time_bar, use_rth=False)
+            logger.info(f"Stopped building {bar_size} bars for {contract.symbol}")
+
+    def on_trades(self, ticker):
+        builders = self.streams.get((ticker.contract.conId, 'ticks'))
+        if not builders:
+            return
+        for tick in ticker.ticks:
+            if tick.tickType in TRADE_TICKS and tick.price > 0:
+                t = tick.time.timestamp()
+                for builder in builders:
+                    builder.add(t, tick.price, tick.price, tick.price, tick.price, tick.size)
+
+    def on_real_time_bar(self, bars):
+        builders = self.streams.get((bars.contract.conId, 'realtime'))
+        if not builders:
+            return
+        bar = bars[-1]
+        t = bar.time.timestamp()
+        for builder in builders:
+            builder.add(t, bar.open_, bar.high, bar.low, bar.close, bar.volume, end=t + bars.barSize)
+
+    async def flush_bars(self):
+        """Close tick-built bars when their time is up, even if no trade follows"""
+        while True:
+            now = time.time()
+            ends = []
+            for (_, _, source, _), builder in list(self.builders.items()):
+                # A real-time bar ending on the boundary closes its bar itself
+                if source == 'ticks' and not builder.flush(now) and builder.end is not None:
+                    ends.append(builder.end)
+            await asyncio.sleep(min([end - now for end in ends if end > now] + [1.0]))
+
+    async def resubscribe(self):
+        """
+        Re-request every subscription after a reconnect, all at once. ib_async drops its
+        subscription state on disconnect; the Ticker and bar list objects handed out
+        before are registered with it again, so strategies' handlers and references
+        keep working without re-seeding. Bars that closed while disconnected are passed
+        to the on_bar handlers in order.
+        """
+        wrapper = getattr(self.ib, 'wrapper', None)
+        if wrapper is None:
+            return  # the simulator keeps its subscriptions across reconnects
+        for ticker in self.tickers.values():
+            # reqMktData reuses the Ticker ib_async holds for the contract
+            wrapper.tickers[hash(ticker.contract)] = ticker
+            self.ib.reqMktData(ticker.contract, '', False, False)
+        keys = list(self.bar_lists)
+        results = await asyncio.gather(*[self.resubscribe_bars(key) for key in keys], return_exceptions=True)
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                logger.error(f"Resubscribing {key[1]} bars for conId {key[0]} failed: {result}")
+        keys = list(self.builders)
+        results = await asyncio.gather(*[self.backfill(key) for key in keys], return_exceptions=True)
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                logger.error(f"Backfilling local {key[1]} bars for conId {key[0]} failed: {result}")
+        logger.info(f"Resubscribed market data for {len(self.tickers)} contracts and {len(self.bar_lists)} bar series")
+
+    async def resubscribe_bars(self, key):
+        old = self.bar_lists[key]
+        wrapper = self.ib.wrapper
+        if key[1] == 'realtime':
+            new = self.ib.reqRealTimeBars(old.contract, old.barSize, old.whatToShow, old.useRTH)
+        else:
+            new = await self.historical(
+                old.contract,
+                endDateTime='',
+                durationStr=old.durationStr,
+                barSizeSetting=old.barSizeSetting,
+                whatToShow=old.whatToShow,
+                useRTH=old.useRTH,
+                formatDate=old.formatDate,
+                keepUpToDate=True
+            )
+        # Route the new request's updates to the list strategies already hold
+        old.reqId = new.reqId
+        wrapper.startSubscription(new.reqId, old, old.contract)
+        if key[1] == 'realtime':
+            return
+        last = old[-2].date if len(old) > 1 else None
+        missed = [i for i in range(len(new) - 1) if last is None or new[i].date > last]
+        old[:] = new
+        callbacks = [callback for handler_key, callback in self.handlers if handler_key == key]
+        for i in missed:
+            for callback in callbacks:
+                self.dispatch(callback, old[:i + 2])
+
+    async def backfill(self, key):
+        """Add the local bars that closed while disconnected from history, passing them to on_bar in order"""
+        builder = self.builders[key]
+        bars = builder.bars
+        if not bars:
+            return
+        last = builder.closed if builder.closed is not None else builder.start
+        history = await self.historical(
+            bars.contract,
+            endDateTime='',
+            durationStr=delta_duration(last, key[1]),
+            barSizeSetting=key[1],
+            whatToShow='TRADES',
+            useRTH=key[3],
+            formatDate=2
+        )
+        callbacks = [callback for handler_key, callback in self.handlers if handler_key == key]
+        for i in builder.merge(history):
+            for callback in callbacks:
+                self.dispatch(callback, bars[:i + 2])
+
+    def close(self):
+        """Cancel every subscription still open"""
+        for ticker in self.tickers.values():
+            self.ib.cancelMktData(ticker.contract)
+        for (con_id, bar_size, _, _), bars in self.bar_lists.items():
+            if bar_size == 'realtime':
+                self.ib.cancelRealTimeBars(bars)
+            else:
+                self.ib.cancelHistoricalData(bars)
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        self.tickers.clear()
+        self.ticker_refs.clear()
+        self.builders.clear()
+        self.builder_refs.clear()
+        self.streams.clear()
+        self.bar_lists.clear()
+        self.bar_refs.clear()
+        self.pending.clear()
+        self.handlers.clear()